@@ -0,0 +1,170 @@
+#!/usr/bin/python3
+"""Characterise an HC-SR04 from a raw capture made with hc_sr04.py.
+
+For hundreds of thousands of pulses, so everything is done on whole NumPy
+arrays, never pulse by pulse. Reports:
+- how many pulses got an echo, and how many timed out, and why.
+- the pulse rate achieved and the delay from trigger to echo.
+- the distribution of distances: percentiles and a histogram.
+- the noise floor: the spread of the difference between consecutive
+  readings in range. With the target still this is the sensor's own noise. It's
+  barely affected by the target moving slowly, unlike the plain standard
+  deviation.
+- the range: the nearest and furthest distances seen, and how many
+  pulses fall outside the range DistanceSensor accepts.
+
+Usage:
+    python3 hc_sr04.py capture.bin -n 300000
+    python3 analyse_capture.py capture.bin
+"""
+
+import argparse
+import json
+
+import numpy as np
+
+import hc_sr04
+from hc_sr04 import DistanceSensor
+
+SPEED_OF_SOUND = 343000  # mm/s, as hc_sr04.
+
+# hc_sr04.CAPTURE_RECORD as a NumPy type.
+RECORD_DTYPE = np.dtype([('trigger', '<f8'), ('rise', '<f8'),
+                         ('fall', '<f8'), ('status', 'u1')])
+
+PERCENTILES = (0, 1, 5, 25, 50, 75, 95, 99, 100)
+
+
+class CaptureError(Exception):
+    """Not a capture file this can read."""
+    pass
+
+
+def load(path):
+    """Return the records in a capture file as a NumPy structured array."""
+    with open(path, 'rb') as f:
+        header = f.read(hc_sr04.CAPTURE_HEADER.size)
+    if len(header) < hc_sr04.CAPTURE_HEADER.size:
+        raise CaptureError(f'{path}: too short for a capture file')
+    magic, version, record_size = hc_sr04.CAPTURE_HEADER.unpack(header)
+    if magic != hc_sr04.CAPTURE_MAGIC:
+        raise CaptureError(f'{path}: not a capture file')
+    if version != hc_sr04.CAPTURE_VERSION or \
+            record_size != RECORD_DTYPE.itemsize:
+        raise CaptureError(f'{path}: capture format {version} with '
+                           f'{record_size} byte records not supported')
+    records = np.fromfile(path, dtype=RECORD_DTYPE,
+                          offset=hc_sr04.CAPTURE_HEADER.size)
+    return records
+
+
+def noise_floor(distances):
+    """Estimate the sensor noise (a standard deviation, in mm).
+
+    From consecutive differences: each is the difference of two
+    independent noisy readings, so has sqrt(2) times the noise. The median
+    absolute deviation times 1.4826 estimates a standard deviation, but
+    ignores the odd wild reading.
+    """
+    if len(distances) < 2:
+        return float('nan')
+    diffs = np.diff(distances)
+    mad = np.median(np.abs(diffs - np.median(diffs)))
+    return float(1.4826 * mad / np.sqrt(2))
+
+
+def analyse(records, dist_min=None, dist_max=None, bins=20):
+    """Return a dict characterising the pulses in records.
+
+    dist_min and dist_max default to DistanceSensor's.
+    """
+    sensor = DistanceSensor()
+    dist_min = sensor.DIST_MIN if dist_min is None else dist_min
+    dist_max = sensor.DIST_MAX if dist_max is None else dist_max
+
+    status = records['status']
+    ok = status == hc_sr04.CAPTURE_OK
+    echoes = records[ok]
+    distances = SPEED_OF_SOUND * (echoes['fall'] - echoes['rise']) / 2
+    results = {
+        'pulses': len(records),
+        'echoes': int(ok.sum()),
+        'no_rise': int((status == hc_sr04.CAPTURE_NO_RISE).sum()),
+        'no_fall': int((status == hc_sr04.CAPTURE_NO_FALL).sum()),
+    }
+    if len(records) > 1:
+        duration = records['trigger'][-1] - records['trigger'][0]
+        results['duration'] = float(duration)
+        results['pulse_rate'] = float((len(records) - 1) / duration) \
+            if duration > 0 else float('nan')
+    if not len(distances):
+        return results
+
+    delays = echoes['rise'] - echoes['trigger']
+    in_range = (distances >= dist_min) & (distances <= dist_max)
+    counts, edges = np.histogram(distances, bins=bins)
+    results.update({
+        'rise_delay_median': float(np.median(delays)),
+        'rise_delay_max': float(delays.max()),
+        'mean': float(distances.mean()),
+        'std': float(distances.std()),
+        'percentiles': dict(zip(
+            PERCENTILES,
+            (float(p) for p in np.percentile(distances, PERCENTILES)))),
+        'noise_floor': noise_floor(distances[in_range]),
+        'min': float(distances.min()),
+        'max': float(distances.max()),
+        'min_in_range': float(distances[in_range].min())
+        if in_range.any() else None,
+        'max_in_range': float(distances[in_range].max())
+        if in_range.any() else None,
+        'too_close': int((distances < dist_min).sum()),
+        'too_far': int((distances > dist_max).sum()),
+        'histogram': list(zip(edges[:-1].tolist(), counts.tolist())),
+    })
+    return results
+
+
+def report(results):
+    print(f"{results['pulses']} pulses, {results['echoes']} echoes, "
+          f"{results['no_rise']} never rose, "
+          f"{results['no_fall']} never fell.")
+    if 'pulse_rate' in results:
+        print(f"{results['pulse_rate']:.1f} pulses/s over "
+              f"{results['duration']:.0f}s.")
+    if not results['echoes']:
+        return
+    print(f"Trigger to echo: median "
+          f"{results['rise_delay_median'] * 1e6:.0f}us, "
+          f"max {results['rise_delay_max'] * 1e6:.0f}us.")
+    print(f"Distance (mm): mean {results['mean']:.1f}, "
+          f"std {results['std']:.2f}, "
+          f"noise floor {results['noise_floor']:.2f}.")
+    print('Percentiles: ' + ', '.join(
+        f'p{p} {d:.1f}' for p, d in results['percentiles'].items()))
+    print(f"Range seen {results['min']:.1f} - {results['max']:.1f}. "
+          f"Too close {results['too_close']}, "
+          f"too far {results['too_far']}.")
+    most = max(count for _, count in results['histogram'])
+    for edge, count in results['histogram']:
+        print(f'{edge:>9.1f} {count:>8} ' + '#' * round(50 * count / most))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('capture', help='file written by hc_sr04.py')
+    parser.add_argument('--bins', type=int, default=20,
+                        help='histogram bins')
+    parser.add_argument('--json', action='store_true',
+                        help='print the results as JSON instead')
+    args = parser.parse_args(argv)
+
+    results = analyse(load(args.capture), bins=args.bins)
+    if args.json:
+        print(json.dumps(results, indent=4))
+    else:
+        report(results)
+
+
+if __name__ == "__main__":
+    main()
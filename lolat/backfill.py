@@ -0,0 +1,419 @@
+#!/usr/bin/python3
+"""Re-map historical sensor readings to volumes and write them back.
+
+When a tank is recalibrated every volume already in the database is wrong.
+The raw 'reading' field is still good though, so stream the historical
+(timestamp, reading) records through the current volume mapping and write
+corrected points, with the original timestamps, as line protocol.
+
+Input is either an InfluxDB annotated CSV export, eg
+    influx query --raw 'from(bucket: "lolat") |> range(start: 0)
+        |> filter(fn: (r) => r._field == "reading")' > readings.csv
+or a plain local CSV file of 'time,reading' rows, where time is
+nanoseconds since the epoch or an RFC3339 string.
+
+Volumes are mapped as the tank's config (see config.py) says: its slope
+and offset, or its calibration file. Readings outside its dist_min to
+dist_max are dropped, and points are tagged with its tags. Without a
+config file that's the original bucket.
+
+Output goes to a file (load it with 'influx write') or straight to a
+Telegraf socket_listener over TCP.
+
+Work is done in NumPy batches of BATCH_SIZE records. After every batch
+a checkpoint is written so an interrupted run can be resumed with the same
+command line.
+
+Usage:
+    python3 backfill.py readings.csv -o corrected.lp -k backfill.json
+    python3 backfill.py readings.csv --telegraf localhost:8094 \
+        -c lolat.json -t water_butt
+"""
+
+import argparse
+import csv
+import json
+import os
+import socket
+import sys
+import time
+
+import numpy as np
+
+import config
+from line_protocol import format_prefix
+
+BATCH_SIZE = 100000
+
+# Column names we recognise in a CSV header row.
+_TIME_COLUMNS = ('_time', 'time', 'timestamp')
+_VALUE_COLUMNS = ('_value', 'reading')
+
+
+class BackfillError(Exception):
+    """Input or checkpoint can't be used."""
+    pass
+
+
+def _parse_header(cells):
+    """Return column indices [time, value, field] if cells is a header row.
+
+    'field' is None for plain CSV files, which only hold readings.
+    Returns None if this doesn't look like a header.
+    """
+    cells = [c.strip() for c in cells]
+    time_index = next((cells.index(c) for c in _TIME_COLUMNS
+                       if c in cells), None)
+    value_index = next((cells.index(c) for c in _VALUE_COLUMNS
+                        if c in cells), None)
+    if time_index is None or value_index is None:
+        return None
+    field_index = cells.index('_field') if '_field' in cells else None
+    return [time_index, value_index, field_index]
+
+
+def _split(line):
+    # Influx only quotes a cell if it contains a comma or quote, which for
+    # our data means the odd tag value. Skip the csv module when we can,
+    # it's several times slower than str.split.
+    if '"' in line:
+        return next(csv.reader([line]))
+    return line.split(',')
+
+
+def read_batches(f, batch_size=BATCH_SIZE, columns=None):
+    """Read (time, reading) records from an open binary file in batches.
+
+    Annotation lines ('#...') and blank lines are skipped. Header rows set
+    (or reset: an Influx export can hold several tables) the columns used.
+    In an Influx export only rows for the 'reading' field are kept. Rows
+    too short to hold every column, eg the truncated last line of an
+    interrupted export, are skipped and counted.
+
+    Args:
+        f: file opened in binary mode.
+        batch_size: maximum number of records per batch.
+        columns: column indices, as returned with a previous batch.
+            Needed when resuming part way through a file.
+
+    Yields:
+        (times, readings, offset, columns, malformed) where times and
+        readings are lists of strings, offset is the file position after
+        the batch and malformed the number of rows skipped as too short.
+    """
+    times = []
+    readings = []
+    lines = 0
+    malformed = 0
+    for raw in iter(f.readline, b''):
+        lines += 1
+        line = raw.decode().strip()
+        if not line or line.startswith('#'):
+            continue
+        cells = _split(line)
+        # All header names contain 'time'. Cheap test to skip the full
+        # check on data rows.
+        if 'time' in line:
+            header = _parse_header(cells)
+            if header is not None:
+                columns = header
+                continue
+        if columns is None:
+            # Plain file with no header row at all.
+            columns = [0, 1, None]
+        time_index, value_index, field_index = columns
+        if len(cells) <= max(i for i in columns if i is not None):
+            malformed += 1
+            continue
+        if field_index is not None and cells[field_index] != 'reading':
+            continue
+        times.append(cells[time_index])
+        readings.append(cells[value_index])
+        if len(times) >= batch_size:
+            yield times, readings, f.tell(), columns, malformed
+            times = []
+            readings = []
+            lines = 0
+            malformed = 0
+    if lines:
+        yield times, readings, f.tell(), columns, malformed
+
+
+def to_nanoseconds(times):
+    """Convert a list of timestamp strings to an int64 array of epoch ns.
+
+    Accepts integers (already ns) or RFC3339 UTC strings as written by
+    Influx. The format of the first entry decides for the whole list.
+    """
+    if not times:
+        return np.empty(0, dtype=np.int64)
+    if times[0].isdigit():
+        return np.fromiter(map(int, times), dtype=np.int64, count=len(times))
+    # numpy has no timezone support and warns about the trailing 'Z'.
+    # Influx always exports UTC so just drop it.
+    times = [t[:-1] if t.endswith('Z') else t for t in times]
+    return np.array(times, dtype='datetime64[ns]').astype(np.int64)
+
+
+def to_readings(readings):
+    """Convert a list of reading strings to a float64 array.
+
+    A cell that isn't a number, eg the empty reading of a point lolat sent
+    as invalid, becomes NaN.
+    """
+    try:
+        return np.array(readings, dtype=np.float64)
+    except ValueError:
+        pass
+    # The slow way, only for batches with a bad cell in them.
+    values = np.full(len(readings), np.nan)
+    for i, cell in enumerate(readings):
+        try:
+            values[i] = float(cell)
+        except ValueError:
+            pass
+    return values
+
+
+def map_volumes(readings, tank=None):
+    """Return the volumes for an array of readings, as floats.
+
+    The vectorised config.TankConfig.map_volume, before its rounding.
+    tank: the TankConfig. None for config.VOLUME_SLOPE and VOLUME_OFFSET.
+    """
+    if tank is None:
+        return config.VOLUME_SLOPE * readings + config.VOLUME_OFFSET
+    if not tank.calibration:
+        return tank.slope * readings + tank.offset
+    # Like map_volume, np.interp gives the nearest end beyond the
+    # calibrated range.
+    calibration = np.array(tank.calibration, dtype=np.float64)
+    return np.interp(readings, calibration[:, 0], calibration[:, 1])
+
+
+def remap(readings, dist_min, dist_max, tank=None):
+    """Filter an array of readings and map them to volumes.
+
+    Mirrors the live path: readings are rounded to the nearest mm, then
+    mapped as map_volumes. Readings outside [dist_min, dist_max] are
+    dropped. That includes the 0 that lolat.get_reading_and_volume used to
+    write when the sensor gave an error.
+
+    Returns:
+        (keep, readings, volumes): boolean mask of kept input records, and
+        int64 arrays of the kept readings and their volumes.
+    """
+    keep = (readings >= dist_min) & (readings <= dist_max)
+    # np.rint rounds half to even, the same as Python's round().
+    kept = np.rint(readings[keep])
+    volumes = np.rint(map_volumes(kept, tank))
+    return keep, kept.astype(np.int64), volumes.astype(np.int64)
+
+
+def format_batch(prefix, times, readings, volumes):
+    """Return a batch of points as one line protocol string."""
+    # Equivalent to line_protocol.format_line for each point, but with the
+    # field names and types fixed this is several times faster.
+    return ''.join([f'{prefix} reading={r}i,volume={v}i {t}\n'
+                    for t, r, v in zip(times.tolist(),
+                                       readings.tolist(),
+                                       volumes.tolist())])
+
+
+class _SocketWriter():
+    """File-like wrapper sending to a Telegraf socket_listener over TCP."""
+    def __init__(self, host, port):
+        self._sock = socket.create_connection((host, port))
+
+    def write(self, data):
+        self._sock.sendall(data.encode())
+
+    def tell(self):
+        return None
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self._sock.close()
+
+
+def load_checkpoint(path, source):
+    """Return the saved checkpoint for source, or None if there isn't one.
+
+    Raises:
+        BackfillError if the checkpoint was written for a different input.
+    """
+    try:
+        with open(path) as f:
+            checkpoint = json.load(f)
+    except FileNotFoundError:
+        return None
+    if checkpoint['source'] != os.path.abspath(source):
+        raise BackfillError(f"Checkpoint {path} is for {checkpoint['source']}")
+    return checkpoint
+
+
+def save_checkpoint(path, checkpoint):
+    """Write the checkpoint atomically, so a crash can't leave half a file."""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def backfill(source, sink, checkpoint_path=None, batch_size=BATCH_SIZE,
+             measurement='lolat', tags=None,
+             dist_min=None, dist_max=None, progress=None, tank=None):
+    """Re-map all readings in source and write the points to sink.
+
+    Args:
+        source: path of the input CSV file.
+        sink: writeable text file-like object.
+        checkpoint_path: optional. If given, resume from it when it exists
+            and update it after every batch.
+        batch_size: records per batch.
+        measurement, tags: written on every point. tags defaults to the
+            tank's.
+        dist_min, dist_max: valid reading range. Defaults to the tank's.
+        progress: optional text file for a progress line per batch.
+        tank: the config.TankConfig to map with. None for the original
+            bucket.
+
+    Returns:
+        The final checkpoint dict, with counts of records 'read', points
+        'written', records 'dropped' and 'malformed' rows skipped: too
+        short, or with no reading or one that isn't a number.
+    """
+    if tank is None:
+        tank = config.load().tanks[0]
+    dist_min = tank.dist_min if dist_min is None else dist_min
+    dist_max = tank.dist_max if dist_max is None else dist_max
+    if tags is None:
+        tags = dict(tank.tags)
+    prefix = format_prefix(measurement, tags)
+
+    checkpoint = None
+    if checkpoint_path:
+        checkpoint = load_checkpoint(checkpoint_path, source)
+    if checkpoint is None:
+        checkpoint = {'source': os.path.abspath(source), 'offset': 0,
+                      'columns': None, 'read': 0, 'written': 0,
+                      'dropped': 0, 'malformed': 0, 'output_size': 0}
+    elif checkpoint.get('output_size') is not None and sink.tell() is not None:
+        # Throw away anything written after the last checkpoint, otherwise
+        # a crash between the two would leave duplicates in the output.
+        sink.truncate(checkpoint['output_size'])
+        sink.seek(checkpoint['output_size'])
+
+    # Checkpoints from before malformed rows were counted.
+    checkpoint.setdefault('malformed', 0)
+    total_size = os.path.getsize(source)
+    start_time = time.monotonic()
+    start_read = checkpoint['read']
+    with open(source, 'rb') as f:
+        f.seek(checkpoint['offset'])
+        for times, readings, offset, columns, malformed in read_batches(
+                f, batch_size, checkpoint['columns']):
+            readings = to_readings(readings)
+            numbers = ~np.isnan(readings)
+            malformed += len(readings) - int(numbers.sum())
+            readings = readings[numbers]
+            keep, kept, volumes = remap(readings, dist_min, dist_max, tank)
+            times = to_nanoseconds(times)[numbers][keep]
+            sink.write(format_batch(prefix, times, kept, volumes))
+            sink.flush()
+
+            checkpoint['offset'] = offset
+            checkpoint['columns'] = columns
+            checkpoint['read'] += len(readings)
+            checkpoint['written'] += len(kept)
+            checkpoint['dropped'] += len(readings) - len(kept)
+            checkpoint['malformed'] += malformed
+            checkpoint['output_size'] = sink.tell()
+            if checkpoint_path:
+                save_checkpoint(checkpoint_path, checkpoint)
+            if progress:
+                elapsed = time.monotonic() - start_time
+                rate = (checkpoint['read'] - start_read) / max(elapsed, 1e-9)
+                print(f"{100 * offset / max(total_size, 1):5.1f}% "
+                      f"read {checkpoint['read']} "
+                      f"written {checkpoint['written']} "
+                      f"dropped {checkpoint['dropped']} "
+                      f"({rate:.0f} records/s)", file=progress)
+    return checkpoint
+
+
+def _parse_tags(tag_strings):
+    tags = {}
+    for tag in tag_strings:
+        key, sep, value = tag.partition('=')
+        if not sep:
+            raise ValueError(f'Expected key=value, got: {tag}')
+        tags[key] = value
+    return tags
+
+
+def main(argv=None):
+    """Command line entry point. See the module docstring."""
+    parser = argparse.ArgumentParser(
+        description='Re-map historical readings to volumes.')
+    parser.add_argument('source', help='CSV file of historical readings')
+    out = parser.add_mutually_exclusive_group(required=True)
+    out.add_argument('-o', '--output',
+                     help='line protocol output file')
+    out.add_argument('--telegraf', metavar='HOST:PORT',
+                     help='send to a Telegraf socket_listener over TCP')
+    parser.add_argument('-k', '--checkpoint',
+                        help='checkpoint file, resumed from if it exists')
+    parser.add_argument('-c', '--config',
+                        help='config file, see config.py')
+    parser.add_argument('-t', '--tank',
+                        help='tank the readings are from (default the '
+                             'first)')
+    parser.add_argument('-b', '--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('-m', '--measurement', default='lolat')
+    parser.add_argument('--tag', action='append',
+                        help="key=value tag for every point (repeatable). "
+                             "Default the tank's tags")
+    args = parser.parse_args(argv)
+    try:
+        tags = _parse_tags(args.tag) if args.tag else None
+    except ValueError as e:
+        parser.error(str(e))
+    try:
+        tanks = config.load(args.config).tanks
+    except config.ConfigError as e:
+        parser.error(str(e))
+    tank = tanks[0] if args.tank is None else next(
+        (tank for tank in tanks if tank.name == args.tank), None)
+    if tank is None:
+        parser.error(f'No tank {args.tank} in {args.config}')
+
+    if args.output:
+        resuming = args.checkpoint and os.path.exists(args.checkpoint)
+        if resuming and not os.path.exists(args.output):
+            sys.exit(f"Can't resume from {args.checkpoint}: output "
+                     f"{args.output} is missing. Delete the checkpoint to "
+                     f"start again.")
+        sink = open(args.output, 'r+' if resuming else 'w')
+    else:
+        host, _, port = args.telegraf.rpartition(':')
+        sink = _SocketWriter(host, int(port))
+    try:
+        result = backfill(args.source, sink, args.checkpoint,
+                          args.batch_size, args.measurement, tags,
+                          progress=sys.stderr, tank=tank)
+    except BackfillError as e:
+        sys.exit(str(e))
+    finally:
+        sink.close()
+    print(f"Done. Read {result['read']}, wrote {result['written']}, "
+          f"dropped {result['dropped']}, skipped {result['malformed']} "
+          f"malformed rows.")
+
+
+if __name__ == "__main__":
+    main()
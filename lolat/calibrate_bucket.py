@@ -8,8 +8,11 @@ See issue #23 for feature ideas to improve this.
 """
 
 # import os
+import argparse
 import json
-from hc_sr04 import DistanceSensor
+import config
+import drivers
+import profiling
 
 
 class _NoMoreInputException(Exception):
@@ -17,7 +20,7 @@ class _NoMoreInputException(Exception):
     pass
 
 
-def _open_file():
+def _open_file(file_name):
     """Open the JSON file.
 
     Asks for confirm before overwriting.  Bails on all other errors.
@@ -29,19 +32,14 @@ def _open_file():
     Raises:
         FileExistsError if the user doesn't want to over-write an existing file.
     """
-    # Words reverse order between this file name and its output. Oh well.
-    # Issue #22 will fix this string being hardcoded.
-    MAPPING_FILE_NAME = 'bucket_calibration.json'
     try:
-        f = open(MAPPING_FILE_NAME, 'x')
+        f = open(file_name, 'x')
     except FileExistsError as e:
         if input('File exists. Overwrite? [N|y] ') == 'y':
-            f = open(MAPPING_FILE_NAME, 'w')
+            f = open(file_name, 'w')
         else:
             raise e
     # There are plenty other file systme errors, let Python handle them.
-    # Will get fixed with #22 and #23, particularly if filename becomes
-    # a user input.
     return f
 
 
@@ -91,7 +89,7 @@ def _get_distance_or_quit(sensor):
     return reading
 
 
-def main():
+def main(argv=None):
     """Create a JSON file containing sensor readings v actual liquid volume.
 
     Check the output file is writeable.
@@ -100,15 +98,43 @@ def main():
     volume. Get a reading from the sensor. Append that to our output list.
     Repeat.
 
-    Write the file.
+    Write the file: the tank's calibration file if it has one configured,
+    else <tank>_calibration.json.
+
+    With --profile, just profile taking that many readings instead.
     """
 
-    sensor = DistanceSensor()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-c', '--config',
+                        help='config file, see config.py')
+    parser.add_argument('-t', '--tank',
+                        help='tank to calibrate (default the first)')
+    drivers.add_arguments(parser)
+    profiling.add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    try:
+        # The calibration file is what we're about to write: it needn't
+        # exist, and if it does we don't want it.
+        tanks = config.load(args.config, calibrations=False).tanks
+    except config.ConfigError as e:
+        parser.error(str(e))
+    tank = tanks[0] if args.tank is None else next(
+        (tank for tank in tanks if tank.name == args.tank), None)
+    if tank is None:
+        parser.error(f'No tank {args.tank} in {args.config}')
+    sensor = tank.make_sensor(drivers.sensor_override(args))
+    if args.profile:
+        with sensor.open():
+            profiling.run_from_arguments(
+                args, lambda: _get_distance_or_quit(sensor))
+        return
     # Use 'with' to do sensor setup and teardown in a tidy way.
     # We only need the file handle when we are done but better to be
     # sure we can open the output file for writing _before_ the user
     # does all their bucket filling.
-    with sensor.open(), _open_file() as f:
+    file_name = tank.calibration_file or f'{tank.name}_calibration.json'
+    with sensor.open(), _open_file(file_name) as f:
 
         print('Taking sensor reading with an empty bucket')
         mappings = []
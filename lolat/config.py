@@ -0,0 +1,361 @@
+#!/usr/bin/python3
+"""The tanks to sample and where to send the results, from a JSON file.
+
+Everything that used to be hardcoded: sensor pins and range, the volume
+mapping or calibration file, the period and the Telegraf connection. For
+example, lolat.json:
+
+    {
+        "period": 900,
+        "sink": {"backend": "telegraf", "host": "localhost", "port": 8094},
+        "tanks": {
+            "bucket": {"calibration": "bucket_calibration.json"},
+            "water_butt": {
+                "pin_trigger": 13, "pin_echo": 15,
+                "dist_max": 2000,
+                "slope": -150.0, "offset": 300000,
+                "period": 3600,
+                "tags": {"src": "water_butt", "site": "garden"}
+            }
+        }
+    }
+
+Every key is optional. A tank's defaults are those of the original
+single bucket, its tags default to {"src": <tank name>} and its period to
+the top level one. Without a file at all there is one tank, 'bucket',
+set up exactly as before.
+
+The volume is either slope * reading + offset, or interpolated from a
+calibration file written by calibrate_bucket.py. Relative paths are
+relative to the config file.
+
+Invalid pulses, eg stray echoes off foam, are handled per tank:
+- retries: extra pulses a reading may send to replace invalid ones.
+- min_valid: the fewest valid pulses (of 5) a reading can be made from.
+- time_budget: seconds a reading may spend retrying. Default
+  TIME_BUDGET, or the period if that's shorter.
+- on_invalid: what to send when a reading still fails. "null": no reading
+  or volume, just quality "invalid". "carry": the last good reading and
+  volume again, with quality "carried". Never a fake zero.
+
+The file is parsed and checked once, into namedtuples that can't be
+changed. A ConfigWatcher notices when it, or a calibration file it uses,
+changes and loads it again. Because tanks are plain values, comparing old
+and new shows exactly which tanks changed.
+"""
+
+import json
+import os
+from bisect import bisect_left
+from collections import namedtuple
+
+# These constants dervied by visual inspection of a best fit line
+# on a Google sheet of the combined calibration data.
+# volume (ml) = VOLUME_SLOPE * reading (mm) + VOLUME_OFFSET
+# backfill.py applies each tank's mapping to historical readings.
+VOLUME_SLOPE = -22.93
+VOLUME_OFFSET = 2522
+
+# Seconds between readings.
+PERIOD = 15 * 60
+
+# Seconds a reading may spend retrying invalid pulses, unless configured.
+# Twice what the 5 pulses of a reading can take at worst: each is a 60ms
+# pause then up to 100ms waiting for each edge of its echo.
+TIME_BUDGET = 2 * 5 * (60 + 2 * 100) / 1000
+
+
+# What to send when a reading is invalid, see the module docstring.
+ON_INVALID = ('null', 'carry')
+
+
+class ConfigError(Exception):
+    """The config file, or a calibration file, can't be used."""
+    pass
+
+
+SinkConfig = namedtuple('SinkConfig', ['backend', 'options', 'tags'])
+
+
+class TankConfig(namedtuple('TankConfig', [
+        'name', 'sensor', 'sensor_options', 'pin_trigger', 'pin_echo',
+        'dist_min', 'dist_max', 'slope', 'offset', 'calibration_file',
+        'calibration', 'period', 'tags', 'retries', 'min_valid',
+        'time_budget', 'on_invalid'])):
+    """One tank. Options and tags are sorted (key, value) tuples,
+    calibration sorted (reading, volume) tuples, or () for none."""
+    __slots__ = ()
+
+    def map_volume(self, reading):
+        """Return the volume (ml, an int) for a reading (mm)."""
+        # Influx wants the same type every time: always an int.
+        if not self.calibration:
+            return round(self.slope * reading + self.offset)
+        readings = [r for r, _ in self.calibration]
+        i = bisect_left(readings, reading)
+        # Beyond the calibrated range, the nearest end.
+        if i == 0:
+            return round(self.calibration[0][1])
+        if i == len(readings):
+            return round(self.calibration[-1][1])
+        (r0, v0), (r1, v1) = self.calibration[i - 1], self.calibration[i]
+        return round(v0 + (v1 - v0) * (reading - r0) / (r1 - r0))
+
+    def make_sensor(self, override=None):
+        """Build this tank's sensor.
+
+        override: optional (backend or None, options), eg from
+        drivers.sensor_override, to use instead of ours.
+        """
+        import drivers
+        backend, options = override or (None, {})
+        # Anything in sensor_options, or the override, wins.
+        all_options = dict(
+            pin_trigger=self.pin_trigger, pin_echo=self.pin_echo,
+            dist_min=self.dist_min, dist_max=self.dist_max,
+            retries=self.retries, min_valid=self.min_valid,
+            time_budget=self.time_budget)
+        all_options.update(self.sensor_options)
+        all_options.update(options)
+        return drivers.sensor(backend or self.sensor, **all_options)
+
+
+Config = namedtuple('Config', ['path', 'period', 'sink', 'tanks'])
+Config.__doc__ = """Everything in a config file. tanks is a tuple of
+TankConfig, in file order. path is None for the defaults."""
+
+
+def _frozen(mapping):
+    return tuple(sorted(mapping.items()))
+
+
+def _check(value, kinds, what):
+    # bool is an int, but never what we want.
+    if isinstance(value, bool) or not isinstance(value, kinds):
+        names = ' or '.join(k.__name__ for k in
+                            (kinds if isinstance(kinds, tuple) else (kinds,)))
+        raise ConfigError(f'{what}: expected {names}, got {value!r}')
+    return value
+
+
+def _take(mapping, key, default, kinds, what):
+    return _check(mapping.pop(key, default), kinds, f'{what}.{key}')
+
+
+def _no_more(mapping, what):
+    if mapping:
+        raise ConfigError(f'{what}: unknown setting(s) '
+                          f'{", ".join(sorted(mapping))}')
+
+
+def load_calibration(path):
+    """Return a calibrate_bucket.py file as sorted (reading, volume)s."""
+    try:
+        with open(path) as f:
+            mappings = json.load(f)
+    except (OSError, ValueError) as e:
+        raise ConfigError(f'Calibration {path}: {e}') from e
+    try:
+        points = sorted((float(r), float(v)) for r, v in mappings)
+    except (TypeError, ValueError):
+        raise ConfigError(f'Calibration {path}: expected a list of '
+                          f'[reading, volume] pairs') from None
+    # Two volumes for one reading: keep the first, there's nothing
+    # between them to interpolate.
+    unique = []
+    for reading, volume in points:
+        if not unique or reading != unique[-1][0]:
+            unique.append((reading, volume))
+    if not unique:
+        raise ConfigError(f'Calibration {path}: no points')
+    return tuple(unique)
+
+
+def _tank(name, settings, period, base, calibrations=True):
+    what = f'tanks.{name}'
+    settings = dict(_check(settings, dict, what))
+    tank = TankConfig(
+        name=name,
+        sensor=_take(settings, 'sensor', 'hc_sr04', str, what),
+        sensor_options=_frozen(
+            _take(settings, 'sensor_options', {}, dict, what)),
+        pin_trigger=_take(settings, 'pin_trigger', 7, int, what),
+        pin_echo=_take(settings, 'pin_echo', 11, int, what),
+        dist_min=_take(settings, 'dist_min', 27, (int, float), what),
+        dist_max=_take(settings, 'dist_max', 4400, (int, float), what),
+        slope=_take(settings, 'slope', VOLUME_SLOPE, (int, float), what),
+        offset=_take(settings, 'offset', VOLUME_OFFSET, (int, float), what),
+        calibration_file=_take(settings, 'calibration', None,
+                               (str, type(None)), what),
+        calibration=(),
+        period=_take(settings, 'period', period, (int, float), what),
+        tags=_frozen(_take(settings, 'tags', {'src': name}, dict, what)),
+        retries=_take(settings, 'retries', 3, int, what),
+        min_valid=_take(settings, 'min_valid', 3, int, what),
+        time_budget=_take(settings, 'time_budget', None,
+                          (int, float, type(None)), what),
+        on_invalid=_take(settings, 'on_invalid', 'null', str, what))
+    _no_more(settings, what)
+    if tank.time_budget is None:
+        tank = tank._replace(time_budget=min(TIME_BUDGET, tank.period))
+    if tank.pin_trigger == tank.pin_echo:
+        raise ConfigError(f'{what}: trigger and echo on the same pin')
+    if not 0 <= tank.dist_min < tank.dist_max:
+        raise ConfigError(f'{what}: need 0 <= dist_min < dist_max')
+    if tank.period <= 0:
+        raise ConfigError(f'{what}.period: must be more than 0')
+    if tank.retries < 0:
+        raise ConfigError(f'{what}.retries: must be 0 or more')
+    if not 3 <= tank.min_valid <= 5:
+        raise ConfigError(f'{what}.min_valid: must be 3 to 5')
+    if tank.on_invalid not in ON_INVALID:
+        raise ConfigError(f'{what}.on_invalid: expected one of '
+                          f'{", ".join(ON_INVALID)}')
+    if tank.sensor == 'fused':
+        sensors = dict(tank.sensor_options).get('sensors')
+        if not sensors or not isinstance(sensors, list) or \
+                not all(isinstance(sensor, dict) for sensor in sensors):
+            raise ConfigError(f'{what}.sensor_options.sensors: expected a '
+                              f'list of sensors for a fused sensor')
+    if tank.calibration_file:
+        path = os.path.join(base, tank.calibration_file)
+        tank = tank._replace(
+            calibration_file=path,
+            calibration=load_calibration(path) if calibrations else ())
+    return tank
+
+
+def _pins(tank):
+    """The board pins a tank's sensor(s) use."""
+    if tank.sensor.startswith('hc_sr04'):
+        return [tank.pin_trigger, tank.pin_echo]
+    if tank.sensor == 'fused':
+        sensors = dict(tank.sensor_options).get('sensors', [])
+        return [pin for sensor in sensors
+                if sensor.get('sensor', 'hc_sr04').startswith('hc_sr04')
+                for pin in (sensor.get('pin_trigger', 7),
+                            sensor.get('pin_echo', 11))]
+    # Not on this board's pins.
+    return []
+
+
+def parse(settings, path=None, calibrations=True):
+    """Return a Config from the settings in a (parsed) config file.
+
+    With calibrations False, calibration files are neither read nor need
+    to exist, eg for calibrate_bucket.py to write them. Tanks then have no
+    calibration.
+
+    Raises:
+        ConfigError naming the first thing wrong.
+    """
+    settings = dict(_check(settings, dict, 'config'))
+    base = os.path.dirname(os.path.abspath(path)) if path else os.getcwd()
+    period = _take(settings, 'period', PERIOD, (int, float), 'config')
+    sink = dict(_take(settings, 'sink', {}, dict, 'config'))
+    sink_config = SinkConfig(
+        backend=_take(sink, 'backend', 'telegraf', str, 'sink'),
+        options=_frozen({
+            'host': _take(sink, 'host', 'localhost', str, 'sink'),
+            'port': _take(sink, 'port', 8094, int, 'sink'),
+            **_take(sink, 'options', {}, dict, 'sink')}),
+        tags=_frozen(_take(sink, 'tags', {}, dict, 'sink')))
+    _no_more(sink, 'sink')
+    tanks = _take(settings, 'tanks', {'bucket': {}}, dict, 'config')
+    if not tanks:
+        raise ConfigError('config.tanks: no tanks')
+    _no_more(settings, 'config')
+    tanks = tuple(_tank(name, tank, period, base, calibrations)
+                  for name, tank in tanks.items())
+    pins = {}
+    for tank in tanks:
+        for pin in _pins(tank):
+            if pin in pins:
+                raise ConfigError(f'tanks.{tank.name}: pin {pin} is '
+                                  f'already used by {pins[pin]}')
+            pins[pin] = tank.name
+    return Config(path, period, sink_config, tanks)
+
+
+def load(path=None, calibrations=True):
+    """Read, parse and check a config file. None for the defaults.
+
+    calibrations: as parse.
+    """
+    if path is None:
+        return parse({}, calibrations=calibrations)
+    try:
+        with open(path) as f:
+            settings = json.load(f)
+    except (OSError, ValueError) as e:
+        raise ConfigError(f'{path}: {e}') from e
+    return parse(settings, path, calibrations)
+
+
+class ConfigWatcher():
+    """Load a config file again when it, or its calibrations, change.
+
+    check() looks at modification times only, so is cheap enough to call
+    every second or so. reload() reloads regardless, eg on SIGHUP.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.config = load(path)
+        self._stamps = self._get_stamps()
+
+    def _files(self):
+        if self.path is None:
+            return []
+        return [self.path] + [tank.calibration_file
+                              for tank in self.config.tanks
+                              if tank.calibration_file]
+
+    def _get_stamps(self):
+        stamps = []
+        for path in self._files():
+            try:
+                stat = os.stat(path)
+                stamps.append((path, stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                stamps.append((path, None, None))
+        return stamps
+
+    def check(self):
+        """Reload if anything changed. Returns the new Config or None.
+
+        Raises:
+            ConfigError if it changed but can't be used. The old config
+            stays in place, and the same error isn't raised again until
+            the file changes again.
+        """
+        stamps = self._get_stamps()
+        if stamps == self._stamps:
+            return None
+        self._stamps = stamps
+        return self.reload()
+
+    def reload(self):
+        """Load the file again. Returns the new Config.
+
+        Raises:
+            ConfigError, leaving the old config in place.
+        """
+        config = load(self.path)
+        self.config = config
+        self._stamps = self._get_stamps()
+        return config
+
+
+def changes(old, new):
+    """Compare two Configs' tanks.
+
+    Returns:
+        (added, changed, removed): lists of tank names.
+    """
+    old_tanks = {tank.name: tank for tank in old.tanks}
+    new_tanks = {tank.name: tank for tank in new.tanks}
+    added = [name for name in new_tanks if name not in old_tanks]
+    removed = [name for name in old_tanks if name not in new_tanks]
+    changed = [name for name in new_tanks
+               if name in old_tanks and new_tanks[name] != old_tanks[name]]
+    return added, changed, removed
@@ -0,0 +1,176 @@
+#!/usr/bin/python3
+"""Sensor and sink backends, looked up by name.
+
+A backend is declared as 'module:attribute', naming something that
+builds it, and its module is only imported when that backend is first
+asked for. So loading lolat doesn't load RPi.GPIO or pytelegraf, and a
+simulated or replayed run never needs them at all.
+
+Sensors (all behave as a hc_sr04.DistanceSensor):
+- hc_sr04: busy-waits on the echo pin. The most accurate.
+- hc_sr04_edge: waits for edges in RPi.GPIO. Frees the CPU, less accurate.
+- simulated: a simulator.SimulatedBoard. Options: distance, noise,
+  missing, stray, seed, poll_time.
+- replay: replays a raw capture file. Options: path, loop.
+- fused: several of the above on one tank, see fusion.py. Options:
+  sensors, a list of dicts each with an optional 'sensor' backend name
+  and its options, parallel and min_valid.
+All also take DistanceSensor's pin_trigger, pin_echo, dist_min, dist_max,
+retries, min_valid and time_budget. A fused sensor passes dist_min,
+dist_max, retries and min_valid on to its sensors, unless they give their
+own, and shares time_budget out between them. It has no pins of its own.
+
+Sinks (anything with a metric(measurement_name, values) method):
+- telegraf: pytelegraf's TelegrafClient.
+- line_protocol: line_protocol.SocketClient, no dependencies.
+
+Options are passed to the backend as keyword arguments. A new backend
+needs no change here: register it, or give 'module:attribute' in place of
+a name.
+"""
+
+import importlib
+import json
+
+# Roughly what one GPIO.input() takes on a Pi 3. Makes simulated
+# busy-wait loops go round about as often as real ones.
+PI_POLL_TIME = 2e-6
+
+SENSORS = {
+    'hc_sr04': 'hc_sr04:DistanceSensor',
+    'hc_sr04_edge': 'hc_sr04:EdgeDistanceSensor',
+    'simulated': 'drivers:simulated_sensor',
+    'replay': 'replay:ReplaySensor',
+    'fused': 'drivers:fused_sensor',
+}
+
+SINKS = {
+    'telegraf': 'drivers:telegraf_client',
+    'line_protocol': 'line_protocol:SocketClient',
+}
+
+
+class DriverError(Exception):
+    """No such backend, or it can't be loaded."""
+    pass
+
+
+def register_sensor(name, target):
+    """Add a sensor backend. target is 'module:attribute' or a callable."""
+    SENSORS[name] = target
+
+
+def register_sink(name, target):
+    """Add a sink backend. target is 'module:attribute' or a callable."""
+    SINKS[name] = target
+
+
+def _load(backends, kind, name):
+    target = backends.get(name, name if ':' in name else None)
+    if target is None:
+        raise DriverError(f'No {kind} called {name!r}. Try one of: '
+                          f'{", ".join(sorted(backends))}')
+    if callable(target):
+        return target
+    module_name, _, attribute = target.partition(':')
+    try:
+        module = importlib.import_module(module_name)
+        target = getattr(module, attribute)
+    except (ImportError, AttributeError) as e:
+        raise DriverError(f"Can't load {kind} {name!r} ({target}): {e}") \
+            from e
+    # Only ever import it once.
+    if name in backends:
+        backends[name] = target
+    return target
+
+
+def sensor(name='hc_sr04', **options):
+    """Return a new sensor from the backend called name."""
+    return _load(SENSORS, 'sensor', name)(**options)
+
+
+def sink(name='telegraf', **options):
+    """Return a new sink from the backend called name."""
+    return _load(SINKS, 'sink', name)(**options)
+
+
+def simulated_sensor(distance=1000, noise=1.0, missing=0.0, stray=0.0,
+                     seed=0, poll_time=PI_POLL_TIME, **kwargs):
+    """A DistanceSensor on a SimulatedBoard with its own VirtualClock.
+
+    Anything else is passed to DistanceSensor, eg pin_trigger.
+    """
+    from hc_sr04 import DistanceSensor
+    from simulator import VirtualClock, SimulatedBoard, EchoProfile
+    clock = VirtualClock()
+    profile = EchoProfile(distance, noise, missing, stray, seed)
+    sensor = DistanceSensor(gpio=None, clock=clock, **kwargs)
+    sensor._gpio = SimulatedBoard(clock, profile, sensor.PIN_TRIGGER,
+                                  sensor.PIN_ECHO, poll_time)
+    return sensor
+
+
+def fused_sensor(sensors, parallel=False, min_valid=3, dist_min=27,
+                 dist_max=4400, pin_trigger=None, pin_echo=None, retries=0,
+                 time_budget=None):
+    """A fusion.FusedSensor of sensors built from a list of dicts, each
+    with an optional 'sensor' backend name and its options."""
+    from fusion import FusedSensor
+    built = []
+    for options in sensors:
+        options = dict(options)
+        backend = options.pop('sensor', 'hc_sr04')
+        options.setdefault('dist_min', dist_min)
+        options.setdefault('dist_max', dist_max)
+        options.setdefault('retries', retries)
+        options.setdefault('min_valid', min_valid)
+        built.append(sensor(backend, **options))
+    return FusedSensor(built, parallel, min_valid, time_budget)
+
+
+def telegraf_client(**options):
+    """pytelegraf's TelegrafClient."""
+    try:
+        from telegraf.client import TelegrafClient
+    except ImportError:
+        # Unit tests won't run in production envrionment.
+        from mock_telegraf import TelegrafClient
+    return TelegrafClient(**options)
+
+
+def _parse_option(text):
+    """'key=value' to (key, value). Values are JSON if they can be."""
+    key, equals, value = text.partition('=')
+    if not equals:
+        raise ValueError(f'Expected key=value, not {text!r}')
+    try:
+        value = json.loads(value)
+    except ValueError:
+        pass
+    return key, value
+
+
+def add_arguments(parser):
+    """Add the sensor choice options to an argparse parser."""
+    group = parser.add_argument_group('sensor')
+    group.add_argument('--sensor',
+                       help=f'sensor backend: {", ".join(SENSORS)} or '
+                            f'module:attribute (default hc_sr04, or as '
+                            f'configured)')
+    group.add_argument('--sensor-option', action='append', default=[],
+                       metavar='KEY=VALUE', type=_parse_option,
+                       help='passed to the sensor backend, eg '
+                            'path=capture.bin for replay')
+    group.add_argument('--simulate', type=float, metavar='MM',
+                       help='short for --sensor simulated '
+                            '--sensor-option distance=MM')
+
+
+def sensor_override(args):
+    """Return (backend or None, options) given by options from
+    add_arguments."""
+    options = dict(args.sensor_option)
+    if args.simulate is not None:
+        return 'simulated', dict(options, distance=args.simulate)
+    return args.sensor, options
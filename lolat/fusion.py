@@ -0,0 +1,147 @@
+#!/usr/bin/python3
+"""Several HC-SR04s on one tank, read as one sensor.
+
+Foam and splashes make a single sensor unreliable: one bad echo and the
+whole reading is lost. A FusedSensor reads every sensor on the tank and
+combines whatever they got:
+- each sensor's pulses that came back in range give it an estimate, as
+  DistanceSensor's trimmed mean, and a variance. Invalid pulses are
+  retried as DistanceSensor.get_distance does, with each sensor's own
+  retries.
+- a sensor with too few valid pulses, or that fails outright, is left out
+  of this reading. Only if every sensor is left out is the reading
+  invalid.
+- the rest are averaged, each weighted by its number of valid pulses over
+  its variance: the more of its pulses agree, and the more closely, the
+  more it counts.
+
+Sensors are read in turn by default, so one can't hear another's echo.
+With parallel=True they are read at the same time, each in a thread of its
+own. Only do that where the geometry keeps their echoes apart, and with
+sensors that don't busy-wait, eg hc_sr04_edge: busy-waiting threads take
+turns on the interpreter, which ruins their timing.
+
+The time budget is for the whole fused reading. Read in turn, each sensor
+may spend an equal share of what's left of it on retries; in parallel each
+may spend all of it. As with DistanceSensor it only limits retries: every
+sensor always sends its first 5 pulses.
+
+As a tank's sensor in a config file:
+
+    "sensor": "fused",
+    "sensor_options": {"sensors": [
+        {"pin_trigger": 7, "pin_echo": 11},
+        {"sensor": "hc_sr04_edge", "pin_trigger": 13, "pin_echo": 15}]}
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+
+from hc_sr04 import DistanceSensor
+from instrumentation import stats
+
+# A variance below this (mm^2) is the 1mm the sensor can resolve, not a
+# better sensor. Also stops one perfect run getting all the weight.
+VARIANCE_FLOOR = 1.0
+
+# What a failing sensor can raise, other than InvalidDistanceError. RPi.GPIO
+# raises RuntimeError, a replay EOFError.
+SENSOR_FAILURES = (OSError, EOFError, RuntimeError)
+
+
+class FusedSensor():
+    """Several sensors read as one. Used like a DistanceSensor.
+
+    Args:
+        sensors: the DistanceSensors (or alikes) on the tank.
+        parallel: read them at the same time, see the module docstring.
+        min_valid: pulses a sensor needs in range to count. At least 3,
+            for the trimmed mean.
+        time_budget: seconds the whole reading may take retrying. None
+            for each sensor's own TIME_BUDGET.
+    """
+    Error = DistanceSensor.Error
+    InvalidDistanceError = DistanceSensor.InvalidDistanceError
+
+    def __init__(self, sensors, parallel=False, min_valid=3,
+                 time_budget=None):
+        if not sensors:
+            raise ValueError('FusedSensor needs at least one sensor')
+        self.sensors = list(sensors)
+        self.parallel = parallel
+        self.min_valid = max(min_valid, 3)
+        self.time_budget = time_budget
+        self._executor = None
+        # The weight each sensor got in the last reading, None if it was
+        # left out.
+        self.weights = [None] * len(self.sensors)
+
+    @contextmanager
+    def open(self):
+        """Open every sensor. Call in a 'with' block."""
+        with ExitStack() as opened:
+            for sensor in self.sensors:
+                opened.enter_context(sensor.open())
+            if self.parallel:
+                self._executor = opened.enter_context(ThreadPoolExecutor(
+                    len(self.sensors), thread_name_prefix='lolat-fused'))
+            try:
+                yield self
+            finally:
+                self._executor = None
+
+    def _estimate(self, sensor, distances):
+        """Return (estimate, weight) for one sensor's valid distances, or
+        None."""
+        count = len(distances)
+        if count < self.min_valid:
+            return None
+        mean = sum(distances) / count
+        variance = sum((d - mean) ** 2 for d in distances) / (count - 1)
+        return (sensor._combine(distances),
+                count / max(variance, VARIANCE_FLOOR))
+
+    def _read(self, sensor, time_budget=None):
+        try:
+            return self._estimate(
+                sensor, sensor._get_valid_distances(time_budget))
+        except sensor.InvalidDistanceError:
+            return None
+        except SENSOR_FAILURES as e:
+            print(f'Sensor on pin {sensor.PIN_ECHO} failed: {e}')
+            return None
+
+    def get_distance(self):
+        """Return the weighted average distance, mm, rounded.
+
+        Raises:
+            InvalidDistanceError if no sensor got enough valid pulses.
+        """
+        started = stats.start()
+        if self._executor:
+            results = list(self._executor.map(
+                lambda sensor: self._read(sensor, self.time_budget),
+                self.sensors))
+        elif self.time_budget is None:
+            results = [self._read(sensor) for sensor in self.sensors]
+        else:
+            # An equal share of what's left each, so what one doesn't use
+            # the rest can.
+            end = time.monotonic() + self.time_budget
+            results = []
+            for left, sensor in zip(range(len(self.sensors), 0, -1),
+                                    self.sensors):
+                share = max(end - time.monotonic(), 0) / left
+                results.append(self._read(sensor, share))
+        self.weights = [result and result[1] for result in results]
+        used = [result for result in results if result]
+        if len(used) < len(results):
+            stats.count('fused_dropouts', len(results) - len(used))
+        if not used:
+            raise self.InvalidDistanceError('No sensor got a valid reading')
+        total = sum(weight for _, weight in used)
+        distance = round(sum(estimate * weight for estimate, weight in used)
+                         / total)
+        stats.stop('get_distance', started)
+        return distance
@@ -5,6 +5,13 @@ API calls:
 - setup: initialise the board.
 - teardown: tidy up when done.
 - get_distance: provide an estimate, in mm, of distance to the nearest object.
+- get_round_trip_times and distance_from_round_trip_times: the same in two
+  halves, raw capture and the sums, so they can run in different processes.
+- capture: fire pulses as fast as is safe and write every echo's edge times
+  to a file, for characterising a sensor. See analyse_capture.py, and main
+  below to run it from the command line.
+
+The GPIO library and clock can be swapped, eg for simulator.py.
 
 API Raises:
 - InvalidDistanceError: sensor indicates object too close or too far.
@@ -16,13 +23,11 @@ For alternate hardware simply implement equivalent versions of the above.
 # GPIO code from Gus at PiMyLifeUp
 # https://pimylifeup.com/raspberry-pi-distance-sensor/
 
+import argparse
+import struct
 import time
 from contextlib import contextmanager
-try:
-    import RPi.GPIO as GPIO
-except ImportError:
-    # Unit tests won't run in production envrionment.
-    import mock_GPIO as GPIO
+from instrumentation import stats
 
 
 # ultrasonic ranging module HC - SR04 spec sheet
@@ -43,6 +48,36 @@ except ImportError:
 # All distances are in millimeters, all times in seconds
 
 
+def _default_gpio():
+    """RPi.GPIO, imported on first use: most users of this module never
+    touch the hardware, and shouldn't pay for loading it."""
+    try:
+        import RPi.GPIO as GPIO
+    except ImportError:
+        # Unit tests won't run in production envrionment.
+        import mock_GPIO as GPIO
+    return GPIO
+
+
+# Raw capture file format. A header: magic, format version and record size.
+# Then one record per pulse: trigger, echo rise and echo fall times (as
+# clock.time()), and a status. Little endian, no padding.
+CAPTURE_MAGIC = b'LOLATCAP'
+CAPTURE_VERSION = 1
+CAPTURE_HEADER = struct.Struct('<8sHH')
+CAPTURE_RECORD = struct.Struct('<dddB')
+# Statuses. For a missing edge its time is when we gave up waiting.
+CAPTURE_OK = 0
+CAPTURE_NO_RISE = 1
+CAPTURE_NO_FALL = 2
+# Give up waiting for the echo pin to rise, or fall, after this long. A
+# genuine HC-SR04 rises within a millisecond and falls within 38ms.
+CAPTURE_RISE_TIMEOUT = 10 / 1000
+CAPTURE_FALL_TIMEOUT = 100 / 1000
+# Pulses per write. 2.5MB, nearly two hours of pulses.
+CAPTURE_BLOCK = 100000
+
+
 class DistanceSensor():
     class Error(Exception):
         """Base class for Exceptions raised by this library"""
@@ -53,27 +88,64 @@ class DistanceSensor():
         def __init__(self, message):
             self.message = message
 
-    def __init__(self):
+    def __init__(self, gpio=None, clock=time, pin_trigger=7, pin_echo=11,
+                 dist_min=27, dist_max=4400, retries=0, min_valid=None,
+                 time_budget=None):
+        """Optionally use a different GPIO library, clock, pins, range or
+        invalid pulse policy.
+
+        Args:
+            gpio: anything implementing the RPi.GPIO calls used here.
+                Defaults to RPi.GPIO (or the mock when testing), imported
+                when the sensor is opened.
+            clock: anything with 'time' and 'sleep' functions like the
+                'time' module, eg a simulator.VirtualClock.
+            pin_trigger, pin_echo: board numbering.
+            dist_min, dist_max: range of valid readings, mm.
+            retries: extra pulses a reading may send to replace invalid
+                ones.
+            min_valid: valid pulses a reading needs, if it runs out of
+                retries or time. At least 3. Default all of them.
+            time_budget: seconds a reading may take before it stops
+                retrying. None for no limit.
+
+        The defaults are the original policy: the first invalid pulse
+        makes the reading invalid.
+        """
+        self._gpio = gpio
+        self._clock = clock
+
         # Set range of valid readings.
         # (See specsheet and testing comments above).
-        # Allowing a 10% margin at either side.
-        self.DIST_MIN = 27
-        self.DIST_MAX = 4400
+        # The defaults allow a 10% margin at either side.
+        self.DIST_MIN = dist_min
+        self.DIST_MAX = dist_max
 
-        self.PIN_TRIGGER = 7
-        self.PIN_ECHO = 11
+        self.PIN_TRIGGER = pin_trigger
+        self.PIN_ECHO = pin_echo
+
+        # Pulses per estimate.
+        self.NUM_READINGS = 5
+
+        self.RETRIES = retries
+        self.MIN_VALID = self.NUM_READINGS if min_valid is None else \
+            min(max(min_valid, 3), self.NUM_READINGS)
+        self.TIME_BUDGET = time_budget
 
     @contextmanager
     def open(self):
         """Do one time sensor set-up, call in 'with' block, tidy up when done"""
-        GPIO.setmode(GPIO.BOARD)
-        GPIO.setup(self.PIN_TRIGGER, GPIO.OUT)
-        GPIO.setup(self.PIN_ECHO, GPIO.IN)
-        GPIO.output(self.PIN_TRIGGER, GPIO.LOW)
+        if self._gpio is None:
+            self._gpio = _default_gpio()
+        self._gpio.setmode(self._gpio.BOARD)
+        self._gpio.setup(self.PIN_TRIGGER, self._gpio.OUT)
+        self._gpio.setup(self.PIN_ECHO, self._gpio.IN)
+        self._gpio.output(self.PIN_TRIGGER, self._gpio.LOW)
         try:
             yield self
         finally:
-            GPIO.cleanup()
+            # Only our pins: other sensors may share the board.
+            self._gpio.cleanup((self.PIN_TRIGGER, self.PIN_ECHO))
 
     def _get_pulse_round_trip_time(self):
         """Send an ultrasonic pulse. Return the time it takes to come back."""
@@ -81,12 +153,13 @@ class DistanceSensor():
         # Avoid possibility of triggering prematurely from a stray
         # pulse from a previous call to this func.
         # Recommendation of 60msec is equivalent to an echo from ~10m away.
-        time.sleep(60 / 1000)  # = 60msec, taken from datasheet.
+        self._clock.sleep(60 / 1000)  # = 60msec, taken from datasheet.
+        started = stats.start()
 
         # Tell board to send ultrasonic burst.
-        GPIO.output(self.PIN_TRIGGER, GPIO.HIGH)
-        time.sleep(10 / 1000000)  # = 10usec, taken from datasheet.
-        GPIO.output(self.PIN_TRIGGER, GPIO.LOW)
+        self._gpio.output(self.PIN_TRIGGER, self._gpio.HIGH)
+        self._clock.sleep(10 / 1000000)  # = 10usec, taken from datasheet.
+        self._gpio.output(self.PIN_TRIGGER, self._gpio.LOW)
 
         # (Phyiscal sensor design should prevent this but) don't want
         # the rx to get triggered by the pulse going out in the tx direction
@@ -98,21 +171,29 @@ class DistanceSensor():
         # and then get stuck in this while loop waiting, lonely, forever.
         #
         # Could do this with a rising edge callback but seems like overkill.
-        start_wait_time = time.time()
-        while GPIO.input(self.PIN_ECHO) == GPIO.LOW:
-            start_wait_time = time.time()
+        #
+        # Look everything up before the busy-waits. Every attribute lookup
+        # inside them costs timing resolution.
+        gpio_input = self._gpio.input
+        clock_time = self._clock.time
+        pin_echo = self.PIN_ECHO
+        low = self._gpio.LOW
+        high = self._gpio.HIGH
+        start_wait_time = clock_time()
+        while gpio_input(pin_echo) == low:
+            start_wait_time = clock_time()
         # Initialise received time in case of race condition: a _very_ short
         # pulse means the next 'while' test fails and we skip the loop.
         # Thank-you unit tests.
         echo_rx_time = start_wait_time
-        while GPIO.input(self.PIN_ECHO) == GPIO.HIGH:
-            echo_rx_time = time.time()
+        while gpio_input(pin_echo) == high:
+            echo_rx_time = clock_time()
         round_trip_time = echo_rx_time - start_wait_time
+        stats.stop('pulse', started)
         return round_trip_time
 
-    def _get_distance(self):
-        """Send an ultrasonic pulse. Use the round trip time taken
-        to calculate (and return) the distance to the nearest thing.
+    def _to_distance(self, round_trip_time):
+        """Return the distance a round trip time means.
 
         Raises:
             InvalidDistanceError if round trip time leads to a calculated
@@ -124,14 +205,72 @@ class DistanceSensor():
         # (Also available in scipy.constants but currently adding the
         # module dependancy is overkill.)
         # Time is for signal to go there and back so divide by 2.
-        distance = 343000 * self._get_pulse_round_trip_time() / 2
+        distance = 343000 * round_trip_time / 2
         if distance < self.DIST_MIN:
+            stats.count('invalid_readings')
             raise self.InvalidDistanceError('Something too close to sensor?')
         elif distance > self.DIST_MAX:
+            # Also what we see if the sensor times out waiting for an echo.
+            stats.count('invalid_readings')
+            stats.count('timeouts')
             raise self.InvalidDistanceError('Nothing in range of sensor?')
         else:
             return distance
 
+    def _get_distance(self):
+        """Send an ultrasonic pulse. Use the round trip time taken
+        to calculate (and return) the distance to the nearest thing.
+
+        Raises:
+            InvalidDistanceError, see _to_distance.
+        """
+        return self._to_distance(self._get_pulse_round_trip_time())
+
+    @staticmethod
+    def _combine(readings):
+        # drop (potential) outliers then return average, to the nearest mm
+        return round((sum(readings) - min(readings) - max(readings)) /
+                     (len(readings) - 2))
+
+    def _get_valid_distances(self, time_budget=None):
+        """Send pulses until there are NUM_READINGS valid distances, or the
+        retries or time run out. Return the valid ones.
+
+        An invalid reading is replaced by another pulse, up to RETRIES of
+        them while within the time budget: time_budget seconds if given,
+        else TIME_BUDGET.
+
+        Raises:
+            InvalidDistanceError as soon as there can't be MIN_VALID.
+        """
+        if time_budget is None:
+            time_budget = self.TIME_BUDGET
+        readings = []
+        pulses = 0
+        max_pulses = self.NUM_READINGS + self.RETRIES
+        deadline = None if time_budget is None else \
+            self._clock.time() + time_budget
+        while len(readings) < self.NUM_READINGS and pulses < max_pulses:
+            if pulses >= self.NUM_READINGS and deadline is not None and \
+                    self._clock.time() >= deadline:
+                break
+            pulses += 1
+            try:
+                readings.append(self._get_distance())
+            except self.InvalidDistanceError as e:
+                # In testing I never saw 4 good readings and 1 invalid one.
+                # So by default something serious is wrong, pass it up.
+                # Stray echoes from foam and splashes are another matter:
+                # give up only once there's no way to get enough.
+                error = e
+                if len(readings) + max_pulses - pulses < self.MIN_VALID:
+                    raise
+        if pulses > self.NUM_READINGS:
+            stats.count('retries', pulses - self.NUM_READINGS)
+        if len(readings) < self.MIN_VALID:
+            raise error
+        return readings
+
     def get_distance(self):
         """Return an estimate in mm of distance to the object nearest to the
         ultrasonic sensor. Rounded to the nearest millimeter.
@@ -139,23 +278,191 @@ class DistanceSensor():
         Takes 5 readings, drops the highest and lowest, and returns an average
         of the rest.
 
+        An invalid reading is replaced by another pulse, up to RETRIES of
+        them while within TIME_BUDGET. If that still leaves fewer than 5,
+        the average is of what there is, as long as there are MIN_VALID.
+
         Raises:
-            InvalidDistanceError if any of the readings indicate a distance
-            that is out of spec.
+            InvalidDistanceError if too many of the readings indicate a
+            distance that is out of spec.
         """
 
-        NUM_READINGS = 5
+        started = stats.start()
+        ret_val = self._combine(self._get_valid_distances())
+        stats.stop('get_distance', started)
+        return ret_val
+
+    def _capture_pulse(self, buf, offset):
+        """Send a pulse and pack its record into buf at offset.
 
+        Unlike _get_pulse_round_trip_time this doesn't trust the sensor to
+        give up: a sensor being characterised may not. The timeout checks
+        cost a little resolution.
+        """
+        gpio_input = self._gpio.input
+        clock_time = self._clock.time
+        pin_echo = self.PIN_ECHO
+        low = self._gpio.LOW
+        high = self._gpio.HIGH
+
+        self._gpio.output(self.PIN_TRIGGER, high)
+        self._clock.sleep(10 / 1000000)
+        self._gpio.output(self.PIN_TRIGGER, low)
+        trigger = rise = clock_time()
+        status = CAPTURE_OK
+        deadline = trigger + CAPTURE_RISE_TIMEOUT
+        while gpio_input(pin_echo) == low:
+            rise = clock_time()
+            if rise > deadline:
+                status = CAPTURE_NO_RISE
+                break
+        fall = rise
+        if status == CAPTURE_OK:
+            deadline = rise + CAPTURE_FALL_TIMEOUT
+            while gpio_input(pin_echo) == high:
+                fall = clock_time()
+                if fall > deadline:
+                    status = CAPTURE_NO_FALL
+                    break
+        CAPTURE_RECORD.pack_into(buf, offset, trigger, rise, fall, status)
+
+    def capture(self, f, count=None, interval=60 / 1000,
+                block=CAPTURE_BLOCK):
+        """Fire pulses, write every echo's raw edge times to f.
+
+        Pulses start interval seconds apart, or as soon as the last one is
+        done if it took longer. The default is the shortest the datasheet
+        allows. Records go into a buffer allocated up front and are
+        written a block at a time, so the file system doesn't get in the
+        way of the timing. Whatever is in the buffer is written if
+        interrupted, eg with Ctrl-C.
+
+        Args:
+            f: binary file to write to.
+            count: pulses to send. None for until interrupted.
+            interval: seconds between the starts of pulses.
+            block: pulses per write.
+
+        Returns:
+            the number of pulses written.
+        """
+        f.write(CAPTURE_HEADER.pack(CAPTURE_MAGIC, CAPTURE_VERSION,
+                                    CAPTURE_RECORD.size))
+        size = CAPTURE_RECORD.size
+        buf = bytearray(block * size)
+        view = memoryview(buf)
+        written = in_buf = 0
+        next_trigger = self._clock.time()
+        try:
+            while count is None or written + in_buf < count:
+                wait = next_trigger - self._clock.time()
+                if wait > 0:
+                    self._clock.sleep(wait)
+                started = self._clock.time()
+                self._capture_pulse(buf, in_buf * size)
+                next_trigger = max(started + interval, self._clock.time())
+                in_buf += 1
+                if in_buf == block:
+                    f.write(view)
+                    written += in_buf
+                    in_buf = 0
+        finally:
+            f.write(view[:in_buf * size])
+            written += in_buf
+        return written
+
+    def get_round_trip_times(self):
+        """Send NUM_READINGS pulses. Return their raw round trip times.
+
+        No checking or sums: that's distance_from_round_trip_times, which
+        needn't be in the same process, or even on the same machine.
+        """
+        return [self._get_pulse_round_trip_time()
+                for _ in range(self.NUM_READINGS)]
+
+    def distance_from_round_trip_times(self, round_trip_times):
+        """Return what get_distance would have for these round trip times.
+
+        No retries, the pulses have been sent: MIN_VALID of them must be
+        in spec.
+
+        Raises:
+            InvalidDistanceError if too many of them are out of spec.
+        """
         readings = []
-        for _ in range(NUM_READINGS):
+        for round_trip_time in round_trip_times:
             try:
-                readings.append(self._get_distance())
-            except self.InvalidDistanceError:
-                # In testing I never saw 4 good readings and 1 invalid one.
-                # Therfore don't just ignore one and try and get 4 valid
-                # readings. Something serious is wrong, pass it up.
-                raise
+                readings.append(self._to_distance(round_trip_time))
+            except self.InvalidDistanceError as e:
+                error = e
+        if len(readings) < min(self.MIN_VALID, len(round_trip_times)):
+            raise error
+        return self._combine(readings)
 
-        # drop (potential) outliers then return average, to the nearest mm
-        ret_val = round((sum(readings) - min(readings) - max(readings))/3)
-        return ret_val
+
+class EdgeDistanceSensor(DistanceSensor):
+    """An HC-SR04 timed by waiting for edges rather than busy-waiting.
+
+    RPi.GPIO's wait_for_edge blocks in C, so the CPU is free while the echo
+    is out. The price is accuracy: each time is taken when Python wakes up
+    after the edge, not at the edge itself.
+    """
+    # Give up waiting for an edge after this many ms. The sensor itself
+    # gives up after 38.
+    EDGE_TIMEOUT = 100
+
+    def _get_pulse_round_trip_time(self):
+        """Send an ultrasonic pulse. Return the time it takes to come back.
+
+        Infinite if an edge never comes.
+        """
+        self._clock.sleep(60 / 1000)  # = 60msec, as DistanceSensor.
+        started = stats.start()
+        gpio = self._gpio
+        gpio.output(self.PIN_TRIGGER, gpio.HIGH)
+        self._clock.sleep(10 / 1000000)
+        gpio.output(self.PIN_TRIGGER, gpio.LOW)
+
+        round_trip_time = float('inf')
+        # If we were slow getting here the echo pin may already be high.
+        if gpio.input(self.PIN_ECHO) == gpio.HIGH or gpio.wait_for_edge(
+                self.PIN_ECHO, gpio.RISING, timeout=self.EDGE_TIMEOUT):
+            rise = self._clock.time()
+            if gpio.wait_for_edge(self.PIN_ECHO, gpio.FALLING,
+                                  timeout=self.EDGE_TIMEOUT):
+                round_trip_time = self._clock.time() - rise
+        stats.stop('pulse', started)
+        return round_trip_time
+
+
+def main(argv=None):
+    """Capture raw echoes from the command line."""
+    parser = argparse.ArgumentParser(
+        description='Capture raw HC-SR04 echoes. Analyse them with '
+                    'analyse_capture.py.')
+    parser.add_argument('capture', help='file to write')
+    parser.add_argument('-n', '--count', type=int,
+                        help='pulses to send (default until Ctrl-C)')
+    parser.add_argument('-i', '--interval', type=float, default=60 / 1000,
+                        help='seconds between pulses (default 0.06)')
+    parser.add_argument('--simulate', type=float, metavar='MM',
+                        help='capture from a simulated sensor instead')
+    args = parser.parse_args(argv)
+
+    if args.simulate is None:
+        sensor = DistanceSensor()
+    else:
+        import drivers
+        # No poll_time: a simulated capture needn't take real CPU.
+        sensor = drivers.sensor('simulated', distance=args.simulate,
+                                noise=2, poll_time=None)
+    with sensor.open(), open(args.capture, 'wb') as f:
+        try:
+            count = sensor.capture(f, args.count, args.interval)
+        except KeyboardInterrupt:
+            count = (f.tell() - CAPTURE_HEADER.size) // CAPTURE_RECORD.size
+    print(f'Captured {count} pulses to {args.capture}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+#!/usr/bin/python3
+"""Timers and counters for the sampler's hot path.
+
+Stages of each cycle (pulse capture, get_distance, volume mapping,
+insert_data) are timed into fixed-bucket latency histograms. Counters
+keep track of invalid readings, timeouts and send failures. Gauges hold
+the latest value of something, eg how many samples were waiting in the
+--split ring buffer. After each
+pass of its scheduler, sampling every tank that was due, lolat publishes
+the lot, as the 'lolat_internal' measurement, through its normal Telegraf
+client, then starts a fresh interval.
+
+Everything goes through the module level 'stats' object:
+
+    started = stats.start()
+    ... do the work ...
+    stats.stop('get_distance', started)
+    stats.count('invalid')
+    stats.gauge('ring_depth', 3)
+
+Until stats.enable() is called these do nothing but return, so the calls
+can stay in the code (and instrumentation on in production) for free.
+"""
+
+import time
+from bisect import bisect_left
+
+# Upper bounds of the histogram buckets, in seconds. A final bucket holds
+# everything slower. Fixed, so results from different Pis and runs line up.
+# Covers a single GPIO read (~us) to a full 5 pulse reading (~0.3s+).
+LATENCY_BUCKETS = (1e-5, 1e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2,
+                   1e-1, 2.5e-1, 5e-1, 1.0, 2.5)
+
+MEASUREMENT = 'lolat_internal'
+
+
+class Histogram():
+    """Counts of observed latencies in fixed buckets, plus sum and max."""
+    __slots__ = ('counts', 'total', 'sum', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.total += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        """Estimate the q quantile (0 - 1) as the upper bound of its bucket.
+
+        Returns the max for the overflow bucket and 0.0 if empty.
+        """
+        rank = q * self.total
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class Stats():
+    """Histograms per stage, counters and gauges for one publishing
+    interval."""
+    def __init__(self):
+        self.enabled = False
+        self.reset()
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def reset(self):
+        """Start a new interval."""
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self.interval_start = time.monotonic()
+
+    def start(self):
+        """Return a start time to pass to stop(). 0 if disabled."""
+        if not self.enabled:
+            return 0.0
+        return time.perf_counter()
+
+    def stop(self, stage, started):
+        """Record the time since started against stage."""
+        if not self.enabled:
+            return
+        elapsed = time.perf_counter() - started
+        try:
+            self.histograms[stage].observe(elapsed)
+        except KeyError:
+            histogram = self.histograms[stage] = Histogram()
+            histogram.observe(elapsed)
+
+    def count(self, name, n=1):
+        if not self.enabled:
+            return
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name, value):
+        """Set name to value. The last set in an interval is published."""
+        if not self.enabled:
+            return
+        self.gauges[name] = value
+
+    def fields(self):
+        """Return this interval's results as field values.
+
+        Per stage: <stage>_count, _mean, _p50, _p90, _p99 and _max, times
+        in seconds. Per counter and gauge: its name.
+        """
+        fields = {'interval': time.monotonic() - self.interval_start}
+        for stage, histogram in sorted(self.histograms.items()):
+            fields[f'{stage}_count'] = histogram.total
+            fields[f'{stage}_mean'] = histogram.sum / histogram.total
+            for q in (50, 90, 99):
+                fields[f'{stage}_p{q}'] = float(histogram.quantile(q / 100))
+            fields[f'{stage}_max'] = histogram.max
+        fields.update(self.counters)
+        fields.update(self.gauges)
+        return fields
+
+    def publish(self, client):
+        """Send this interval's results via client, then start a new one.
+
+        Does nothing if disabled. A failure to send is counted, not raised:
+        instrumentation mustn't stop the sampler.
+        """
+        if not self.enabled:
+            return
+        fields = self.fields()
+        self.reset()
+        try:
+            client.metric(MEASUREMENT, fields)
+        except OSError:
+            self.count('send_failures')
+
+
+# The one used by the sampler.
+stats = Stats()
@@ -0,0 +1,238 @@
+#!/usr/bin/python3
+"""Format and parse points in InfluxDB line protocol, as used by Telegraf.
+
+pytelegraf does this for us when we send one point at a time. Tools that
+write in bulk (eg backfill.py) need to build the lines themselves so they
+can send or save thousands of points in one go. Test tools standing in for
+Telegraf (eg tests/telegraf_listener.py) need to parse them.
+
+Line protocol reference:
+https://docs.influxdata.com/influxdb/v1.8/write_protocols/line_protocol_reference/
+"""
+
+import socket
+
+
+def _escape_measurement(name):
+    return name.replace(',', r'\,').replace(' ', r'\ ')
+
+
+def _escape_key(key):
+    """Escape a tag key, tag value or field key."""
+    return key.replace(',', r'\,').replace('=', r'\=').replace(' ', r'\ ')
+
+
+def format_value(value):
+    """Return a field value in line protocol syntax.
+
+    Integers get an 'i' suffix so Influx stores them as integers, just like
+    pytelegraf does. (See the comment on 'round' in lolat.map_volume.)
+    """
+    # bool is a subclass of int so test for it first.
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, int):
+        return f'{value}i'
+    if isinstance(value, float):
+        return repr(value)
+    value = str(value).replace('\\', '\\\\').replace('"', r'\"')
+    return f'"{value}"'
+
+
+def format_tags(tags):
+    """Return the ',key=value' tag section, sorted by key as Influx prefers.
+
+    Returns an empty string if there are no tags.
+    """
+    if not tags:
+        return ''
+    return ''.join(f',{_escape_key(k)}={_escape_key(str(tags[k]))}'
+                   for k in sorted(tags))
+
+
+def format_prefix(measurement, tags=None):
+    """Return the measurement and tags part of a line.
+
+    Bulk writers compute this once and reuse it for every point.
+    """
+    return _escape_measurement(measurement) + format_tags(tags)
+
+
+def format_line(measurement, values, tags=None, timestamp=None):
+    """Return one point as a line of line protocol, without the newline.
+
+    Args:
+        measurement: measurement name, eg 'lolat'.
+        values: dict of field name to value. Must not be empty.
+        tags: optional dict of tag name to value.
+        timestamp: optional int, nanoseconds since the epoch. If omitted
+            the server assigns the time of arrival.
+
+    Raises:
+        ValueError if there are no field values.
+    """
+    if not values:
+        raise ValueError('A point needs at least one field value.')
+    fields = ','.join(f'{_escape_key(k)}={format_value(v)}'
+                      for k, v in values.items())
+    line = f'{format_prefix(measurement, tags)} {fields}'
+    if timestamp is not None:
+        line += f' {int(timestamp)}'
+    return line
+
+
+class LineProtocolError(ValueError):
+    """A line that Telegraf would reject."""
+    pass
+
+
+def _scan(line, start, stop, in_fields=False):
+    """Return index of the first unescaped stop character from start.
+
+    In the field section commas and spaces inside "quoted strings" don't
+    count. Returns len(line) if there isn't one.
+    """
+    if '\\' not in line and not (in_fields and '"' in line):
+        # Nothing escaped or quoted, the usual case. Let str do the work.
+        i = line.find(stop, start)
+        return len(line) if i < 0 else i
+    i = start
+    quoted = False
+    while i < len(line):
+        c = line[i]
+        if c == '\\':
+            i += 2
+            continue
+        if in_fields and c == '"':
+            quoted = not quoted
+        elif not quoted and c == stop:
+            return i
+        i += 1
+    if quoted:
+        raise LineProtocolError(f'Unterminated string: {line}')
+    return i
+
+
+def _split(line, sep, in_fields=False):
+    parts = []
+    start = 0
+    while True:
+        end = _scan(line, start, sep, in_fields)
+        parts.append(line[start:end])
+        if end == len(line):
+            return parts
+        start = end + 1
+
+
+def _unescape(text):
+    out = []
+    i = 0
+    while i < len(text):
+        if text[i] == '\\' and i + 1 < len(text):
+            i += 1
+        out.append(text[i])
+        i += 1
+    return ''.join(out)
+
+
+def _key_value(pair, line):
+    end = _scan(pair, 0, '=')
+    key, sep, value = pair[:end], pair[end:end + 1], pair[end + 1:]
+    if not key or not sep or not value:
+        raise LineProtocolError(f'Expected key=value, got {pair!r}: {line}')
+    return _unescape(key), value
+
+
+def parse_value(text):
+    """Return the Python value of a field value in line protocol syntax.
+
+    Raises:
+        LineProtocolError if it isn't a valid field value.
+    """
+    if text.startswith('"'):
+        if len(text) < 2 or not text.endswith('"'):
+            raise LineProtocolError(f'Bad string value: {text}')
+        return _unescape(text[1:-1])
+    if text in ('t', 'T', 'true', 'True', 'TRUE'):
+        return True
+    if text in ('f', 'F', 'false', 'False', 'FALSE'):
+        return False
+    try:
+        if text[-1] in 'iu':
+            return int(text[:-1])
+        return float(text)
+    except (ValueError, IndexError):
+        raise LineProtocolError(f'Bad field value: {text!r}') from None
+
+
+def parse_line(line):
+    """Parse one line of line protocol.
+
+    Returns:
+        (measurement, tags, values, timestamp): tags and values are dicts,
+        timestamp is an int (ns) or None.
+
+    Raises:
+        LineProtocolError if Telegraf would reject the line.
+    """
+    line = line.rstrip('\n')
+    key_end = _scan(line, 0, ' ')
+    field_end = _scan(line, key_end + 1, ' ', in_fields=True)
+    if key_end >= len(line) or field_end == key_end + 1:
+        raise LineProtocolError(f'No fields: {line}')
+
+    measurement, *tag_pairs = _split(line[:key_end], ',')
+    if not measurement:
+        raise LineProtocolError(f'No measurement: {line}')
+    tags = {}
+    for pair in tag_pairs:
+        key, value = _key_value(pair, line)
+        tags[key] = _unescape(value)
+
+    values = {}
+    for pair in _split(line[key_end + 1:field_end], ',', in_fields=True):
+        key, value = _key_value(pair, line)
+        values[key] = parse_value(value)
+
+    timestamp = line[field_end + 1:].strip()
+    if timestamp:
+        try:
+            timestamp = int(timestamp)
+        except ValueError:
+            raise LineProtocolError(f'Bad timestamp: {line}') from None
+    else:
+        timestamp = None
+    return _unescape(measurement), tags, values, timestamp
+
+
+class SocketClient():
+    """Send points to Telegraf's socket_listener, one datagram/write each.
+
+    A stand-in for pytelegraf's TelegrafClient with the same metric() call,
+    for where pytelegraf isn't installed or TCP is wanted.
+
+    Args:
+        host, port: of the socket_listener.
+        tags: dict of tags added to every point.
+        protocol: 'udp' (as pytelegraf) or 'tcp'.
+    """
+    def __init__(self, host='localhost', port=8094, tags=None,
+                 protocol='udp'):
+        self.host = host
+        self.port = port
+        self.tags = tags or {}
+        if protocol == 'udp':
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._sock.connect((host, port))
+        elif protocol == 'tcp':
+            self._sock = socket.create_connection((host, port))
+        else:
+            raise ValueError(f"protocol should be 'udp' or 'tcp': {protocol}")
+
+    def metric(self, measurement_name, values, tags=None, timestamp=None):
+        all_tags = dict(self.tags, **tags) if tags else self.tags
+        line = format_line(measurement_name, values, all_tags, timestamp)
+        self._sock.sendall((line + '\n').encode())
+
+    def close(self):
+        self._sock.close()
@@ -8,20 +8,46 @@ testing.
 Simply start up 'screen' and invoke it from the command line.
 """
 
+import argparse
+import contextlib
+import signal
 import time
-from hc_sr04 import DistanceSensor
-try:
-    from telegraf.client import TelegrafClient
-except ImportError:
-    # Unit tests won't run in production envrionment.
-    from mock_telegraf import TelegrafClient
+import config
+import drivers
+from config import VOLUME_SLOPE, VOLUME_OFFSET, PERIOD, ConfigError
+from instrumentation import stats
+from metrics_server import Health, serve
+import profiling
+import snapshot
+from split_sampler import SplitSampler, consume
 
+# Seconds between looks at the config file for changes.
+CONFIG_CHECK = 1.0
 
-def db_handle():
-    client = TelegrafClient(host='localhost', port=8094, tags={'src': 'bucket'})
+# The quality field sent with every point. An invalid point has no reading
+# or volume. A carried one repeats the last good reading and volume.
+GOOD = 'good'
+CARRIED = 'carried'
+INVALID = 'invalid'
+
+# Where to keep tanks' state between runs, see snapshot.py. A dot file so
+# that 'make install' leaves it alone.
+STATE_FILE = '.lolat_state'
+
+
+def db_handle(sink='telegraf'):
+    client = drivers.sink(sink, host='localhost', port=8094,
+                          tags={'src': 'bucket'})
     return client
 
 
+def make_client(sink, backend=None):
+    """Build the client for a config.SinkConfig, optionally with a
+    different backend."""
+    return drivers.sink(backend or sink.backend, tags=dict(sink.tags),
+                        **dict(sink.options))
+
+
 def get_reading(sensor):
     reading = sensor.get_distance()
     return reading
@@ -31,39 +57,422 @@ def map_volume(reading):
     # The 'round' is important to stop Influx declaring the
     # measurement type 'float'. If it does that then it will later
     # reject an attempted insertion of an int.
-
-    # These constants dervied by visual inspection of a best fit line
-    # on a Google sheet of the combined calibration data.
-    return round((-22.93 * reading) + 2522)
+    return round((VOLUME_SLOPE * reading) + VOLUME_OFFSET)
 
 
 def get_reading_and_volume(sensor, get_volume_func):
+    """Return (reading, volume), or (None, None) if the reading was
+    invalid."""
     try:
         reading = get_reading(sensor)
+        started = stats.start()
         volume = get_volume_func(reading)
+        stats.stop('map_volume', started)
     except sensor.InvalidDistanceError:
-        reading = 0
-        volume = 0
+        # Not 0: a fake zero is indistinguishable from an empty tank.
+        reading = None
+        volume = None
 
     return reading, volume
 
 
-def insert_data(client, reading, volume):
-    client.metric('lolat', {'reading': reading, 'volume': volume})
-    print(f'Sent to db: reading : {reading}, volume: {volume}')
+def insert_data(client, reading, volume, timestamp=None, tags=None,
+                quality=None):
+    """Send a point. A reading of None sends quality only.
+
+    quality defaults to GOOD, or INVALID if there's no reading.
+    """
+    started = stats.start()
+    if quality is None:
+        quality = INVALID if reading is None else GOOD
+    values = {} if reading is None else {'reading': reading,
+                                         'volume': volume}
+    values['quality'] = quality
+    # Only pass what's needed: not every client takes them.
+    extras = {}
+    if tags:
+        extras['tags'] = tags
+    if timestamp is not None:
+        # Sent later than sampled (--split): say when it was sampled.
+        extras['timestamp'] = timestamp
+    try:
+        client.metric('lolat', values, **extras)
+    except OSError:
+        stats.count('send_failures')
+        raise
+    stats.stop('insert_data', started)
+    print(f'Sent to db: reading : {reading}, volume: {volume}, '
+          f'quality: {quality}')
+
+
+def send_sample(client, health, reading, volume, timestamp=None,
+                tank=None, last=None):
+    """Send a reading and volume, and record how it went.
+
+    An invalid reading (None) is sent as the tank's on_invalid says: as
+    invalid, or as last carried forward.
+
+    Args:
+        tank: the config.TankConfig it's for. None for the original
+            bucket, which sends invalid readings as invalid.
+        last: the last good (reading, volume, ...), or None.
+
+    Returns:
+        (reading, volume, quality) as sent.
+    """
+    name = 'bucket' if tank is None else tank.name
+    quality = GOOD
+    if reading is None:
+        health.record_error('invalid_readings')
+        if tank is not None and tank.on_invalid == 'carry' and last:
+            reading, volume = last[:2]
+            quality = CARRIED
+        else:
+            quality = INVALID
+    else:
+        health.record_sample(name, reading, volume)
+    insert_data(client, reading, volume, timestamp,
+                None if tank is None else dict(tank.tags), quality)
+    return reading, volume, quality
+
+
+def sample_once(sensor, client, health, tank=None, last=None):
+    """One sampling cycle: read, map, send and record how it went.
+
+    tank: the config.TankConfig to map and tag with. None for the original
+    bucket. last: as send_sample.
+
+    Returns:
+        (reading, volume, quality) as sent.
+    """
+    cycle_start = time.monotonic()
+    reading, volume = get_reading_and_volume(
+        sensor, map_volume if tank is None else tank.map_volume)
+    sent = send_sample(client, health, reading, volume, tank=tank,
+                       last=last)
+    health.record_cycle(time.monotonic() - cycle_start)
+    return sent
+
+
+def run_split(sensor, client, health, period=PERIOD, cpu=None,
+              max_samples=None, tank=None):
+    """Sample in a separate process, map and send in this one.
+
+    See split_sampler.py. Cycle time in health becomes the time from
+    sampling to sent. lolat_internal is published once per batch of
+    samples read, with the ring buffer's depth and overruns. Health gets
+    them too.
+    """
+    get_volume = map_volume if tank is None else tank.map_volume
+    if tank is not None:
+        health.expect({tank.name: period})
+    last = None
+
+    def handle_sample(distance, sampled_at):
+        nonlocal last
+        reading = distance
+        volume = None
+        if reading is not None:
+            started = stats.start()
+            volume = get_volume(reading)
+            stats.stop('map_volume', started)
+        sent = send_sample(client, health, reading, volume,
+                           round(sampled_at * 1e9), tank, last)
+        if sent[2] == GOOD:
+            last = sent
+        health.record_cycle(time.time() - sampled_at)
+
+    with SplitSampler(sensor, period, cpu) as sampler:
+        def handle_batch(depth):
+            health.record_queue(depth, sampler.ring.overruns)
+            stats.publish(client)
+
+        consume(sampler, sensor, handle_sample, max_samples=max_samples,
+                handle_batch=handle_batch)
+
+
+class Tank():
+    """A configured tank: its sensor, opened, and when it's next due.
+
+    Args:
+        config: its config.TankConfig.
+        due: time.monotonic() of its next sample.
+        override: optional (sensor backend, options) replacing the
+            configured sensor, see drivers.sensor_override.
+    """
+    def __init__(self, config, due, override=None):
+        self.config = config
+        self.due = due
+        # Last good (reading, volume, time.time()), or None.
+        self.last = None
+        self.sensor = config.make_sensor(override)
+        self._opened = contextlib.ExitStack()
+        self._opened.enter_context(self.sensor.open())
+
+    def close(self):
+        self._opened.close()
+
+    def state(self, now, now_monotonic):
+        """Return a snapshot.TankState of where this tank is up to."""
+        reading, volume, sampled_at = self.last or (0, 0, 0.0)
+        return snapshot.TankState(self.config.period, sampled_at,
+                                  round(reading), round(volume),
+                                  now + self.due - now_monotonic)
 
+    def restore(self, state, health, now, now_monotonic):
+        """Carry on from a snapshot.TankState saved by an earlier run.
 
-def main():
+        Its last sample goes into health, as if just taken. It's next due
+        when it would have been, unless its period has changed since, and
+        never more than a period from now.
+        """
+        if state.sampled_at:
+            self.last = (state.reading, state.volume, state.sampled_at)
+            health.record_sample(self.config.name, state.reading,
+                                 state.volume, state.sampled_at)
+        if state.period == self.config.period:
+            due = state.due
+        elif state.sampled_at:
+            due = state.sampled_at + self.config.period
+        else:
+            return
+        self.due = now_monotonic + min(max(due - now, 0),
+                                       self.config.period)
+
+
+def open_tanks(configs, override=None):
+    """Return a dict of Tanks by name for TankConfigs, all due now."""
+    now = time.monotonic()
+    return {tank.name: Tank(tank, now, override) for tank in configs}
+
+
+def apply_config(tanks, old, new, health, override=None):
+    """Update tanks, a dict of Tanks by name, from config old to new.
+
+    Only tanks whose config changed are rebuilt. They keep their place in
+    the schedule, unless their period changed. The rest carry on as if
+    nothing happened. A tank that can't be rebuilt is dropped, and
+    counted as a config error.
+    """
+    added, changed, removed = config.changes(old, new)
+    new_tanks = {tank.name: tank for tank in new.tanks}
+    now = time.monotonic()
+    for name in removed:
+        tanks.pop(name).close()
+        health.tanks.pop(name, None)
+    # Close every changed tank before opening any: a new one may take pins
+    # another old one holds, eg when two tanks swap pins, and closing that
+    # old one afterwards would reset them under it.
+    old_tanks = {name: tanks.pop(name) for name in changed if name in tanks}
+    for old_tank in old_tanks.values():
+        old_tank.close()
+    for name in changed + added:
+        due = now
+        old_tank = old_tanks.get(name)
+        if old_tank and old_tank.config.period == new_tanks[name].period:
+            due = old_tank.due
+        try:
+            tanks[name] = Tank(new_tanks[name], due, override)
+            if old_tank:
+                tanks[name].last = old_tank.last
+        except Exception as e:
+            print(f'Tank {name} dropped: {e}')
+            health.record_error('config_errors')
+    expect_tanks(health, tanks, new)
+    print(f'Config reloaded. Added {added}, changed {changed}, '
+          f'removed {removed}.')
+
+
+def expect_tanks(health, tanks, config):
+    """Tell health every tank in config, and which aren't in tanks, a
+    dict of Tanks by name, because they couldn't be built."""
+    health.expect({tank.name: tank.period for tank in config.tanks},
+                  [tank.name for tank in config.tanks
+                   if tank.name not in tanks])
+
+
+def restore_state(tanks, path, health):
+    """Restore tanks from the snapshot at path, if there is one."""
+    try:
+        _, states = snapshot.load(path)
+    except snapshot.SnapshotError as e:
+        print(f'Starting cold: {e}')
+        return
+    now, now_monotonic = time.time(), time.monotonic()
+    for name, state in states.items():
+        if name in tanks:
+            tanks[name].restore(state, health, now, now_monotonic)
+
+
+def save_state(tanks, path, health):
+    """Snapshot tanks to path. A failure is counted, not raised."""
+    now, now_monotonic = time.time(), time.monotonic()
+    states = {name: tank.state(now, now_monotonic)
+              for name, tank in tanks.items()}
+    try:
+        snapshot.save(path, states, now)
+    except OSError as e:
+        print(f'State not saved: {e}')
+        health.record_error('state_save_failures')
+
+
+def run(watcher, health, override=None, sink=None, max_samples=None,
+        check_interval=CONFIG_CHECK, reload_requested=None,
+        state_path=None):
+    """Sample every configured tank, each at its own period, for ever.
+
+    Watches the config for changes, and reloads it when
+    reload_requested() is True, eg after a SIGHUP. lolat_internal is
+    published once per pass: after sampling every tank that was due.
+
+    Args:
+        watcher: config.ConfigWatcher.
+        health: metrics_server.Health.
+        override: optional (sensor backend, options) for every tank.
+        sink: optional sink backend to use instead of the configured one.
+        max_samples: stop after this many. None for never.
+        check_interval: seconds between looks at the config file.
+        reload_requested: function returning True to force a reload.
+        state_path: file to save tanks' state to after every sample, and
+            to restore it from first. None for neither.
+    """
+    current = watcher.config
+    client = make_client(current.sink, sink)
+    tanks = open_tanks(current.tanks, override)
+    expect_tanks(health, tanks, current)
+    if state_path:
+        restore_state(tanks, state_path, health)
+    samples = 0
+    # Sampled since lolat_internal was last published.
+    unpublished = False
+    try:
+        while max_samples is None or samples < max_samples:
+            now = time.monotonic()
+            tank = min(tanks.values(), key=lambda tank: tank.due,
+                       default=None)
+            if tank and tank.due <= now:
+                reading, volume, quality = sample_once(
+                    tank.sensor, client, health, tank.config, tank.last)
+                if quality == GOOD:
+                    tank.last = (reading, volume, time.time())
+                samples += 1
+                unpublished = True
+                tank.due += tank.config.period
+                if tank.due < now:
+                    # Fell behind. Don't try to catch up.
+                    tank.due = now
+                if state_path:
+                    save_state(tanks, state_path, health)
+                continue
+
+            # Every tank that was due has been sampled: one point for the
+            # lot, not one per tank.
+            if unpublished:
+                stats.publish(client)
+                unpublished = False
+            time.sleep(check_interval if tank is None
+                       else min(tank.due - now, check_interval))
+            try:
+                if reload_requested and reload_requested():
+                    new = watcher.reload()
+                else:
+                    new = watcher.check()
+            except ConfigError as e:
+                print(f'Config not reloaded: {e}')
+                health.record_error('config_errors')
+                continue
+            if new:
+                if new.sink != current.sink:
+                    old_client = client
+                    client = make_client(new.sink, sink)
+                    if hasattr(old_client, 'close'):
+                        old_client.close()
+                apply_config(tanks, current, new, health, override)
+                current = new
+        if unpublished:
+            stats.publish(client)
+    finally:
+        for tank in tanks.values():
+            tank.close()
+
+
+def main(argv=None):
     """Measure the liquid level in a bucket and store it in a databse."""
 
-    client = db_handle()
-    sensor = DistanceSensor()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--no-instrumentation', action='store_true',
+                        help="don't publish lolat_internal timings")
+    parser.add_argument('--metrics-port', type=int,
+                        help='serve /metrics and /health on this port')
+    parser.add_argument('--metrics-host', default='localhost',
+                        help='address to serve them on (default localhost)')
+    parser.add_argument('--split', action='store_true',
+                        help='capture pulses in a separate process')
+    parser.add_argument('--cpu', type=int,
+                        help='with --split, pin the sampler to this core')
+    parser.add_argument('-c', '--config',
+                        help='tanks and where to send readings, see '
+                             'config.py (default one bucket)')
+    parser.add_argument('--state', default=STATE_FILE,
+                        help=f'file to keep tank state in between runs '
+                             f'(default {STATE_FILE}, "" for none)')
+    parser.add_argument('--sink',
+                        help=f'where to send readings: '
+                             f'{", ".join(drivers.SINKS)} or '
+                             f'module:attribute (default telegraf, or as '
+                             f'configured)')
+    drivers.add_arguments(parser)
+    profiling.add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    try:
+        watcher = config.ConfigWatcher(args.config)
+    except ConfigError as e:
+        parser.error(str(e))
+    override = drivers.sensor_override(args)
+    stats.enable(not args.no_instrumentation)
+    health = Health(max(tank.period for tank in watcher.config.tanks))
+    if args.metrics_port:
+        serve(health, args.metrics_host, args.metrics_port)
+
+    if args.split or args.profile:
+        tanks = watcher.config.tanks
+        client = make_client(watcher.config.sink, args.sink)
+        if args.split:
+            if len(tanks) > 1:
+                parser.error('--split samples one tank only')
+            sensor = tanks[0].make_sensor(override)
+            if not hasattr(sensor, 'get_round_trip_times'):
+                parser.error("--split can't sample a fused sensor")
+            run_split(sensor, client, health, tanks[0].period, args.cpu,
+                      tank=tanks[0])
+            return
+        with contextlib.ExitStack() as opened:
+            sensors = [
+                (opened.enter_context(tank.make_sensor(override).open()),
+                 tank)
+                for tank in tanks]
+
+            def cycle():
+                for sensor, tank in sensors:
+                    sample_once(sensor, client, health, tank)
+                stats.publish(client)
+            # Back to back, no sleeping: it's the work we want to see.
+            profiling.run_from_arguments(args, cycle)
+        return
+
+    # A SIGHUP reloads the config now rather than when it's next checked.
+    hangups = []
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, lambda *_: hangups.append(True))
+
+    def reload_requested():
+        requested = bool(hangups)
+        hangups.clear()
+        return requested
 
-    with sensor.open():
-        while True:
-            reading, volume = get_reading_and_volume(sensor, map_volume)
-            insert_data(client, reading, volume)
-            time.sleep(15 * 60)
+    run(watcher, health, override, args.sink,
+        reload_requested=reload_requested, state_path=args.state)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,212 @@
+#!/usr/bin/python3
+"""Local HTTP metrics and health endpoint for the running sampler.
+
+Instead of watching the prints in a 'screen' session, point a browser,
+curl or Prometheus at the Pi:
+- /metrics: Prometheus text format. Level per tank, last sample age,
+  whether each tank is up, cycle times, the --split queue depth and error
+  counts.
+- /health: 200 if every tank has been sampled recently, 503 if not.
+
+The sampler records into a Health object. Collection is lock free. The
+sampler is the only writer. Each value it records is immutable: a
+namedtuple per tank, a number, a frozenset. It stores them in the tanks
+and errors dicts in place; the expected dict it only ever replaces whole.
+The server thread copies the dicts it reads in place; under the GIL a
+dict copy is atomic, so it sees a consistent snapshot and never a dict
+changing under it. Nothing is lost, and a scrape can never hold up a
+sample.
+"""
+
+import json
+import threading
+import time
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Latest sample for one tank. time is from time.time().
+TankSample = namedtuple('TankSample', ['reading', 'volume', 'time'])
+
+
+class Health():
+    """What the sampler is up to. Written by the sampler, read by scrapes.
+
+    Args:
+        period: seconds between samples, for tanks not given to expect().
+            A tank is unhealthy once its last sample is more than two
+            periods old.
+    """
+    def __init__(self, period=15 * 60):
+        self.period = period
+        self.started = time.time()
+        self.tanks = {}
+        # (period, time.time() first expected) by tank name, see expect().
+        self.expected = {}
+        self.dropped = frozenset()
+        self.errors = {}
+        self.cycles = 0
+        self.last_cycle_time = 0.0
+        self.max_cycle_time = 0.0
+        # Samples waiting in the --split ring buffer when last read.
+        self.queue_depth = 0
+
+    def record_sample(self, tank, reading, volume, now=None):
+        self.tanks[tank] = TankSample(reading, volume,
+                                      time.time() if now is None else now)
+
+    def expect(self, periods, dropped=(), now=None):
+        """Set the tanks there should be samples from.
+
+        Until a tank's first sample it's judged from when it was first
+        expected, so one that never gives a valid reading still shows up,
+        as unhealthy.
+
+        Args:
+            periods: dict of every configured tank's period by name.
+            dropped: names of those that couldn't be set up. Unhealthy
+                until they are.
+        """
+        now = time.time() if now is None else now
+        expected = self.expected
+        self.expected = {name: (period, expected.get(name, (0, now))[1])
+                         for name, period in periods.items()}
+        self.dropped = frozenset(dropped)
+
+    def record_error(self, name):
+        self.errors[name] = self.errors.get(name, 0) + 1
+
+    def record_queue(self, depth, overruns):
+        """Record the --split ring buffer's depth, and its overruns so
+        far."""
+        self.queue_depth = depth
+        if overruns:
+            self.errors['ring_overruns'] = overruns
+
+    def record_cycle(self, seconds):
+        self.cycles += 1
+        self.last_cycle_time = seconds
+        if seconds > self.max_cycle_time:
+            self.max_cycle_time = seconds
+
+    def tank_health(self, now=None):
+        """Return a dict of True by tank name for each tank sampled in
+        the last two of its periods, else False.
+
+        The tanks are those expected, or if none are those sampled so far.
+        A dropped tank is never healthy.
+        """
+        now = time.time() if now is None else now
+        tanks = self.tanks.copy()
+        expected = self.expected
+        if not expected:
+            return {name: now - sample.time < 2 * self.period
+                    for name, sample in tanks.items()}
+        dropped = self.dropped
+        health = {}
+        for name, (period, since) in expected.items():
+            last = tanks[name].time if name in tanks else since
+            health[name] = name not in dropped and now - last < 2 * period
+        return health
+
+    def is_healthy(self, now=None):
+        """True if every tank has been sampled in the last two of its
+        periods.
+
+        With no tanks yet, healthy for two periods after starting.
+        """
+        now = time.time() if now is None else now
+        health = self.tank_health(now)
+        if not health:
+            return now - self.started < 2 * self.period
+        return all(health.values())
+
+
+def _metric(lines, name, kind, help_text, samples):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} {kind}')
+    for labels, value in samples:
+        label_text = ','.join(f'{k}="{v}"' for k, v in labels)
+        lines.append(f'{name}{{{label_text}}} {value}' if label_text
+                     else f'{name} {value}')
+
+
+def render(health, now=None):
+    """Return the Prometheus text exposition of health."""
+    now = time.time() if now is None else now
+    # Copy first: the sampler may add to them while we are rendering.
+    tanks = sorted(health.tanks.copy().items())
+    errors = sorted(health.errors.copy().items())
+    tank_health = sorted(health.tank_health(now).items())
+    lines = []
+    _metric(lines, 'lolat_up', 'gauge', '1 if all tanks sampled recently.',
+            [((), int(health.is_healthy(now)))])
+    _metric(lines, 'lolat_tank_up', 'gauge',
+            '1 if the tank has been sampled recently.',
+            [((('tank', name),), int(up)) for name, up in tank_health])
+    _metric(lines, 'lolat_volume_ml', 'gauge', 'Latest volume per tank.',
+            [((('tank', name),), s.volume) for name, s in tanks])
+    _metric(lines, 'lolat_reading_mm', 'gauge', 'Latest reading per tank.',
+            [((('tank', name),), s.reading) for name, s in tanks])
+    _metric(lines, 'lolat_last_sample_age_seconds', 'gauge',
+            'Seconds since each tank was last sampled.',
+            [((('tank', name),), round(now - s.time, 3))
+             for name, s in tanks])
+    _metric(lines, 'lolat_cycles_total', 'counter', 'Sampling cycles run.',
+            [((), health.cycles)])
+    _metric(lines, 'lolat_cycle_seconds', 'gauge',
+            'Duration of the last sampling cycle.',
+            [((), health.last_cycle_time)])
+    _metric(lines, 'lolat_cycle_seconds_max', 'gauge',
+            'Longest sampling cycle so far.', [((), health.max_cycle_time)])
+    _metric(lines, 'lolat_queue_depth', 'gauge',
+            'Samples waiting to be sent when last read (--split only).',
+            [((), health.queue_depth)])
+    _metric(lines, 'lolat_errors_total', 'counter', 'Errors by type.',
+            [((('type', name),), count) for name, count in errors])
+    _metric(lines, 'lolat_uptime_seconds', 'gauge',
+            'Seconds since the sampler started.',
+            [((), round(now - health.started, 3))])
+    return '\n'.join(lines) + '\n'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Set on the subclass made by serve().
+    health = None
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self._reply(200, 'text/plain; version=0.0.4',
+                        render(self.health))
+        elif self.path == '/health':
+            healthy = self.health.is_healthy()
+            body = json.dumps({'healthy': healthy,
+                               'cycles': self.health.cycles,
+                               'tanks': self.health.tank_health()})
+            self._reply(200 if healthy else 503, 'application/json', body)
+        else:
+            self._reply(404, 'text/plain', 'Try /metrics or /health\n')
+
+    def _reply(self, status, content_type, body):
+        body = body.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would drown the sampler's own output.
+        pass
+
+
+def serve(health, host='localhost', port=9101):
+    """Serve health on host:port from a background thread.
+
+    Returns the server. Call its shutdown() to stop it.
+    """
+    handler = type('Handler', (_Handler,), {'health': health})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
@@ -0,0 +1,175 @@
+#!/usr/bin/python3
+"""Profile N sampler (or calibration) cycles, on real or simulated hardware.
+
+Used by the --profile option of lolat.py and calibrate_bucket.py. Runs the
+cycles back to back (no waiting for the period) under:
+- cProfile, timed by CPU rather than wall clock, so sleeps don't count
+  but the busy-waits in hc_sr04 do.
+- tracemalloc, for allocation hot spots and memory growth per cycle.
+- optionally a stack sampler: a thread that records the main thread's
+  stack every sample_interval seconds. Its output is in the 'collapsed'
+  format flamegraph.pl and speedscope read.
+
+With --simulate (see drivers.py) each GPIO read costs as much virtual
+time as it would on a Pi, so the busy-wait loops go round about as often
+as they do there.
+
+Then writes a report of the top functions by CPU time, the allocation hot
+spots (growth between the end of the first cycle and the last) and the
+memory in use after each cycle.
+"""
+
+import argparse
+import cProfile
+import io
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+
+class StackSampler():
+    """Sample a thread's stack at intervals from a background thread."""
+    def __init__(self, interval=0.001, thread_id=None):
+        self.interval = interval
+        self.thread_id = thread_id or threading.get_ident()
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_filename.rsplit("/", 1)[-1]}:'
+                             f'{code.co_name}')
+                frame = frame.f_back
+            # Outermost first, as the collapsed format wants.
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    def collapsed(self):
+        """Return samples in collapsed format: 'a;b;c count' per line."""
+        return ''.join(f'{stack} {count}\n'
+                       for stack, count in self.stacks.most_common())
+
+
+def profile_cycles(cycle, cycles, top=20, sample_interval=None,
+                   file=sys.stdout, collapsed_file=None):
+    """Run cycle() cycles times under the profilers and report.
+
+    Args:
+        cycle: function doing one cycle's work.
+        cycles: how many times to run it. At least 2 to see growth.
+        top: how many functions and allocation sites to report.
+        sample_interval: seconds between stack samples. None to not sample.
+        file: where to write the report.
+        collapsed_file: optional file for the sampled stacks.
+
+    Returns:
+        (pstats.Stats, list of bytes in use after each cycle).
+
+    Raises:
+        ValueError if cycles is less than 1.
+    """
+    if cycles < 1:
+        raise ValueError(f'Need at least 1 cycle to profile, not {cycles}')
+    profiler = cProfile.Profile(time.process_time)
+    sampler = StackSampler(sample_interval) if sample_interval else None
+    tracemalloc.start(10)
+    memory = []
+    first_snapshot = None
+    if sampler:
+        sampler.start()
+    try:
+        for i in range(cycles):
+            profiler.enable()
+            cycle()
+            profiler.disable()
+            memory.append(tracemalloc.get_traced_memory()[0])
+            if i == 0:
+                # After the first cycle: imports and one-off set up are done.
+                first_snapshot = tracemalloc.take_snapshot()
+        last_snapshot = tracemalloc.take_snapshot()
+    finally:
+        if sampler:
+            sampler.stop()
+        tracemalloc.stop()
+
+    print(f'Profiled {cycles} cycles.\n', file=file)
+    print(f'Top {top} functions by CPU time:', file=file)
+    out = io.StringIO()
+    stats = pstats.Stats(profiler, stream=out)
+    stats.sort_stats('tottime').print_stats(top)
+    print(out.getvalue(), file=file)
+
+    print(f'Top {top} allocation sites, growth since the first cycle:',
+          file=file)
+    snapshot_filter = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    growth = last_snapshot.filter_traces(snapshot_filter).compare_to(
+        first_snapshot.filter_traces(snapshot_filter), 'lineno')
+    for stat in growth[:top]:
+        print(f'  {stat}', file=file)
+
+    print('\nMemory in use after each cycle (bytes, change):', file=file)
+    previous = None
+    for i, used in enumerate(memory, 1):
+        change = '' if previous is None else f'{used - previous:+}'
+        print(f'  {i:>4} {used:>12} {change:>10}', file=file)
+        previous = used
+
+    if sampler:
+        samples = sum(sampler.stacks.values())
+        print(f'\n{samples} stack samples. Most common:', file=file)
+        for stack, count in sampler.stacks.most_common(top // 2 or 1):
+            print(f'  {count:>6} {stack}', file=file)
+        if collapsed_file:
+            collapsed_file.write(sampler.collapsed())
+    return stats, memory
+
+
+def _positive_int(text):
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError(f'must be 1 or more, not {value}')
+    return value
+
+
+def add_arguments(parser):
+    """Add the profiling command line options to an argparse parser."""
+    group = parser.add_argument_group('profiling')
+    group.add_argument('--profile', type=_positive_int, metavar='N',
+                       help='profile N cycles, write a report and exit')
+    group.add_argument('--profile-output', metavar='FILE',
+                       help='write the report here rather than stdout')
+    group.add_argument('--profile-sample', type=float, metavar='SECONDS',
+                       help='also sample stacks at this interval')
+    group.add_argument('--profile-collapsed', metavar='FILE',
+                       help='write sampled stacks in collapsed format')
+
+
+def run_from_arguments(args, cycle):
+    """Profile cycle as asked for by options from add_arguments."""
+    report = open(args.profile_output, 'w') if args.profile_output \
+        else sys.stdout
+    collapsed = open(args.profile_collapsed, 'w') \
+        if args.profile_collapsed else None
+    try:
+        profile_cycles(cycle, args.profile,
+                       sample_interval=args.profile_sample, file=report,
+                       collapsed_file=collapsed)
+    finally:
+        if report is not sys.stdout:
+            report.close()
+        if collapsed:
+            collapsed.close()
@@ -0,0 +1,63 @@
+#!/usr/bin/python3
+"""Replay a raw capture (see DistanceSensor.capture) as a live sensor.
+
+Gives the rest of lolat pulses exactly as a real sensor once gave them:
+the same noise, missing echoes and odd readings, as often as you like.
+A pulse with a missing edge comes back with an infinite round trip time,
+ie out of range. Nothing sleeps: readings come as fast as they are asked
+for.
+"""
+
+from contextlib import contextmanager
+
+from hc_sr04 import DistanceSensor, CAPTURE_HEADER, CAPTURE_MAGIC, \
+    CAPTURE_VERSION, CAPTURE_RECORD, CAPTURE_OK
+
+
+class ReplaySensor(DistanceSensor):
+    """A DistanceSensor whose pulses come from a capture file.
+
+    Args:
+        path: the capture file.
+        loop: start again at the end. If False, running out raises
+            EOFError.
+        Anything else is passed to DistanceSensor, eg dist_min. Pins are
+        accepted and ignored.
+    """
+    def __init__(self, path, loop=True, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.loop = loop
+        self._records = None
+        self._next = 0
+
+    @contextmanager
+    def open(self):
+        """Load the capture. No hardware to set up."""
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        magic, version, record_size = CAPTURE_HEADER.unpack_from(data)
+        if magic != CAPTURE_MAGIC or version != CAPTURE_VERSION or \
+                record_size != CAPTURE_RECORD.size:
+            raise ValueError(f'{self.path}: not a capture file this can '
+                             f'replay')
+        self._records = [
+            fall - rise if status == CAPTURE_OK else float('inf')
+            for _, rise, fall, status in CAPTURE_RECORD.iter_unpack(
+                data[CAPTURE_HEADER.size:])]
+        if not self._records:
+            raise ValueError(f'{self.path}: no pulses in capture')
+        self._next = 0
+        try:
+            yield self
+        finally:
+            self._records = None
+
+    def _get_pulse_round_trip_time(self):
+        if self._next == len(self._records):
+            if not self.loop:
+                raise EOFError(f'{self.path}: end of capture')
+            self._next = 0
+        round_trip_time = self._records[self._next]
+        self._next += 1
+        return round_trip_time
@@ -0,0 +1,120 @@
+#!/usr/bin/python3
+"""A ring buffer of samples in shared memory, one writer and one reader.
+
+The sampler process (see split_sampler.py) writes each set of raw pulse
+round trip times here; the consumer process reads them. Neither ever waits
+for the other: the writer never blocks, and if the reader falls more than
+a buffer's worth behind the oldest samples are overwritten and counted as
+overruns.
+
+Layout, all little endian:
+- header: the sequence number of the last sample written, 0 for none.
+- capacity slots, each one RECORD: sequence number, time.time() of the
+  sample, how many round trip times it holds, then MAX_TIMES of them.
+
+A slot's sequence number is written after the rest of it, and zeroed first,
+so a reader can tell a slot that is complete from one being (over)written.
+"""
+
+import struct
+from collections import namedtuple
+from multiprocessing import shared_memory
+
+HEADER = struct.Struct('<Q')
+# Room for this many round trip times per sample. hc_sr04 takes 5.
+MAX_TIMES = 8
+RECORD = struct.Struct(f'<QdI{MAX_TIMES}d')
+
+Sample = namedtuple('Sample', ['seq', 'time', 'round_trip_times'])
+
+
+class RingBuffer():
+    """See the module docstring.
+
+    Args:
+        capacity: slots. At a sample every 15 minutes 64 is 16 hours.
+        name: of existing shared memory to attach to. None creates it.
+    """
+    def __init__(self, capacity=64, name=None):
+        self.capacity = capacity
+        size = HEADER.size + capacity * RECORD.size
+        if name is None:
+            self._shm = shared_memory.SharedMemory(create=True, size=size)
+            self._shm.buf[:size] = bytes(size)
+            self._owner = True
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+            self._owner = False
+        self._buf = self._shm.buf
+        # Reader's position. Only the reader's copy of this matters.
+        self.next_seq = 1
+        self.overruns = 0
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    def _offset(self, seq):
+        return HEADER.size + (seq % self.capacity) * RECORD.size
+
+    def write(self, time, round_trip_times):
+        """Add a sample. Never blocks. Returns its sequence number."""
+        count = len(round_trip_times)
+        if count > MAX_TIMES:
+            raise ValueError(f'At most {MAX_TIMES} round trip times, '
+                             f'not {count}')
+        seq = HEADER.unpack_from(self._buf, 0)[0] + 1
+        offset = self._offset(seq)
+        times = list(round_trip_times) + [0.0] * (MAX_TIMES - count)
+        # Mark the slot incomplete, fill it in, then give it its number.
+        struct.pack_into('<Q', self._buf, offset, 0)
+        RECORD.pack_into(self._buf, offset, 0, time, count, *times)
+        struct.pack_into('<Q', self._buf, offset, seq)
+        HEADER.pack_into(self._buf, 0, seq)
+        return seq
+
+    @property
+    def written(self):
+        """Sequence number of the last sample written, 0 if none."""
+        return HEADER.unpack_from(self._buf, 0)[0]
+
+    @property
+    def depth(self):
+        """Samples written but not yet read. At most capacity: any more
+        have been overwritten."""
+        return min(max(self.written - self.next_seq + 1, 0), self.capacity)
+
+    def read(self):
+        """Return the samples written since the last read, oldest first."""
+        written = self.written
+        if written - self.next_seq + 1 > self.capacity:
+            # Lapped. Skip to the oldest still there.
+            oldest = written - self.capacity + 1
+            self.overruns += oldest - self.next_seq
+            self.next_seq = oldest
+        samples = []
+        while self.next_seq <= written:
+            offset = self._offset(self.next_seq)
+            record = RECORD.unpack_from(self._buf, offset)
+            seq, time, count = record[:3]
+            # Check the slot is complete and wasn't overwritten under us.
+            if seq != self.next_seq or \
+                    struct.unpack_from('<Q', self._buf, offset)[0] != seq:
+                self.overruns += 1
+            else:
+                samples.append(Sample(seq, time, record[3:3 + count]))
+            self.next_seq += 1
+        return samples
+
+    def close(self):
+        """Detach. The creator also frees the shared memory."""
+        self._buf = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
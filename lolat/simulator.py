@@ -0,0 +1,268 @@
+#!/usr/bin/python3
+"""Simulate HC-SR04 sensors against a virtual clock.
+
+tests/mock_GPIO.py emulates echoes with real timers and real sleeps, so
+results depend on how busy the machine is. Here nothing ever really sleeps:
+a VirtualClock stands in for the 'time' module and a SimulatedBoard stands
+in for RPi.GPIO. Give both to a DistanceSensor:
+
+    clock = VirtualClock()
+    board = SimulatedBoard(clock, EchoProfile(1000))
+    sensor = DistanceSensor(gpio=board, clock=clock)
+    with sensor.open():
+        sensor.get_distance()   # == 1000, exactly, every time.
+
+Runs are exact and deterministic (noise comes from a seeded random
+generator) and take microseconds of real time per simulated reading.
+
+What the sensor 'sees' for each pulse is decided by an echo profile:
+- EchoProfile: a fixed distance, or a function of time, plus optional
+  noise, missing echoes and stray pulses.
+- ScriptedProfile: an explicit list of echoes, one per pulse.
+
+All distances are in millimeters, all times in seconds.
+"""
+
+import itertools
+import random
+from collections import namedtuple
+
+# Speed of sound, as used by hc_sr04.
+SPEED_OF_SOUND = 343000  # mm/s
+
+# From the HC-SR04 datasheet. After the trigger the module sends an 8 cycle
+# 40kHz burst, then raises the echo pin until the echo returns or it gives
+# up after 38ms.
+BURST_TIME = 8 / 40000
+ECHO_TIMEOUT = 38 / 1000
+TRIGGER_TIME = 10 / 1000000
+
+# One pulse's worth of echo.
+# distance: mm to the reflecting surface, or None if no echo comes back.
+# strays: list of (start, width) extra HIGH periods on the echo pin,
+# start measured from the end of the trigger pulse.
+Echo = namedtuple('Echo', ['distance', 'strays'], defaults=[()])
+
+
+def distance_to_time(distance):
+    """Return the echo round trip time for a distance."""
+    return 2 * distance / SPEED_OF_SOUND
+
+
+class VirtualClock():
+    """Drop-in replacement for the time and sleep functions of 'time'.
+
+    Time only moves when something sleeps or the board advances it.
+    """
+    def __init__(self, start=0.0):
+        self._now = start
+
+    def time(self):
+        return self._now
+
+    def monotonic(self):
+        return self._now
+
+    def sleep(self, seconds):
+        if seconds < 0:
+            raise ValueError('sleep length must be non-negative')
+        self._now += seconds
+
+    def advance_to(self, when):
+        """Move the clock forward to 'when'. Never moves it backwards."""
+        if when > self._now:
+            self._now = when
+
+
+class EchoProfile():
+    """Echoes from a surface at a given distance.
+
+    Args:
+        distance: mm, or a function taking the virtual time and returning
+            mm, for a moving surface.
+        noise: standard deviation, in mm, of gaussian noise on each echo.
+        missing: probability that a pulse gets no echo at all.
+        stray: probability that a pulse is preceded by a short stray pulse.
+        seed: for the random generator. The same seed gives the same run.
+    """
+    def __init__(self, distance, noise=0.0, missing=0.0, stray=0.0, seed=0):
+        self._distance = distance if callable(distance) else (
+            lambda _: distance)
+        self.noise = noise
+        self.missing = missing
+        self.stray = stray
+        self._random = random.Random(seed)
+
+    def next_echo(self, now):
+        """Return the Echo for a pulse triggered at virtual time 'now'."""
+        strays = ()
+        if self.stray and self._random.random() < self.stray:
+            # A short blip on the echo pin before the real echo starts.
+            start = self._random.uniform(0, BURST_TIME / 4)
+            width = self._random.uniform(BURST_TIME / 20, BURST_TIME / 2)
+            strays = ((start, width),)
+        if self.missing and self._random.random() < self.missing:
+            return Echo(None, strays)
+        distance = self._distance(now)
+        if self.noise:
+            distance += self._random.gauss(0, self.noise)
+        return Echo(max(distance, 0), strays)
+
+
+class ScriptedProfile():
+    """Echoes given explicitly, one per pulse, repeating when exhausted.
+
+    Each entry is a distance in mm, None for a missing echo, or an Echo.
+    """
+    def __init__(self, script):
+        self._script = itertools.cycle([
+            entry if isinstance(entry, Echo) else Echo(entry)
+            for entry in script])
+
+    def next_echo(self, now):
+        return next(self._script)
+
+
+class SimulatedBoard():
+    """A GPIO board with one HC-SR04 attached, driven by a VirtualClock.
+
+    Implements the part of the RPi.GPIO API that hc_sr04 uses.
+
+    Repeatedly reading an unchanged echo pin moves the clock on to the
+    pin's next change of state. So a busy-wait loop sees every edge at
+    exactly the right time and takes only a few iterations. Set poll_time
+    to instead model the cost of each read on real hardware.
+
+    Args:
+        clock: the VirtualClock shared with the sensor code.
+        profile: EchoProfile, ScriptedProfile or anything with a
+            next_echo(now) method.
+        pin_trigger, pin_echo: as set on the DistanceSensor.
+        poll_time: optional, seconds each read of an input pin takes.
+    """
+    BCM = 11
+    BOARD = 10
+    HIGH = 1
+    LOW = 0
+    IN = 1
+    OUT = 0
+    UNKNOWN = -1
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+
+    def __init__(self, clock, profile, pin_trigger=7, pin_echo=11,
+                 poll_time=None):
+        self.clock = clock
+        self.profile = profile
+        self.pin_trigger = pin_trigger
+        self.pin_echo = pin_echo
+        self.poll_time = poll_time
+        # Number of ultrasonic bursts the sensor has sent.
+        self.pulses = 0
+        self._reset()
+
+    def _reset(self):
+        self._mode = self.UNKNOWN
+        self._directions = {}
+        self._trigger_state = self.LOW
+        self._trigger_rise = None
+        # Sorted (start, end) periods where the echo pin is HIGH.
+        self._echo_high = []
+        self._last_echo = None
+
+    def getmode(self):
+        return self._mode
+
+    def setmode(self, mode):
+        if mode not in (self.BCM, self.BOARD):
+            raise ValueError('mode should be BCM or BOARD.')
+        self._mode = mode
+
+    def setup(self, pin, direction):
+        if self._mode == self.UNKNOWN:
+            raise ValueError('Mode has not been set.')
+        if pin not in (self.pin_trigger, self.pin_echo):
+            raise ValueError(f'Nothing simulated on pin {pin}')
+        self._directions[pin] = direction
+
+    def cleanup(self, channel=None):
+        # Only one sensor on this board, so it's all or nothing.
+        self._reset()
+
+    def output(self, pin, state):
+        if pin != self.pin_trigger or self._directions.get(pin) != self.OUT:
+            raise ValueError(f'Pin {pin} is not set to OUT direction.')
+        now = self.clock.time()
+        if state == self.HIGH and self._trigger_state == self.LOW:
+            self._trigger_rise = now
+        elif state == self.LOW and self._trigger_state == self.HIGH:
+            # Allow for float rounding in the 10usec the driver sleeps.
+            if now - self._trigger_rise >= TRIGGER_TIME * 0.99:
+                self._fire(now)
+        self._trigger_state = state
+
+    def _fire(self, now):
+        """Schedule the echo pin's response to a trigger pulse ending now."""
+        self.pulses += 1
+        echo = self.profile.next_echo(now)
+        periods = [(now + start, now + start + width)
+                   for start, width in echo.strays]
+        rise = now + BURST_TIME
+        if echo.distance is None:
+            periods.append((rise, rise + ECHO_TIMEOUT))
+        else:
+            periods.append((rise, rise + distance_to_time(echo.distance)))
+        # Drop anything already over and keep the rest in time order.
+        self._echo_high = sorted(
+            p for p in self._echo_high + periods if p[1] > now)
+
+    def input(self, pin):
+        if pin != self.pin_echo or self._directions.get(pin) != self.IN:
+            raise ValueError(f'Pin {pin} is not set to IN direction.')
+        now = self.clock.time()
+        periods = self._echo_high
+        while periods and periods[0][1] <= now:
+            periods.pop(0)
+        if periods and periods[0][0] <= now:
+            state, next_edge = self.HIGH, periods[0][1]
+        else:
+            state = self.LOW
+            next_edge = periods[0][0] if periods else None
+
+        if self.poll_time is not None:
+            self.clock.sleep(self.poll_time)
+        elif state == self._last_echo and next_edge is not None:
+            # Second read of the same state: the caller is busy-waiting for
+            # it to change. The pin holds this state until its next edge so
+            # skip straight there. The caller sees the change on its next
+            # read, with the clock exactly at the edge.
+            self.clock.advance_to(next_edge)
+        self._last_echo = state
+        return state
+
+    def wait_for_edge(self, pin, edge, bouncetime=None, timeout=None):
+        """Move the clock on to the echo pin's next edge.
+
+        timeout is in milliseconds, as in RPi.GPIO. Returns pin, or None
+        if timeout expires first.
+        """
+        if pin != self.pin_echo or self._directions.get(pin) != self.IN:
+            raise ValueError(f'Pin {pin} is not set to IN direction.')
+        now = self.clock.time()
+        # The next input() isn't part of a busy-wait, don't skip ahead.
+        self._last_echo = None
+        edges = []
+        for start, end in self._echo_high:
+            if edge in (self.RISING, self.BOTH) and start > now:
+                edges.append(start)
+            if edge in (self.FALLING, self.BOTH) and end > now:
+                edges.append(end)
+        limit = None if timeout is None else now + timeout / 1000
+        if edges and (limit is None or min(edges) <= limit):
+            self.clock.advance_to(min(edges))
+            return pin
+        if limit is None:
+            raise RuntimeError('Waiting forever: no edge is coming.')
+        self.clock.advance_to(limit)
+        return None
@@ -0,0 +1,105 @@
+#!/usr/bin/python3
+"""Save each tank's runtime state, so a restart carries on where it was.
+
+Without it a restart, eg after a 'make install', starts cold: no last
+reading until a new one is taken, and every tank sampled at once, off its
+old schedule. With it each tank picks up its last sample and is next due
+when it would have been.
+
+The file is small and binary, all little endian:
+- HEADER: MAGIC, VERSION, the time.time() it was written, the tank count.
+- per tank: its name as NAME_LENGTH then UTF-8 bytes, then RECORD: period,
+  time.time() of the last sample (0 for none), its reading and volume
+  (both ints), and time.time() the next sample is due.
+
+It's written to a temporary file which then replaces the old one, so a
+crash or power cut mid write leaves either the old snapshot or the new,
+never half of one.
+"""
+
+import os
+import struct
+from collections import namedtuple
+
+MAGIC = b'LOLATSNP'
+VERSION = 2
+HEADER = struct.Struct('<8sHdI')
+NAME_LENGTH = struct.Struct('<H')
+# Readings and volumes are ints, as sent: Influx won't take a float for
+# a field that has been an int.
+RECORD = struct.Struct('<ddqqd')
+
+# sampled_at and due are time.time()s. sampled_at is 0 if never sampled.
+TankState = namedtuple('TankState', ['period', 'sampled_at', 'reading',
+                                     'volume', 'due'])
+
+
+class SnapshotError(Exception):
+    """Not a snapshot file this can read."""
+    pass
+
+
+def pack(states, now):
+    """Return a snapshot of states, a dict of TankState by tank name."""
+    parts = [HEADER.pack(MAGIC, VERSION, now, len(states))]
+    for name, state in states.items():
+        encoded = name.encode()
+        parts.append(NAME_LENGTH.pack(len(encoded)))
+        parts.append(encoded)
+        parts.append(RECORD.pack(*state))
+    return b''.join(parts)
+
+
+def unpack(data):
+    """Return (time written, dict of TankState by name) from a snapshot.
+
+    Raises:
+        SnapshotError if data isn't one.
+    """
+    try:
+        magic, version, written, count = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise SnapshotError('not a snapshot this can read')
+        offset = HEADER.size
+        states = {}
+        for _ in range(count):
+            length, = NAME_LENGTH.unpack_from(data, offset)
+            offset += NAME_LENGTH.size
+            name = data[offset:offset + length].decode()
+            offset += length
+            states[name] = TankState(*RECORD.unpack_from(data, offset))
+            offset += RECORD.size
+    except (struct.error, UnicodeDecodeError) as e:
+        raise SnapshotError(f'truncated or corrupt: {e}') from e
+    return written, states
+
+
+def save(path, states, now):
+    """Atomically replace the snapshot at path."""
+    temp = f'{path}.tmp'
+    with open(temp, 'wb') as f:
+        f.write(pack(states, now))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp, path)
+
+
+def load(path):
+    """Return (time written, dict of TankState by name) from path.
+
+    A missing file is no tanks, written at 0.
+
+    Raises:
+        SnapshotError if it can't be read.
+    """
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return 0.0, {}
+    except OSError as e:
+        raise SnapshotError(f'{path}: {e}') from e
+    try:
+        return unpack(data)
+    except SnapshotError as e:
+        raise SnapshotError(f'{path}: {e}') from e
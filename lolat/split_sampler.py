@@ -0,0 +1,152 @@
+#!/usr/bin/python3
+"""Run the pulse capture in a process of its own. lolat.py --split.
+
+The echo timing in hc_sr04 is only as good as the busy-wait loops: if the
+process is interrupted mid pulse, by a network send, a GC pause or
+anything else, the round trip time comes out wrong. So with --split:
+- a sampler process does nothing but capture: every period it sends the
+  pulses and writes the raw round trip times, with the time, to a shared
+  memory RingBuffer. Optionally pinned to a CPU core. Automatic garbage
+  collection is off; it collects between captures instead.
+- the main process is the consumer. It turns round trip times into a
+  distance, maps that to a volume and sends it, at its own pace. A slow
+  send no longer delays or skews a sample.
+
+The sampler is forked, not spawned, so it inherits the sensor as is:
+module objects like RPi.GPIO can't be pickled.
+"""
+
+import gc
+import multiprocessing
+import os
+import time
+
+from instrumentation import stats
+from ring_buffer import RingBuffer
+
+# How often the consumer looks for new samples. Plenty for a 15 min period.
+POLL_INTERVAL = 0.1
+
+
+def _pin_to_cpu(cpu):
+    """Run on this core only. Not every platform can."""
+    try:
+        os.sched_setaffinity(0, {cpu})
+    except (AttributeError, OSError) as e:
+        print(f'Sampler not pinned to cpu {cpu}: {e}')
+
+
+def run_sampler(sensor, ring, period, stop, cpu=None):
+    """Capture every period seconds until stop is set. The sampler process.
+
+    Args:
+        sensor: a DistanceSensor, not yet opened.
+        ring: RingBuffer to write to.
+        period: seconds between the starts of captures.
+        stop: multiprocessing.Event.
+        cpu: optional core to pin to.
+    """
+    if cpu is not None:
+        _pin_to_cpu(cpu)
+    # Nothing here to publish timings to.
+    stats.enable(False)
+    # Everything allocated so far lives forever: stop the collector
+    # looking at it, and stop it running at all mid capture.
+    gc.collect()
+    gc.freeze()
+    gc.disable()
+    with sensor.open():
+        next_capture = time.monotonic()
+        while not stop.is_set():
+            sampled_at = time.time()
+            ring.write(sampled_at, sensor.get_round_trip_times())
+            gc.collect()
+            next_capture += period
+            stop.wait(max(next_capture - time.monotonic(), 0))
+
+
+class SplitSampler():
+    """Start and stop a sampler process writing to a new RingBuffer.
+
+    Use with 'with'. Read samples with read().
+    """
+    def __init__(self, sensor, period, cpu=None, capacity=64):
+        self.ring = RingBuffer(capacity)
+        context = multiprocessing.get_context('fork')
+        self._stop = context.Event()
+        self.process = context.Process(
+            target=run_sampler, name='lolat-sampler',
+            args=(sensor, self.ring, period, self._stop, cpu), daemon=True)
+
+    def start(self):
+        self.process.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.ring.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def read(self):
+        """Samples captured since the last read.
+
+        Raises:
+            RuntimeError if the sampler process has died.
+        """
+        samples = self.ring.read()
+        if not samples and not self.process.is_alive():
+            raise RuntimeError(f'Sampler process died, exit code '
+                               f'{self.process.exitcode}')
+        return samples
+
+
+def consume(sampler, sensor, handle_sample, poll_interval=POLL_INTERVAL,
+            max_samples=None, handle_batch=None):
+    """Turn samples into distances and pass them on. The consumer.
+
+    Args:
+        sampler: a started SplitSampler.
+        sensor: DistanceSensor to do the sums, as distance_from_round_
+            trip_times. It needn't be (and shouldn't be) opened.
+        handle_sample: called with (distance, time) per sample. Distance
+            is None if the sample was invalid.
+        poll_interval: seconds between looks for new samples.
+        max_samples: stop after this many. None for forever.
+        handle_batch: optional, called after each batch of samples read
+            together has been handled, with the ring buffer's depth when
+            it was read: how far behind the consumer was.
+
+    The depth and overruns are also recorded in stats, as ring_depth and
+    overruns.
+    """
+    handled = 0
+    overruns = 0
+    while max_samples is None or handled < max_samples:
+        depth = sampler.ring.depth
+        samples = sampler.read()
+        # Counted even when 0, so every lolat_internal point has it.
+        stats.count('overruns', sampler.ring.overruns - overruns)
+        overruns = sampler.ring.overruns
+        if not samples:
+            time.sleep(poll_interval)
+            continue
+        for sample in samples:
+            try:
+                distance = sensor.distance_from_round_trip_times(
+                    sample.round_trip_times)
+            except sensor.InvalidDistanceError:
+                distance = None
+            handle_sample(distance, sample.time)
+            handled += 1
+        stats.gauge('ring_depth', depth)
+        if handle_batch:
+            handle_batch(depth)
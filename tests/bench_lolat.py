@@ -0,0 +1,22 @@
+#!/usr/bin/python3
+"""pytest-benchmark wrappers for the cases in benchmark.py.
+
+Not collected by 'make test'. Run explicitly:
+    pytest tests/bench_lolat.py --benchmark-json=results.json
+    pytest tests/bench_lolat.py --benchmark-autosave --benchmark-compare
+"""
+
+import pytest
+pytest.importorskip('pytest_benchmark')
+import benchmark as cases  # noqa: E402
+
+
+@pytest.mark.parametrize('name', cases.available_cases())
+def test_case(benchmark, name):
+    make, _ = cases.CASES[name]
+    op, teardown = make()
+    try:
+        benchmark(op)
+    finally:
+        if teardown:
+            teardown()
@@ -0,0 +1,313 @@
+#!/usr/bin/python3
+"""Benchmarks for the measurement to database pipeline.
+
+Runs against simulated hardware (simulator.py) and a local UDP socket
+standing in for Telegraf, so results only depend on the machine, not on
+sensors or network.
+
+Standalone:
+    python3 tests/benchmark.py                      # print results
+    python3 tests/benchmark.py -o after.json        # ... and save them
+    python3 tests/benchmark.py --compare before.json
+    python3 tests/benchmark.py -k get_distance      # just matching cases
+
+With pytest-benchmark, the same cases are in tests/bench_lolat.py:
+    pytest tests/bench_lolat.py --benchmark-json=after.json
+
+Every case is a function taking no arguments that does one operation and
+returns the number of items it handled (eg points in a batch). Timings are
+wall clock and CPU per operation and items per second.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import socket
+import statistics
+import sys
+import time
+
+from context import virtual_sensor  # Also puts lolat on the path.
+import lolat
+import line_protocol
+from simulator import EchoProfile
+
+try:
+    import numpy as np
+    import backfill
+except ImportError:
+    # The backfill cases are skipped without numpy.
+    np = None
+
+
+class _LocalSink():
+    """A bound UDP socket, standing in for Telegraf's socket_listener.
+
+    Nothing reads it: datagrams beyond the receive buffer are dropped by
+    the kernel, which costs the sender nothing.
+    """
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.port = self.sock.getsockname()[1]
+
+    def close(self):
+        self.sock.close()
+
+
+def _simulated_sensor(poll_time=None):
+    return virtual_sensor(EchoProfile(1000, noise=2),
+                          board_options={'poll_time': poll_time})
+
+
+# Each make_* function sets up a case and returns (operation, teardown).
+# teardown may be None.
+
+def make_get_distance():
+    """One 5 pulse reading with exact (jump to edge) echo timing."""
+    sensor = _simulated_sensor()
+    opened = sensor.open()
+    opened.__enter__()
+
+    def op():
+        sensor.get_distance()
+        return 1
+    return op, lambda: opened.__exit__(None, None, None)
+
+
+def make_get_distance_polled():
+    """As get_distance, but each echo pin read costs 2usec, as on a Pi.
+
+    So the busy-wait loops really loop: ~3000 reads per pulse at 1m.
+    """
+    sensor = _simulated_sensor(poll_time=2e-6)
+    opened = sensor.open()
+    opened.__enter__()
+
+    def op():
+        sensor.get_distance()
+        return 1
+    return op, lambda: opened.__exit__(None, None, None)
+
+
+def make_map_volume():
+    """The live path's scalar volume mapping, 1000 readings per op."""
+    readings = list(range(100, 1100))
+
+    def op():
+        for reading in readings:
+            lolat.map_volume(reading)
+        return len(readings)
+    return op, None
+
+
+def make_get_reading_and_volume():
+    """Reading, invalid handling and mapping, as each live cycle does."""
+    sensor = _simulated_sensor()
+    opened = sensor.open()
+    opened.__enter__()
+
+    def op():
+        lolat.get_reading_and_volume(sensor, lolat.map_volume)
+        return 1
+    return op, lambda: opened.__exit__(None, None, None)
+
+
+def make_backfill_remap():
+    """Vectorised filter and mapping of a 100k reading batch."""
+    readings = np.random.default_rng(0).integers(0, 4500, 100000)
+    readings = readings.astype(np.float64)
+
+    def op():
+        backfill.remap(readings, 27, 4400)
+        return len(readings)
+    return op, None
+
+
+def make_backfill_pipeline():
+    """Parse, filter, map and format 100k Influx CSV export rows."""
+    rows = ''.join(
+        f',,0,2020-11-01T00:00:00Z,2020-12-01T00:00:00Z,'
+        f'2020-11-04T10:{i % 60:02d}:00.{i % 1000:03d}Z,{i % 4500},'
+        f'reading,lolat,bucket\n' for i in range(100000))
+    data = (',result,table,_start,_stop,_time,_value,_field,_measurement,'
+            'src\n' + rows).encode()
+
+    def op():
+        points = 0
+        sink = io.StringIO()
+        for times, readings, *_ in backfill.read_batches(
+                io.BytesIO(data)):
+            readings = np.array(readings, dtype=np.float64)
+            keep, kept, volumes = backfill.remap(readings, 27, 4400)
+            times = backfill.to_nanoseconds(times)[keep]
+            sink.write(backfill.format_batch('lolat,src=bucket',
+                                             times, kept, volumes))
+            points += len(readings)
+        return points
+    return op, None
+
+
+def make_format_line():
+    """Serialise one point, as sent each cycle."""
+    tags = {'src': 'bucket'}
+
+    def op():
+        line_protocol.format_line('lolat', {'reading': 123, 'volume': 2500},
+                                  tags, 1604484000000000000)
+        return 1
+    return op, None
+
+
+def make_format_batch():
+    """Serialise 100k points in one batch, as backfill does."""
+    n = 100000
+    times = np.arange(n, dtype=np.int64) + 1604484000000000000
+    readings = np.arange(n, dtype=np.int64) % 4400
+    volumes = readings * 23
+
+    def op():
+        backfill.format_batch('lolat,src=bucket', times, readings, volumes)
+        return n
+    return op, None
+
+
+def make_insert_data():
+    """lolat.insert_data to a local UDP socket, 100 points per op."""
+    sink = _LocalSink()
+    client = line_protocol.SocketClient('127.0.0.1', sink.port,
+                                        {'src': 'bucket'})
+
+    def op():
+        # insert_data prints every point. Don't benchmark the terminal.
+        with contextlib.redirect_stdout(io.StringIO()):
+            for i in range(100):
+                lolat.insert_data(client, 123, i)
+        return 100
+
+    def teardown():
+        client.close()
+        sink.close()
+    return op, teardown
+
+
+# name: (make function, needs numpy)
+CASES = {
+    'get_distance': (make_get_distance, False),
+    'get_distance_polled': (make_get_distance_polled, False),
+    'map_volume': (make_map_volume, False),
+    'get_reading_and_volume': (make_get_reading_and_volume, False),
+    'backfill_remap': (make_backfill_remap, True),
+    'backfill_pipeline': (make_backfill_pipeline, True),
+    'format_line': (make_format_line, False),
+    'format_batch': (make_format_batch, True),
+    'insert_data': (make_insert_data, False),
+}
+
+
+def available_cases():
+    """Names of the cases that can run here."""
+    return [name for name, (_, needs_numpy) in CASES.items()
+            if np is not None or not needs_numpy]
+
+
+def run_case(name, min_time=1.0, min_rounds=5):
+    """Time one case. Run it for at least min_time s and min_rounds times.
+
+    Returns a dict of results. Times are in seconds per operation.
+    """
+    make, _ = CASES[name]
+    op, teardown = make()
+    try:
+        op()  # Warm up.
+        wall = []
+        cpu = []
+        items = 0
+        started = time.perf_counter()
+        while len(wall) < min_rounds or \
+                time.perf_counter() - started < min_time:
+            cpu_start = time.process_time()
+            start = time.perf_counter()
+            items += op()
+            wall.append(time.perf_counter() - start)
+            cpu.append(time.process_time() - cpu_start)
+    finally:
+        if teardown:
+            teardown()
+    total = sum(wall)
+    return {
+        'rounds': len(wall),
+        'mean': total / len(wall),
+        'median': statistics.median(wall),
+        'min': min(wall),
+        'max': max(wall),
+        'stddev': statistics.stdev(wall) if len(wall) > 1 else 0.0,
+        'cpu_mean': sum(cpu) / len(cpu),
+        'items_per_second': items / total if total else float('inf'),
+    }
+
+
+def run(names, min_time=1.0):
+    """Run the named cases. Returns the results document saved as JSON."""
+    return {
+        'machine': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'processor': platform.machine(),
+            'cpus': os.cpu_count(),
+        },
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'results': {name: run_case(name, min_time) for name in names},
+    }
+
+
+def _format_time(seconds):
+    for unit, scale in (('s', 1), ('ms', 1e3), ('us', 1e6)):
+        if seconds * scale >= 1:
+            return f'{seconds * scale:.3g}{unit}'
+    return f'{seconds * 1e9:.3g}ns'
+
+
+def report(document, baseline=None, file=sys.stdout):
+    """Print results, with the change from baseline if given."""
+    print(f"{'case':<24}{'mean':>10}{'cpu':>10}{'items/s':>14}"
+          f"{'vs baseline':>14}", file=file)
+    for name, result in document['results'].items():
+        change = ''
+        if baseline and name in baseline['results']:
+            before = baseline['results'][name]['mean']
+            change = f"{100 * (result['mean'] - before) / before:+.1f}%"
+        print(f"{name:<24}{_format_time(result['mean']):>10}"
+              f"{_format_time(result['cpu_mean']):>10}"
+              f"{result['items_per_second']:>14.0f}{change:>14}", file=file)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-o', '--output', help='save results as JSON')
+    parser.add_argument('--compare', metavar='JSON',
+                        help='show change from previously saved results')
+    parser.add_argument('-k', '--keyword', default='',
+                        help='only run cases with this in their name')
+    parser.add_argument('-t', '--min-time', type=float, default=1.0,
+                        help='seconds to spend on each case')
+    args = parser.parse_args(argv)
+
+    names = [n for n in available_cases() if args.keyword in n]
+    document = run(names, args.min_time)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    report(document, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(document, f, indent=4)
+            print(file=f)
+
+
+if __name__ == "__main__":
+    main()
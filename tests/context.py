@@ -7,3 +7,52 @@ sys.path.insert(0,
 # but it's already cost too much time just trying to get it to work :-(
 # noqa
 import lolat
+
+# Shared by the tests (and benchmark.py), after lolat is on the path.
+from collections import namedtuple  # noqa: E402
+from hc_sr04 import DistanceSensor  # noqa: E402
+from simulator import VirtualClock, SimulatedBoard  # noqa: E402
+
+# A point sent to a Client.
+Point = namedtuple('Point', ['measurement', 'values', 'tags', 'timestamp'])
+
+
+class Client():
+    """A sink client that keeps every point sent to it, as Points."""
+    def __init__(self):
+        self.sent = []
+
+    def metric(self, measurement_name, values, tags=None, timestamp=None):
+        self.sent.append(Point(measurement_name, values, tags, timestamp))
+
+    def values(self, measurement='lolat'):
+        """The values of each point of measurement sent."""
+        return [point.values for point in self.sent
+                if point.measurement == measurement]
+
+    def readings(self):
+        """(src tag, reading) of each lolat point sent. None for no
+        reading."""
+        return [(point.tags['src'], point.values.get('reading'))
+                for point in self.sent if point.measurement == 'lolat']
+
+
+def virtual_sensor(profile, sensor_class=DistanceSensor,
+                   board_class=SimulatedBoard, board_options=None,
+                   **kwargs):
+    """A sensor_class on a board_class playing profile, both on a new
+    VirtualClock.
+
+    The board and clock are the sensor's _gpio and _clock. kwargs go to
+    the sensor, board_options to the board.
+    """
+    clock = VirtualClock()
+    board = board_class(clock, profile, **(board_options or {}))
+    return sensor_class(gpio=board, clock=clock, **kwargs)
+
+
+def simulated_tank(distance, period=0.01):
+    """Config file settings for a tank with a noiseless simulated sensor."""
+    return {'sensor': 'simulated', 'period': period,
+            'sensor_options': {'distance': distance, 'noise': 0,
+                               'poll_time': None}}
@@ -0,0 +1,237 @@
+#!/usr/bin/python3
+"""Synthetic fleet load generator: how many tanks can one Pi handle?
+
+Spins up N virtual tanks, each with its own simulated HC-SR04 (see
+simulator.py) looking at a liquid surface that fills, drains, sloshes and
+sometimes confuses the sensor. Every cycle each tank goes through the real
+lolat.py code path: get_reading_and_volume (so get_distance and
+map_volume) then insert_data, which sends to a local Telegraf stand-in.
+
+All tanks share one virtual clock and are sampled one after another, as a
+single Pi would. Two limits show up as N grows:
+- hardware time: each reading takes ~0.3s of (virtual) sensor time, so a
+  cycle of N tanks takes N times that. If it's longer than the period the
+  cycle overruns.
+- CPU: real CPU per sample here, and the share of a core that needs in
+  real time (load). Set --poll-time to make the busy-wait loops cost what
+  they do on a Pi.
+
+Usage:
+    python3 tests/fleet_load.py --tanks 100,1000,3000 --cycles 3
+"""
+
+import argparse
+import contextlib
+import io
+import math
+import random
+import time
+import tracemalloc
+
+import context  # noqa: F401 Puts lolat on the path.
+import lolat
+from hc_sr04 import DistanceSensor
+from line_protocol import SocketClient
+from simulator import VirtualClock, SimulatedBoard, EchoProfile
+from telegraf_listener import TelegrafListener
+
+
+class TankDynamics():
+    """Liquid level in one tank over (virtual) time.
+
+    Distances are from the sensor, mounted at the top, down to the surface.
+    The level starts part full, moves at rate mm/s (positive fills,
+    negative drains) and bounces between empty and full. Waves add a
+    sinusoid on top.
+    """
+    def __init__(self, depth=1000, start=0.5, rate=0.0,
+                 wave_height=0.0, wave_period=5.0, phase=0.0):
+        self.depth = depth
+        self.start = start * depth
+        self.rate = rate
+        self.wave_height = wave_height
+        self.wave_period = wave_period
+        self.phase = phase
+
+    def level(self, now):
+        """Liquid depth in mm at virtual time now."""
+        level = self.start + self.rate * now
+        # Reflect off empty and full, like a triangle wave.
+        level = level % (2 * self.depth)
+        if level > self.depth:
+            level = 2 * self.depth - level
+        if self.wave_height:
+            level += self.wave_height * math.sin(
+                2 * math.pi * now / self.wave_period + self.phase)
+        return min(max(level, 0), self.depth)
+
+    def distance(self, now):
+        # Sensor sits 50mm above the full mark, so full is still in range.
+        return self.depth + 50 - self.level(now)
+
+
+class VirtualTank():
+    """One tank: its level dynamics, simulated sensor and client tags."""
+    def __init__(self, name, clock, client, rng):
+        self.name = name
+        kind = rng.choice(('still', 'filling', 'draining', 'waves',
+                           'faulty'))
+        self.kind = kind
+        rate = {'filling': 0.05, 'draining': -0.05}.get(kind, 0.0)
+        self.dynamics = TankDynamics(
+            depth=rng.randint(500, 3000), start=rng.random(),
+            rate=rate * rng.uniform(0.5, 2),
+            wave_height=rng.uniform(5, 40) if kind == 'waves' else 0.0,
+            wave_period=rng.uniform(1, 10), phase=rng.uniform(0, math.pi))
+        faulty = kind == 'faulty'
+        profile = EchoProfile(self.dynamics.distance,
+                              noise=rng.uniform(0.5, 3),
+                              missing=0.05 if faulty else 0.0,
+                              stray=0.05 if faulty else 0.0,
+                              seed=rng.randrange(2**32))
+        self.board = SimulatedBoard(clock, profile)
+        self.sensor = DistanceSensor(gpio=self.board, clock=clock)
+        self.client = _TankClient(client, {'src': name})
+        self.samples = 0
+        self.invalid = 0
+
+    def sample(self):
+        """One cycle of lolat.main for this tank."""
+        reading, volume = lolat.get_reading_and_volume(self.sensor,
+                                                       lolat.map_volume)
+        if reading is None:
+            self.invalid += 1
+        lolat.insert_data(self.client, reading, volume)
+        self.samples += 1
+
+
+class _TankClient():
+    """Adds a tank's tags to each metric sent on a shared client.
+
+    One socket per tank would run out of file descriptors.
+    """
+    def __init__(self, client, tags):
+        self._client = client
+        self._tags = tags
+
+    def metric(self, measurement_name, values):
+        self._client.metric(measurement_name, values, self._tags)
+
+
+def run_fleet(num_tanks, cycles=3, period=15 * 60, poll_time=None,
+              listener=None, seed=0):
+    """Run num_tanks virtual tanks for a number of cycles.
+
+    Args:
+        num_tanks: how many tanks.
+        cycles: how many sampling cycles.
+        period: seconds (virtual) between the starts of cycles, as the
+            15 minute sleep in lolat.main.
+        poll_time: optional cost of each GPIO read, see SimulatedBoard.
+        listener: a started TelegrafListener to send to. If None one is
+            started for the run.
+        seed: for the random tank mix.
+
+    Returns:
+        dict of results.
+    """
+    own_listener = listener is None
+    if own_listener:
+        listener = TelegrafListener(port=0, tcp=False).start()
+    listener.reset()
+    client = SocketClient(listener.host, listener.port)
+    clock = VirtualClock()
+    rng = random.Random(seed)
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    tanks = [VirtualTank(f'tank{i}', clock, client, rng)
+             for i in range(num_tanks)]
+    for tank in tanks:
+        tank.board.poll_time = poll_time
+    memory = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    cycle_times = []
+    overruns = 0
+    opened = contextlib.ExitStack()
+    for tank in tanks:
+        opened.enter_context(tank.sensor.open())
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    # insert_data prints every point. Don't load test the terminal.
+    with opened, contextlib.redirect_stdout(io.StringIO()):
+        for cycle in range(cycles):
+            cycle_start = clock.time()
+            for tank in tanks:
+                tank.sample()
+            cycle_time = clock.time() - cycle_start
+            cycle_times.append(cycle_time)
+            if cycle_time > period:
+                overruns += 1
+            else:
+                clock.sleep(period - cycle_time)
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+
+    samples = sum(tank.samples for tank in tanks)
+    listener.wait_for(samples, timeout=2)
+    stats = listener.stats()
+    client.close()
+    if own_listener:
+        listener.stop()
+    return {
+        'tanks': num_tanks,
+        'samples': samples,
+        'invalid': sum(tank.invalid for tank in tanks),
+        'samples_per_second': samples / wall,
+        'cpu_per_sample': cpu / samples,
+        # Share of one core needed to keep up in real time, on this box.
+        'cpu_load': cpu / (cycles * period),
+        'cycle_time': max(cycle_times),
+        'overrun_rate': overruns / cycles,
+        'max_tanks_per_period': int(period * num_tanks / max(cycle_times)),
+        'memory_per_tank': memory / num_tanks,
+        'received': stats['accepted'],
+        'rejected': stats['rejected'],
+    }
+
+
+def report(results):
+    print(f"{'tanks':>7}{'samples/s':>11}{'cpu/sample':>12}{'load%':>7}"
+          f"{'cycle(s)':>10}{'overrun':>9}{'KB/tank':>9}{'received':>10}")
+    for r in results:
+        print(f"{r['tanks']:>7}{r['samples_per_second']:>11.0f}"
+              f"{r['cpu_per_sample'] * 1e6:>10.0f}us"
+              f"{100 * r['cpu_load']:>7.3f}"
+              f"{r['cycle_time']:>10.0f}{100 * r['overrun_rate']:>8.0f}%"
+              f"{r['memory_per_tank'] / 1024:>9.1f}"
+              f"{100 * r['received'] / r['samples']:>9.1f}%")
+    if results:
+        print(f"Sampled one after another, a period fits about "
+              f"{results[-1]['max_tanks_per_period']}"
+              f" tanks per cycle.")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tanks', default='10,100,1000',
+                        help='comma separated fleet sizes to try')
+    parser.add_argument('--cycles', type=int, default=3)
+    parser.add_argument('--period', type=float, default=15 * 60,
+                        help='seconds between cycles')
+    parser.add_argument('--poll-time', type=float,
+                        help='seconds each GPIO read takes, eg 2e-6')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    results = []
+    with TelegrafListener(port=0, tcp=False) as listener:
+        for num_tanks in (int(n) for n in args.tanks.split(',')):
+            results.append(run_fleet(num_tanks, args.cycles, args.period,
+                                     args.poll_time, listener, args.seed))
+    report(results)
+
+
+if __name__ == "__main__":
+    main()
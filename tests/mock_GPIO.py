@@ -1,33 +1,46 @@
-from collections import defaultdict
-
-# Inspired by code from Joe Sacher https://github.com/sacherjj
-# Docs http://www.joesacher.com/blog/2017/10/14/rpi-hardware-mocking/
-
 """
 Simulates a board that is interfaced via RPi.GPIO for mock test purposes.
 Set and get pin direction (IN or OUT) and state (HIGH or LOW).
 You can register callbacks on state transitions as part of your emulation.
+
+The module level functions work on a single default board, just like
+RPi.GPIO. For simulations needing more pins than one board has (eg dozens
+of sensors) create further Board objects: each has the same functions as
+methods.
+
+Boards are thread safe. Edges are dispatched to callbacks one at a time,
+in the order they happened, even when pins are changed from several
+threads (eg Timers simulating echoes). A callback that changes a pin has
+that edge's callbacks run after it returns, not in the middle of it.
 """
+
+import threading
+import time
+from collections import deque
+
+# Inspired by code from Joe Sacher https://github.com/sacherjj
+# Docs http://www.joesacher.com/blog/2017/10/14/rpi-hardware-mocking/
+
 # Constants defined in GPIO.
 # First the ones we actually use:
 BCM = 11
 BOARD = 10
 FALLING = 32
 RISING = 31
+BOTH = 33
 HIGH = 1
 LOW = 0
 IN = 1
 OUT = 0
 UNKNOWN = -1  # used for board state, pin direction and pin state
+PUD_DOWN = 21
+PUD_OFF = 20
+PUD_UP = 22
 
 # Then the ones we don't.
 # Future use:
-BOTH = 33
 HARD_PWM = 43
 I2C = 42
-PUD_DOWN = 21
-PUD_OFF = 20
-PUD_UP = 22
 SERIAL = 40
 SPI = 41
 VERSION = '0.7.0'  # When I developed this mock, it was against this version.
@@ -64,274 +77,420 @@ _board_to_bcm = {3: 2,
                  38: 20,
                  40: 21}
 
+# Computed once, not on every pin access.
 _valid_pins = {
-    UNKNOWN: (),
-    BCM: _board_to_bcm.values(),
-    BOARD: _board_to_bcm.keys()
+    BCM: frozenset(_board_to_bcm.values()),
+    BOARD: frozenset(_board_to_bcm.keys())
 }
 
-# BOARD or BCM
-_mode = UNKNOWN
-
-# Holds current status [ direction, state ] for each pin
-# where direction is IN or OUT and state is HIGH or LOW.
-_pins = {}
-
-# Hold list of callbacks for edge transititions
-# [ direction, (partial)function ], indexed by pin.
-# where direction is RISING (ie LOW to HIGH) or FALLING (ie HIGH to LOW).
-_edge_callback = defaultdict(list)
-
-
-def _cleanup():
-    # Reset the board. With apologies to the gods of DRY.
-    global _mode
-    global _pins
-    global _edge_callback
-
-    _mode = UNKNOWN
-    _pins = {}
-    _edge_callback = defaultdict(list)
-
-
-def _get_board_mode():
-    """Return the board's mode: BCM, BOARD or UNKNOWN if not initialised yet."""
-    return _mode
-
-
-def _set_board_mode(pin_numbering_style):
-    """Set the board's mode: BCM or BOARD."""
-    global _mode
-    global _pins
-
-    if pin_numbering_style not in (BCM, BOARD):
-        raise ValueError('mode should be BCM or BOARD.')
-    _mode = pin_numbering_style
-
-    pin_list = _board_to_bcm.values() if _mode == BCM else _board_to_bcm.keys()
-
-    # Initialise the board. You may prefer to set these to something else,
-    # depending on the behaviour of the board under simuation.
-    _pins = {}
-    for pin in pin_list:
-        _pins[pin] = {'direction': UNKNOWN, 'state': UNKNOWN}
-
-
-def is_input(pin):
-    """Test given pin's direction is set as input. Returns True / False."""
-    _check_pin_number(pin)
-    return _pins[pin]['direction'] == IN
-
-def is_output(pin):
-    """Test given pin's direction is set as output. Returns True / False."""
-    _check_pin_number(pin)
-    return _pins[pin]['direction'] == OUT
-
-def get_direction(pin):
-    """Returns direction (IN or OUT) for given pin."""
-    _check_pin_number(pin)
-    return _pins[pin]['direction']
-
-def set_direction(pin, direction, clear_callbacks=True):
-    """Sets direction (IN or OUT) for given pin.
-    Optionally, but by default, clear any callbacks on this pin.
-    This will happen even if the old direction is the same as the new."""
-    _check_pin_number(pin)
-    if direction not in (IN, OUT):
-        raise ValueError(f'Expected {IN} or {OUT}, got {direction}')
-    _pins[pin]['direction'] = direction
-    if clear_callbacks:
-        deregister_event_callback(pin, edge_type=None, callback=None)
-
-
-def input_is_high(pin):
-    _check_pin_number(pin)
-    if is_input(pin):
-        return _pins[pin]['state'] == HIGH
-    raise ValueError(f'Pin {pin} is not set to IN direction.')
-
-def input_is_low(pin):
-    _check_pin_number(pin)
-    if is_input(pin):
-        return _pins[pin]['state'] == LOW
-    raise ValueError(f'Pin {pin} is not set to IN direction.')
-
-def get_input_state(pin):
-    """Check pin direction is input. If so return its state (HIGH or LOW).
-
-    Set state using simulate_input_state_change in whatever test code you
-    use to simulate your GPIO board's behaviour."""
-    _check_pin_number(pin)
-    if is_input(pin):
-        return _pins[pin]['state']
-    raise ValueError(f'Pin {pin} is not set to IN direction.')
-
-def init_input_state(pin, state):
-    """Setup an IN pin's HIGH or LOW state. Only use during initialisation -
-    will not trigger callbacks.
-    But then should you have callbacks at that point anyway?"""
-    _check_pin_number(pin)
-    if not is_input(pin):
-        raise ValueError(f'Pin {pin} is not set to IN direction.')
-    if state not in (HIGH, LOW):
-        raise ValueError(f'Expected {HIGH} or {LOW}, got {state}')
-    _pins[pin]['state'] = state
-
-def simulate_input_state_change(pin, state):
-    """Simulate an IN pin getting set by the GPIO board.
-
-    If this changes the state,
-        execute any callbacks registered for that transition.
-    else:
-        return silently.
-
-    If that 'silently' is a problem ie you expect your code to always change
-    the state, never to set it to the same state it already is,
-    then do a get_input_state test before calling this function.
-    """
-    _check_pin_number(pin)
-    if not is_input(pin):
-        raise ValueError(f'Pin {pin} is not set to IN direction.')
-    _state_change(pin, IN, state)
-
-
-def output_is_high(pin):
-    _check_pin_number(pin)
-    if is_output(pin):
-        return _pins[pin]['state'] == HIGH
-    raise ValueError(f'Pin {pin} is not set to OUT direction.')
-
-def output_is_low(pin):
-    _check_pin_number(pin)
-    if is_output(pin):
-        return _pins[pin]['state'] == LOW
-    raise ValueError(f'Pin {pin} is not set to OUT direction.')
-
-def get_output_pin_state(pin):
-    """Test that an OUT pin has been set correctly."""
-    _check_pin_number(pin)
-    if is_output(pin):
-        return _pins[pin]['state']
-    raise ValueError(f'Pin {pin} is not set to OUT direction.')
-
-def init_output_state(pin, state):
-    """Setup an OUT pin to HIGH or LOW. Only use during initialisation -
-    will not trigger callbacks.
-    But then should you have callbacks at that point anyway?"""
-    _check_pin_number(pin)
-    if not is_output(pin):
-        raise ValueError(f'Pin {pin} is not set to OUT direction.')
-    if state not in (HIGH, LOW):
-        raise ValueError(f'Expected {HIGH} or {LOW}, got {state}')
-    _pins[pin]['state'] = state
-
-def set_output_pin_state(pin, state):
-    """Set an output pin to state, HIGH or LOW.
-
-    If this changes the state:
-        execute any callbacks registered for that transition.
-    else:
-        return silently.
-
-    If that 'silently' is a problem ie you expect your code to always change
-    the state, never to set it to the same state it already is,
-    then do a get_output_state test before calling this function.
-    """
-    _check_pin_number(pin)
-    if not is_output(pin):
-        raise ValueError(f'Pin {pin} is not set to OUT direction.')
-    _state_change(pin, OUT, state)
-
-
-def _state_change(pin, direction, state):
-    global _pins
+_EDGES = (RISING, FALLING)
 
-    if state not in (HIGH, LOW):
-        raise ValueError(f'Expected {HIGH} or {LOW}, got {state}')
-    if state == _pins[pin]['state']:
-        return
 
-    _pins[pin]['state'] = state
-    _trigger_any_edge_callbacks(pin, RISING if state == HIGH else FALLING)
+class _Pin():
+    """Current status of one pin.
 
-def _trigger_any_edge_callbacks(pin, edge_type):
-    for callpair in _edge_callback[pin]:
-        if callpair[0] == edge_type:
-            callpair[1]()
-
-def register_event_callback(pin, edge_type, callback):
-    global _edge_callback
-
-    _check_pin_number(pin)
-    if edge_type not in (RISING, FALLING):
-        raise ValueError('Edge_type should be RISING or FALLING.')
-    _edge_callback[pin].append((edge_type, callback))
-
-def deregister_event_callback(pin, edge_type=None, callback=None):
-    global _edge_callback
-
-    _check_pin_number(pin)
-    if edge_type not in (RISING, FALLING, None):
-        raise ValueError('Edge_type should be RISING or FALLING (or None).')
-    for callpair in _edge_callback[pin]:
-        if edge_type is None or callpair[0] == edge_type:
-            if callback is None or callpair[1] == callback:
-                _edge_callback[pin].remove(callpair)
-                # No return - could be multiple callbacks on that condistion.
-
-
-# Handle the fact that the different board types have different numbering
-# schemes.
-def _check_pin_number(pin):
-    if _mode == UNKNOWN:
-        raise ValueError('Mode has not been set.')
-    if pin not in _valid_pins[_mode]:
-        raise ValueError(f'Pin_number {pin} is invalid for mode: {_mode}')
-
-
-# Could also add some tests to verify that you are not trying to set
-# a volatge pin, etc?
-def get_registered_event_callbacks():
-    raise NotImplementedError
-
-# GPIO library functions
-def add_event_callback():
-    raise NotImplementedError
-
-def add_event_detect():
-    raise NotImplementedError
-
-def event_detected():
-    raise NotImplementedError
-
-def gpio_function():
-    raise NotImplementedError
-
-def remove_event_detect():
-    raise NotImplementedError
-
-def setwarnings():
-    raise NotImplementedError
-
-def wait_for_edge():
-    raise NotImplementedError
-# Also not implemented: anything to do with PWM, I2C, SPI.
-
-# Map all implemented GPIO function names to our internal naming scheme.
-def getmode():
-    return _get_board_mode()
-
-def setmode(pin_numbering_style):
-    return _set_board_mode(pin_numbering_style)
-
-def setup(pin, direction):
-    return set_direction(pin, direction, clear_callbacks=True)
-
-def output(pin, state):
-    return set_output_pin_state(pin, state)
-
-def input(pin):
-    return get_input_state(pin)
-
-def cleanup():
-    return _cleanup()
+    direction is IN or OUT, state is HIGH or LOW.
+    callbacks holds, per edge type, a tuple of functions to call on that
+    transition. Tuples are replaced rather than changed so an edge can
+    take a snapshot of them without copying.
+    """
+    __slots__ = ('number', 'direction', 'state', 'callbacks',
+                 'detect', 'detect_callbacks', 'bouncetime', 'last_detect',
+                 'detected', 'edge_counts')
+
+    def __init__(self, number):
+        self.number = number
+        # You may prefer to set these to something else, depending on the
+        # behaviour of the board under simuation.
+        self.direction = UNKNOWN
+        self.state = UNKNOWN
+        self.callbacks = {RISING: (), FALLING: ()}
+        # add_event_detect settings: edge type, callbacks taking the
+        # channel, bouncetime in seconds.
+        self.detect = None
+        self.detect_callbacks = ()
+        self.bouncetime = 0
+        self.last_detect = None
+        self.detected = False
+        # Edges seen so far, for wait_for_edge.
+        self.edge_counts = {RISING: 0, FALLING: 0}
+
+
+class Board():
+    """One simulated GPIO board. See the module docstring."""
+    # So a Board can be passed anywhere the module can, eg to DistanceSensor.
+    BCM = BCM
+    BOARD = BOARD
+    RISING = RISING
+    FALLING = FALLING
+    BOTH = BOTH
+    HIGH = HIGH
+    LOW = LOW
+    IN = IN
+    OUT = OUT
+    UNKNOWN = UNKNOWN
+
+    def __init__(self):
+        # Guards pin state. Also the Condition wait_for_edge waits on.
+        self._lock = threading.RLock()
+        self._edge_seen = threading.Condition(self._lock)
+        # Edges waiting for their callbacks to run, in order:
+        # (callbacks, args) pairs.
+        self._events = deque()
+        # Held by whichever thread is running callbacks.
+        self._dispatching = threading.Lock()
+        self._cleanup()
+
+    def _cleanup(self):
+        with self._lock:
+            self._mode = UNKNOWN
+            self._pins = {}
+            self._warnings = True
+
+    def _get_board_mode(self):
+        """Return the board's mode: BCM, BOARD or UNKNOWN if not initialised."""
+        return self._mode
+
+    def _set_board_mode(self, pin_numbering_style):
+        """Set the board's mode: BCM or BOARD."""
+        if pin_numbering_style not in (BCM, BOARD):
+            raise ValueError('mode should be BCM or BOARD.')
+        with self._lock:
+            # As RPi.GPIO: setting it again is fine, changing it isn't.
+            if self._mode == pin_numbering_style:
+                return
+            if self._mode != UNKNOWN:
+                raise ValueError('A different mode has already been set!')
+            self._mode = pin_numbering_style
+            self._pins = {pin: _Pin(pin)
+                          for pin in _valid_pins[pin_numbering_style]}
+
+    # Handle the fact that the different board types have different
+    # numbering schemes. A pin is valid if it is in _pins, which is only
+    # filled in once the mode is set.
+    def _get_pin(self, pin):
+        try:
+            return self._pins[pin]
+        except KeyError:
+            if self._mode == UNKNOWN:
+                raise ValueError('Mode has not been set.') from None
+            raise ValueError(
+                f'Pin_number {pin} is invalid for mode: {self._mode}') from None
+
+    def _get_pin_with_direction(self, pin, direction):
+        p = self._get_pin(pin)
+        if p.direction != direction:
+            name = 'IN' if direction == IN else 'OUT'
+            raise ValueError(f'Pin {pin} is not set to {name} direction.')
+        return p
+
+    def is_input(self, pin):
+        """Test given pin's direction is set as input. Returns True / False."""
+        return self._get_pin(pin).direction == IN
+
+    def is_output(self, pin):
+        """Test given pin's direction is set as output. Returns True / False."""
+        return self._get_pin(pin).direction == OUT
+
+    def get_direction(self, pin):
+        """Returns direction (IN or OUT) for given pin."""
+        return self._get_pin(pin).direction
+
+    def set_direction(self, pin, direction, clear_callbacks=True):
+        """Sets direction (IN or OUT) for given pin.
+        Optionally, but by default, clear any callbacks on this pin.
+        This will happen even if the old direction is the same as the new."""
+        p = self._get_pin(pin)
+        if direction not in (IN, OUT):
+            raise ValueError(f'Expected {IN} or {OUT}, got {direction}')
+        with self._lock:
+            p.direction = direction
+            if clear_callbacks:
+                p.callbacks = {RISING: (), FALLING: ()}
+                p.detect = None
+                p.detect_callbacks = ()
+
+    def input_is_high(self, pin):
+        return self._get_pin_with_direction(pin, IN).state == HIGH
+
+    def input_is_low(self, pin):
+        return self._get_pin_with_direction(pin, IN).state == LOW
+
+    def get_input_state(self, pin):
+        """Check pin direction is input. If so return its state (HIGH or LOW).
+
+        Set state using simulate_input_state_change in whatever test code you
+        use to simulate your GPIO board's behaviour."""
+        return self._get_pin_with_direction(pin, IN).state
+
+    def init_input_state(self, pin, state):
+        """Setup an IN pin's HIGH or LOW state. Only use during initialisation -
+        will not trigger callbacks.
+        But then should you have callbacks at that point anyway?"""
+        p = self._get_pin_with_direction(pin, IN)
+        if state not in (HIGH, LOW):
+            raise ValueError(f'Expected {HIGH} or {LOW}, got {state}')
+        p.state = state
+
+    def simulate_input_state_change(self, pin, state):
+        """Simulate an IN pin getting set by the GPIO board.
+
+        If this changes the state,
+            execute any callbacks registered for that transition.
+        else:
+            return silently.
+
+        If that 'silently' is a problem ie you expect your code to always
+        change the state, never to set it to the same state it already is,
+        then do a get_input_state test before calling this function.
+        """
+        self._state_change(self._get_pin_with_direction(pin, IN), state)
+
+    def output_is_high(self, pin):
+        return self._get_pin_with_direction(pin, OUT).state == HIGH
+
+    def output_is_low(self, pin):
+        return self._get_pin_with_direction(pin, OUT).state == LOW
+
+    def get_output_pin_state(self, pin):
+        """Test that an OUT pin has been set correctly."""
+        return self._get_pin_with_direction(pin, OUT).state
+
+    def init_output_state(self, pin, state):
+        """Setup an OUT pin to HIGH or LOW. Only use during initialisation -
+        will not trigger callbacks.
+        But then should you have callbacks at that point anyway?"""
+        p = self._get_pin_with_direction(pin, OUT)
+        if state not in (HIGH, LOW):
+            raise ValueError(f'Expected {HIGH} or {LOW}, got {state}')
+        p.state = state
+
+    def set_output_pin_state(self, pin, state):
+        """Set an output pin to state, HIGH or LOW.
+
+        If this changes the state:
+            execute any callbacks registered for that transition.
+        else:
+            return silently.
+
+        If that 'silently' is a problem ie you expect your code to always
+        change the state, never to set it to the same state it already is,
+        then do a get_output_state test before calling this function.
+        """
+        self._state_change(self._get_pin_with_direction(pin, OUT), state)
+
+    def _state_change(self, p, state):
+        if state not in (HIGH, LOW):
+            raise ValueError(f'Expected {HIGH} or {LOW}, got {state}')
+        with self._lock:
+            if state == p.state:
+                return
+            p.state = state
+            edge = RISING if state == HIGH else FALLING
+            p.edge_counts[edge] += 1
+            self._edge_seen.notify_all()
+            # Queue this edge's callbacks while still holding the lock, so
+            # the queue is in the same order as the edges.
+            callbacks = p.callbacks[edge]
+            if callbacks:
+                self._events.append((callbacks, ()))
+            if p.detect in (edge, BOTH) and not self._bouncing(p):
+                p.detected = True
+                if p.detect_callbacks:
+                    self._events.append((p.detect_callbacks, (p.number,)))
+        self._dispatch()
+
+    @staticmethod
+    def _bouncing(p):
+        """Is this edge within bouncetime of the last one detected?"""
+        now = time.monotonic()
+        if p.bouncetime and p.last_detect is not None \
+                and now - p.last_detect < p.bouncetime:
+            return True
+        p.last_detect = now
+        return False
+
+    def _dispatch(self):
+        """Run queued callbacks, oldest first, unless someone else is."""
+        while self._events:
+            # If another thread (or this one, further up the stack) is
+            # already dispatching it will pick up our events: it only stops
+            # once the queue is empty, and rechecks after letting go.
+            if not self._dispatching.acquire(blocking=False):
+                return
+            try:
+                while self._events:
+                    callbacks, args = self._events.popleft()
+                    for callback in callbacks:
+                        callback(*args)
+            finally:
+                self._dispatching.release()
+
+    def register_event_callback(self, pin, edge_type, callback):
+        """Call callback(), with no arguments, on each edge_type transition."""
+        p = self._get_pin(pin)
+        if edge_type not in _EDGES:
+            raise ValueError('Edge_type should be RISING or FALLING.')
+        with self._lock:
+            p.callbacks[edge_type] += (callback,)
+
+    def deregister_event_callback(self, pin, edge_type=None, callback=None):
+        p = self._get_pin(pin)
+        if edge_type not in (RISING, FALLING, None):
+            raise ValueError('Edge_type should be RISING or FALLING (or None).')
+        with self._lock:
+            for edge in _EDGES:
+                if edge_type is None or edge == edge_type:
+                    # Could be multiple callbacks on that condition.
+                    p.callbacks[edge] = tuple(
+                        c for c in p.callbacks[edge]
+                        if callback is not None and c != callback)
+
+    # Could also add some tests to verify that you are not trying to set
+    # a volatge pin, etc?
+    def get_registered_event_callbacks(self, pin):
+        """Return a list of (edge_type, callback) registered on pin."""
+        p = self._get_pin(pin)
+        return [(edge, c) for edge in _EDGES for c in p.callbacks[edge]]
+
+    # GPIO library functions
+    def add_event_detect(self, channel, edge, callback=None, bouncetime=None):
+        """Detect edge (RISING, FALLING or BOTH) on an input channel.
+
+        bouncetime is in milliseconds, as in RPi.GPIO.
+        """
+        p = self._get_pin_with_direction(channel, IN)
+        if edge not in (RISING, FALLING, BOTH):
+            raise ValueError('The edge must be set to RISING, FALLING '
+                             'or BOTH')
+        with self._lock:
+            if p.detect is not None:
+                raise RuntimeError('Conflicting edge detection already '
+                                   'enabled for this GPIO channel')
+            p.detect = edge
+            p.bouncetime = (bouncetime or 0) / 1000
+            p.last_detect = None
+            p.detected = False
+            p.detect_callbacks = (callback,) if callback else ()
+
+    def add_event_callback(self, channel, callback):
+        """Call callback(channel) on each edge detected on channel."""
+        p = self._get_pin(channel)
+        with self._lock:
+            if p.detect is None:
+                raise RuntimeError('Add event detection using '
+                                   'add_event_detect first before adding '
+                                   'a callback')
+            p.detect_callbacks += (callback,)
+
+    def event_detected(self, channel):
+        """Has a detected edge happened since we last asked?"""
+        p = self._get_pin(channel)
+        with self._lock:
+            detected = p.detected
+            p.detected = False
+        return detected
+
+    def remove_event_detect(self, channel):
+        p = self._get_pin(channel)
+        with self._lock:
+            p.detect = None
+            p.detect_callbacks = ()
+            p.detected = False
+
+    def wait_for_edge(self, channel, edge, bouncetime=None, timeout=None):
+        """Block until edge happens on channel.
+
+        timeout is in milliseconds, as in RPi.GPIO.
+        Returns channel, or None if timeout expires first.
+        """
+        p = self._get_pin_with_direction(channel, IN)
+        if edge not in (RISING, FALLING, BOTH):
+            raise ValueError('The edge must be set to RISING, FALLING '
+                             'or BOTH')
+        edges = _EDGES if edge == BOTH else (edge,)
+        with self._lock:
+            # Count edges rather than watch the state, so an edge that is
+            # immediately followed by another isn't missed.
+            start = [p.edge_counts[e] for e in edges]
+            seen = self._edge_seen.wait_for(
+                lambda: [p.edge_counts[e] for e in edges] != start,
+                None if timeout is None else timeout / 1000)
+        return channel if seen else None
+
+    def gpio_function(self, channel):
+        """Return IN, OUT or UNKNOWN for channel."""
+        return self._get_pin(channel).direction
+
+    def setwarnings(self, flag):
+        self._warnings = flag
+    # Not implemented: anything to do with PWM, I2C, SPI.
+
+    # Map GPIO function names to our internal naming scheme.
+    def getmode(self):
+        return self._get_board_mode()
+
+    def setmode(self, pin_numbering_style):
+        return self._set_board_mode(pin_numbering_style)
+
+    def setup(self, pin, direction, pull_up_down=PUD_OFF, initial=None):
+        self.set_direction(pin, direction, clear_callbacks=True)
+        if initial is not None and direction == OUT:
+            self.init_output_state(pin, initial)
+
+    def output(self, pin, state):
+        return self.set_output_pin_state(pin, state)
+
+    def input(self, pin):
+        return self.get_input_state(pin)
+
+    def cleanup(self, channel=None):
+        """Reset channel, a list of them or, by default, everything.
+
+        Once no pin is in use the mode is forgotten too, as RPi.GPIO.
+        """
+        if channel is None:
+            return self._cleanup()
+        channels = (channel,) if isinstance(channel, int) else channel
+        with self._lock:
+            for pin in channels:
+                self._get_pin(pin)
+                self._pins[pin] = _Pin(pin)
+            if all(p.direction == UNKNOWN for p in self._pins.values()):
+                self._cleanup()
+
+
+# The default board, and its methods as module functions so this module
+# can stand in for RPi.GPIO.
+_board = Board()
+
+is_input = _board.is_input
+is_output = _board.is_output
+get_direction = _board.get_direction
+set_direction = _board.set_direction
+input_is_high = _board.input_is_high
+input_is_low = _board.input_is_low
+get_input_state = _board.get_input_state
+init_input_state = _board.init_input_state
+simulate_input_state_change = _board.simulate_input_state_change
+output_is_high = _board.output_is_high
+output_is_low = _board.output_is_low
+get_output_pin_state = _board.get_output_pin_state
+init_output_state = _board.init_output_state
+set_output_pin_state = _board.set_output_pin_state
+register_event_callback = _board.register_event_callback
+deregister_event_callback = _board.deregister_event_callback
+get_registered_event_callbacks = _board.get_registered_event_callbacks
+add_event_detect = _board.add_event_detect
+add_event_callback = _board.add_event_callback
+event_detected = _board.event_detected
+remove_event_detect = _board.remove_event_detect
+wait_for_edge = _board.wait_for_edge
+gpio_function = _board.gpio_function
+setwarnings = _board.setwarnings
+getmode = _board.getmode
+setmode = _board.setmode
+setup = _board.setup
+output = _board.output
+input = _board.input
+cleanup = _board.cleanup
@@ -9,6 +9,7 @@ class TelegrafClient():
         assert port == 8094
         assert tags == {'src': 'bucket'}
 
-    def metric(self, measurement_name, values):
+    def metric(self, measurement_name, values, tags=None, timestamp=None):
         assert measurement_name == 'lolat'
-        assert values == {'reading': -1, 'volume': -1}
+        assert values in ({'reading': -1, 'volume': -1, 'quality': 'good'},
+                          {'quality': 'invalid'})
@@ -0,0 +1,367 @@
+#!/usr/bin/python3
+"""A local stand-in for Telegraf's socket_listener, for load testing.
+
+Listens for line protocol on UDP and/or TCP (port 8094 by default, same as
+Telegraf), parses and validates every line, and keeps count of:
+- accepted and rejected lines, with the first few errors,
+- lines received per second,
+- drops and reordering: per series (measurement + tags), a timestamp
+  earlier than the last one seen is counted as reordered. If points carry
+  an integer 'seq' field, gaps in it are counted as drops, and the last
+  seq again as a duplicate.
+
+It can also misbehave on purpose: add latency to every line, or go down
+for a while (outage) and come back on the same port.
+
+Run it in place of Telegraf, eg while lolat.py runs:
+    python3 tests/telegraf_listener.py
+Or have it load test lolat.insert_data against itself:
+    python3 tests/telegraf_listener.py --load 100000 --protocol tcp \
+        --outage-every 2 --outage-for 0.5
+"""
+
+import argparse
+import contextlib
+import io
+import socket
+import threading
+import time
+from collections import Counter
+
+import context  # noqa: F401 Puts lolat on the path.
+import lolat
+from line_protocol import parse_line, LineProtocolError, SocketClient
+
+# Keep this many error messages, no more.
+MAX_ERRORS = 100
+
+
+class TelegrafListener():
+    """Receive, check and count line protocol. See the module docstring.
+
+    Args:
+        host, port: to listen on. Port 0 picks a free one, see self.port.
+        udp, tcp: which protocols to listen on.
+        latency: seconds to wait before handling each line.
+        keep_points: keep every parsed point in self.points.
+    """
+    def __init__(self, host='127.0.0.1', port=8094, udp=True, tcp=True,
+                 latency=0.0, keep_points=False):
+        self.host = host
+        self.port = port
+        self.udp = udp
+        self.tcp = tcp
+        self.latency = latency
+        self.keep_points = keep_points
+        self.points = []
+        self._lock = threading.Lock()
+        self._received = threading.Condition(self._lock)
+        self._up = False
+        self._sockets = []
+        self._threads = []
+        self._outage_timer = None
+        self.reset()
+
+    def reset(self):
+        """Forget everything received so far."""
+        with self._lock:
+            self.accepted = 0
+            self.rejected = 0
+            self.dropped = 0
+            self.reordered = 0
+            self.duplicates = 0
+            self.errors = []
+            self.points = []
+            self._per_second = Counter()
+            self._field_types = {}
+            self._last_timestamp = {}
+            self._last_seq = {}
+
+    # Start, stop and outages.
+
+    def start(self):
+        """Start listening. Returns self, so it can be used with 'with'."""
+        if self.tcp:
+            server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            server.bind((self.host, self.port))
+            # With port 0, UDP must use the port TCP got.
+            self.port = server.getsockname()[1]
+            server.listen()
+            self._serve(self._accept_tcp, server)
+        if self.udp:
+            server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            server.bind((self.host, self.port))
+            self.port = server.getsockname()[1]
+            self._serve(self._receive_udp, server)
+        self._up = True
+        return self
+
+    def stop(self):
+        """Stop listening and drop any open connections."""
+        if self._outage_timer:
+            self._outage_timer.cancel()
+            self._outage_timer = None
+        self._go_down()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def outage(self, duration):
+        """Go down now, come back on the same port after duration seconds.
+
+        Returns immediately.
+        """
+        self._go_down()
+        self._outage_timer = threading.Timer(duration, self.start)
+        self._outage_timer.daemon = True
+        self._outage_timer.start()
+
+    @property
+    def is_up(self):
+        return self._up
+
+    def _go_down(self):
+        self._up = False
+        for sock in self._sockets:
+            with contextlib.suppress(OSError):
+                sock.shutdown(socket.SHUT_RDWR)
+            sock.close()
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join(1)
+        self._sockets = []
+        self._threads = []
+
+    def _serve(self, target, sock):
+        self._sockets.append(sock)
+        thread = threading.Thread(target=target, args=(sock,), daemon=True)
+        self._threads.append(thread)
+        thread.start()
+
+    def _accept_tcp(self, server):
+        while True:
+            try:
+                conn, _ = server.accept()
+            except OSError:
+                return  # Closed by _go_down.
+            self._serve(self._receive_tcp, conn)
+
+    def _receive_tcp(self, conn):
+        # With latency set we read slowly, so TCP pushes back on the sender.
+        with conn.makefile('rb') as f:
+            try:
+                for line in f:
+                    self._handle(line)
+            except (OSError, ValueError):
+                return  # Closed by _go_down.
+
+    def _receive_udp(self, server):
+        while True:
+            try:
+                data = server.recv(65536)
+            except OSError:
+                return  # Closed by _go_down.
+            # One datagram can hold many lines.
+            for line in data.splitlines():
+                self._handle(line)
+
+    # Checking and counting.
+
+    def _handle(self, raw):
+        if self.latency:
+            time.sleep(self.latency)
+        line = raw.decode(errors='replace').strip()
+        if not line or line.startswith('#'):
+            return
+        now = time.time()
+        try:
+            point = parse_line(line)
+        except LineProtocolError as e:
+            with self._lock:
+                self._reject(str(e))
+            return
+        with self._lock:
+            self._record(point, now)
+
+    def _reject(self, message):
+        self.rejected += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append(message)
+
+    def _record(self, point, now):
+        measurement, tags, values, timestamp = point
+        # Influx rejects a field whose type differs from what it has stored.
+        for field, value in values.items():
+            key = (measurement, field)
+            stored = self._field_types.setdefault(key, type(value))
+            if stored is not type(value):
+                self._reject(f'{measurement}.{field}: type conflict, '
+                             f'{type(value).__name__} != {stored.__name__}')
+                return
+
+        series = (measurement, tuple(sorted(tags.items())))
+        late = False
+        if timestamp is not None:
+            last = self._last_timestamp.get(series)
+            if last is not None and timestamp < last:
+                late = True
+            else:
+                self._last_timestamp[series] = timestamp
+        seq = values.get('seq')
+        if isinstance(seq, int):
+            last = self._last_seq.get(series)
+            if last is None or seq > last:
+                if last is not None:
+                    self.dropped += seq - last - 1
+                self._last_seq[series] = seq
+            elif seq == last:
+                # Sent twice, eg retried after a lost ack. Neither late nor
+                # a drop made good.
+                self.duplicates += 1
+            else:
+                # Counted as dropped when we skipped it. Not dropped after
+                # all, just out of order.
+                late = True
+                self.dropped = max(self.dropped - 1, 0)
+        if late:
+            self.reordered += 1
+
+        self.accepted += 1
+        self._per_second[int(now)] += 1
+        if self.keep_points:
+            self.points.append(point)
+        self._received.notify_all()
+
+    # Results.
+
+    def wait_for(self, count, timeout=None):
+        """Wait until count lines have been accepted. Returns True if so."""
+        with self._lock:
+            return self._received.wait_for(lambda: self.accepted >= count,
+                                           timeout)
+
+    def rates(self):
+        """Lines accepted per second, as sorted (epoch second, count)."""
+        with self._lock:
+            return sorted(self._per_second.items())
+
+    def stats(self):
+        """Return a dict summarising everything received."""
+        rates = [count for _, count in self.rates()]
+        with self._lock:
+            return {
+                'accepted': self.accepted,
+                'rejected': self.rejected,
+                'dropped': self.dropped,
+                'reordered': self.reordered,
+                'duplicates': self.duplicates,
+                'peak_rate': max(rates, default=0),
+                'mean_rate': sum(rates) / len(rates) if rates else 0,
+                'errors': list(self.errors),
+            }
+
+
+def load_insert_data(listener, count, protocol='udp', outage_every=None,
+                     outage_for=1.0):
+    """Send count points through lolat.insert_data to the listener.
+
+    Optionally take the listener down for outage_for seconds every
+    outage_every seconds, to see how the writer path copes.
+
+    Returns:
+        (sent, failed, elapsed): points sent without an exception, points
+        whose send raised one, and seconds taken.
+    """
+    def connect():
+        return SocketClient(listener.host, listener.port,
+                            {'src': 'bucket'}, protocol)
+
+    client = None
+    sent = failed = 0
+    start = last_outage = time.monotonic()
+    # insert_data prints every point. Don't load test the terminal.
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(count):
+            if outage_every and \
+                    time.monotonic() - last_outage >= outage_every:
+                listener.outage(outage_for)
+                last_outage = time.monotonic()
+            try:
+                if client is None:
+                    client = connect()
+                lolat.insert_data(client, i % 4400, i)
+                sent += 1
+            except OSError:
+                failed += 1
+                if client:
+                    client.close()
+                client = None
+    if client:
+        client.close()
+    return sent, failed, time.monotonic() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8094)
+    parser.add_argument('--no-udp', action='store_true')
+    parser.add_argument('--no-tcp', action='store_true')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds to wait before handling each line')
+    parser.add_argument('--outage-every', type=float, metavar='SECONDS',
+                        help='go down this often')
+    parser.add_argument('--outage-for', type=float, default=1.0,
+                        metavar='SECONDS', help='for this long')
+    parser.add_argument('--load', type=int, metavar='N',
+                        help='send N points with lolat.insert_data, '
+                             'report and exit')
+    parser.add_argument('--protocol', choices=('udp', 'tcp'), default='udp',
+                        help='for --load')
+    args = parser.parse_args(argv)
+
+    listener = TelegrafListener(args.host, args.port, not args.no_udp,
+                                not args.no_tcp, args.latency)
+    with listener:
+        if args.load:
+            sent, failed, elapsed = load_insert_data(
+                listener, args.load, args.protocol, args.outage_every,
+                args.outage_for)
+            listener.wait_for(sent, timeout=2)
+            stats = listener.stats()
+            # insert_data points carry no 'seq' so drops only show here.
+            print(f'Sent {sent} ({failed} failed) in {elapsed:.2f}s, '
+                  f'{sent / elapsed:.0f}/s. '
+                  f"Lost {sent - stats['accepted']} after sending.")
+            print(stats)
+            return
+
+        print(f'Listening on {args.host}:{listener.port}. Ctrl-C to stop.')
+        last_outage = time.monotonic()
+        try:
+            while True:
+                time.sleep(1)
+                if args.outage_every and \
+                        time.monotonic() - last_outage >= args.outage_every:
+                    listener.outage(args.outage_for)
+                    last_outage = time.monotonic()
+                stats = listener.stats()
+                rates = listener.rates()
+                print(f"{'up  ' if listener.is_up else 'DOWN'} "
+                      f"last second {rates[-1][1] if rates else 0}/s, "
+                      f"accepted {stats['accepted']}, "
+                      f"rejected {stats['rejected']}, "
+                      f"dropped {stats['dropped']}, "
+                      f"reordered {stats['reordered']}, "
+                      f"duplicates {stats['duplicates']}")
+        except KeyboardInterrupt:
+            print(listener.stats())
+
+
+if __name__ == "__main__":
+    main()
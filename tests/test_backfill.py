@@ -0,0 +1,178 @@
+#!/usr/bin/python3
+"""Unit tests for backfill of historical readings."""
+
+import io
+import json
+import os
+import pytest
+from context import lolat
+import config
+np = pytest.importorskip('numpy')
+import backfill  # noqa: E402
+
+_INFLUX_EXPORT = """\
+#group,false,false,true,true,false,false,true,true,true
+#datatype,string,long,dateTime:RFC3339,dateTime:RFC3339,dateTime:RFC3339,\
+double,string,string,string
+#default,_result,,,,,,,,
+,result,table,_start,_stop,_time,_value,_field,_measurement,src
+,,0,2020-11-01T00:00:00Z,2020-12-01T00:00:00Z,2020-11-04T10:00:00Z,\
+100,reading,lolat,bucket
+,,0,2020-11-01T00:00:00Z,2020-12-01T00:00:00Z,2020-11-04T10:15:00Z,\
+0,reading,lolat,bucket
+,,0,2020-11-01T00:00:00Z,2020-12-01T00:00:00Z,2020-11-04T10:30:00Z,\
+101.5,reading,lolat,bucket
+
+#group,false,false,true,true,false,false,true,true,true
+#datatype,string,long,dateTime:RFC3339,dateTime:RFC3339,dateTime:RFC3339,\
+long,string,string,string
+#default,_result,,,,,,,,
+,result,table,_start,_stop,_time,_value,_field,_measurement,src
+,,1,2020-11-01T00:00:00Z,2020-12-01T00:00:00Z,2020-11-04T10:00:00Z,\
+229,volume,lolat,bucket
+"""
+
+
+def _write(tmp_path, text, name='readings.csv'):
+    path = tmp_path / name
+    path.write_text(text)
+    return str(path)
+
+
+def test_remap_matches_map_volume():
+    """The vectorised mapping must give exactly what the live path does."""
+    readings = np.arange(27, 4401, dtype=np.float64)
+    keep, kept, volumes = backfill.remap(readings, 27, 4400)
+    assert keep.all()
+    assert volumes.tolist() == [lolat.map_volume(r) for r in kept.tolist()]
+
+
+def test_remap_matches_tank_map_volume():
+    """And what a configured tank's does, calibrated or not."""
+    calibration = ((100.0, 5000.0), (200.0, 3000.0), (350.0, 1234.5))
+    sloped, calibrated = config.parse({'tanks': {
+        'a': {'sensor': 'simulated', 'slope': -3.5, 'offset': 9000},
+        'b': {'sensor': 'simulated'}}}).tanks
+    calibrated = calibrated._replace(calibration=calibration)
+    readings = np.arange(27, 4401, dtype=np.float64)
+    for tank in (sloped, calibrated):
+        _, kept, volumes = backfill.remap(readings, 27, 4400, tank)
+        assert volumes.tolist() == [tank.map_volume(r)
+                                    for r in kept.tolist()]
+
+
+def test_remap_drops_invalid():
+    """0 is what lolat writes on sensor error. Drop it and out of range."""
+    readings = np.array([0, 26, 27, 4400, 4401], dtype=np.float64)
+    keep, kept, _ = backfill.remap(readings, 27, 4400)
+    assert keep.tolist() == [False, False, True, True, False]
+    assert kept.tolist() == [27, 4400]
+
+
+def test_to_nanoseconds():
+    assert backfill.to_nanoseconds(['1604484000000000000']).tolist() == \
+        [1604484000000000000]
+    assert backfill.to_nanoseconds(['2020-11-04T10:00:00Z']).tolist() == \
+        [1604484000000000000]
+
+
+def test_influx_export(tmp_path):
+    """Only 'reading' rows are used. Invalid readings are dropped."""
+    source = _write(tmp_path, _INFLUX_EXPORT)
+    sink = io.StringIO()
+    result = backfill.backfill(source, sink, tags={'src': 'bucket'})
+    assert (result['read'], result['written'], result['dropped']) == (3, 2, 1)
+    assert sink.getvalue().splitlines() == [
+        'lolat,src=bucket reading=100i,volume=229i 1604484000000000000',
+        'lolat,src=bucket reading=102i,volume=183i 1604485800000000000']
+
+
+def test_plain_csv_with_checkpoint(tmp_path):
+    """Resuming from a checkpoint gives the same output as one run."""
+    rows = ''.join(f'{1604484000000000000 + i},{100 + i}\n'
+                   for i in range(10))
+    source = _write(tmp_path, 'time,reading\n' + rows)
+    checkpoint = str(tmp_path / 'checkpoint.json')
+
+    one_go = io.StringIO()
+    backfill.backfill(source, one_go, batch_size=4)
+
+    # Stop after the first batch, as if interrupted.
+    output = tmp_path / 'out.lp'
+    with open(output, 'w') as sink:
+        with pytest.raises(KeyboardInterrupt):
+            backfill.backfill(source, sink, checkpoint, batch_size=4,
+                              progress=_Interrupt())
+    # Simulate a crash after writing output but before the checkpoint.
+    with open(output, 'a') as sink:
+        sink.write('lolat partial line')
+    with open(output, 'r+') as sink:
+        result = backfill.backfill(source, sink, checkpoint, batch_size=4)
+    assert result['written'] == 10
+    assert output.read_text() == one_go.getvalue()
+
+
+def test_checkpoint_for_other_source(tmp_path):
+    source = _write(tmp_path, '1,100\n')
+    checkpoint = str(tmp_path / 'checkpoint.json')
+    backfill.save_checkpoint(checkpoint, {'source': '/some/other.csv'})
+    with pytest.raises(backfill.BackfillError):
+        backfill.backfill(source, io.StringIO(), checkpoint)
+
+
+def test_malformed_rows_skipped(tmp_path):
+    """A short row, eg an export cut off mid line, is skipped."""
+    source = _write(tmp_path, _INFLUX_EXPORT + ',,0,2020-11-04T10:30')
+    result = backfill.backfill(source, io.StringIO())
+    assert (result['read'], result['malformed']) == (3, 1)
+
+
+def test_rows_without_a_reading_skipped(tmp_path):
+    """Invalid points have no reading. Nor, in a CSV, do they crash it."""
+    source = _write(tmp_path, 'time,reading,quality\n'
+                              '1604484000000000000,,invalid\n'
+                              '1604484900000000000,100,good\n'
+                              '1604485800000000000,n/a,invalid\n')
+    sink = io.StringIO()
+    result = backfill.backfill(source, sink)
+    assert (result['read'], result['written'], result['malformed']) == \
+        (1, 1, 2)
+    assert sink.getvalue() == ('lolat,src=bucket reading=100i,volume=229i '
+                               '1604484900000000000\n')
+
+
+def test_resume_with_output_missing(tmp_path):
+    source = _write(tmp_path, '1604484000000000000,100\n')
+    checkpoint = str(tmp_path / 'checkpoint.json')
+    output = str(tmp_path / 'out.lp')
+    backfill.main([source, '-o', output, '-k', checkpoint])
+    os.remove(output)
+    with pytest.raises(SystemExit, match='is missing'):
+        backfill.main([source, '-o', output, '-k', checkpoint])
+
+
+def test_configured_tank(tmp_path):
+    """A tank's mapping, range and tags come from the config file."""
+    source = _write(tmp_path, '1604484000000000000,100\n'
+                              '1604484900000000000,2500\n')
+    path = tmp_path / 'lolat.json'
+    path.write_text(json.dumps({'tanks': {
+        'bucket': {},
+        'butt': {'pin_trigger': 13, 'pin_echo': 15, 'dist_max': 2000,
+                 'slope': -150.0, 'offset': 300000,
+                 'tags': {'src': 'butt', 'site': 'garden'}}}}))
+    output = tmp_path / 'out.lp'
+    backfill.main([source, '-o', str(output), '-c', str(path),
+                   '-t', 'butt'])
+    assert output.read_text() == (
+        'lolat,site=garden,src=butt reading=100i,volume=285000i '
+        '1604484000000000000\n')
+    with pytest.raises(SystemExit):
+        backfill.main([source, '-o', str(output), '-c', str(path),
+                       '-t', 'barrel'])
+
+
+class _Interrupt():
+    """Progress 'file' that interrupts the backfill on first write."""
+    def write(self, text):
+        raise KeyboardInterrupt
@@ -0,0 +1,82 @@
+#!/usr/bin/python3
+"""Unit tests for raw echo capture and its analysis."""
+
+import io
+import pytest
+from context import lolat, virtual_sensor
+import hc_sr04
+import analyse_capture
+from simulator import SimulatedBoard, ScriptedProfile, EchoProfile
+
+
+class _DeadBoard(SimulatedBoard):
+    """The sensor never answers."""
+    def _fire(self, now):
+        self.pulses += 1
+
+
+def _capture(sensor, count, **kwargs):
+    f = io.BytesIO()
+    with sensor.open():
+        written = sensor.capture(f, count, **kwargs)
+    return written, f.getvalue()
+
+
+def test_capture_file_layout():
+    sensor = virtual_sensor(ScriptedProfile([1000, 2000, None]))
+    written, data = _capture(sensor, 7, block=3)
+    assert written == 7
+    header = hc_sr04.CAPTURE_HEADER.unpack_from(data)
+    assert header == (hc_sr04.CAPTURE_MAGIC, hc_sr04.CAPTURE_VERSION,
+                      hc_sr04.CAPTURE_RECORD.size)
+    records = list(hc_sr04.CAPTURE_RECORD.iter_unpack(
+        data[hc_sr04.CAPTURE_HEADER.size:]))
+    assert len(records) == 7
+    trigger, rise, fall, status = records[0]
+    assert status == hc_sr04.CAPTURE_OK
+    assert 343000 * (fall - rise) / 2 == pytest.approx(1000)
+    # Pulses 60ms apart.
+    assert records[1][0] - trigger == pytest.approx(0.06)
+
+
+def test_capture_no_rise_times_out():
+    sensor = virtual_sensor(ScriptedProfile([1000]), board_class=_DeadBoard,
+                            board_options={'poll_time': 1e-4})
+    written, data = _capture(sensor, 2)
+    records = list(hc_sr04.CAPTURE_RECORD.iter_unpack(
+        data[hc_sr04.CAPTURE_HEADER.size:]))
+    assert [r[3] for r in records] == [hc_sr04.CAPTURE_NO_RISE] * 2
+
+
+def test_analyse(tmp_path):
+    sensor = virtual_sensor(EchoProfile(1000, noise=2, missing=0.1, seed=1))
+    path = tmp_path / 'capture.bin'
+    with sensor.open(), open(path, 'wb') as f:
+        sensor.capture(f, 2000)
+    records = analyse_capture.load(path)
+    assert len(records) == 2000
+    results = analyse_capture.analyse(records)
+    assert results['pulses'] == 2000
+    assert results['pulse_rate'] == pytest.approx(1 / 0.06, rel=0.01)
+    # Missing echoes time out at the sensor, 38ms or ~6.5m: too far.
+    assert 100 < results['too_far'] < 300
+    assert results['percentiles'][50] == pytest.approx(1000, abs=1)
+    assert results['min_in_range'] == pytest.approx(1000, abs=10)
+    assert results['noise_floor'] == pytest.approx(2, rel=0.2)
+    assert sum(count for _, count in results['histogram']) == 2000
+
+
+def test_load_rejects_other_files(tmp_path):
+    path = tmp_path / 'capture.bin'
+    path.write_bytes(b'time,reading\n1,2\n')
+    with pytest.raises(analyse_capture.CaptureError):
+        analyse_capture.load(path)
+
+
+def test_main(tmp_path, capsys):
+    path = tmp_path / 'capture.bin'
+    hc_sr04.main([str(path), '-n', '50', '--simulate', '500'])
+    analyse_capture.main([str(path)])
+    out = capsys.readouterr().out
+    assert 'Captured 50 pulses' in out
+    assert '50 pulses, 50 echoes' in out
@@ -0,0 +1,250 @@
+#!/usr/bin/python3
+"""Unit tests for the config file and multi-tank sampling."""
+
+import json
+import os
+import time
+import pytest
+from context import lolat, Client, simulated_tank
+import config
+from config import ConfigError, ConfigWatcher
+from metrics_server import Health
+import calibrate_bucket
+
+
+def _write(path, settings):
+    path.write_text(json.dumps(settings))
+    # Make sure the watcher sees a new mtime, however coarse the clock.
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+
+def test_defaults_are_the_original_bucket():
+    defaults = config.load()
+    assert defaults.period == config.PERIOD
+    assert defaults.sink.backend == 'telegraf'
+    assert dict(defaults.sink.options) == {'host': 'localhost',
+                                           'port': 8094}
+    tank, = defaults.tanks
+    assert tank.name == 'bucket'
+    assert (tank.pin_trigger, tank.pin_echo) == (7, 11)
+    assert dict(tank.tags) == {'src': 'bucket'}
+    assert tank.map_volume(100) == lolat.map_volume(100)
+    assert (tank.retries, tank.min_valid, tank.on_invalid) == (3, 3, 'null')
+    assert tank.time_budget == config.TIME_BUDGET < tank.period
+    quick, = config.parse({'tanks': {'a': {'period': 1}}}).tanks
+    assert quick.time_budget == 1
+
+
+@pytest.mark.parametrize('settings, match', [
+    ({'periods': 60}, 'unknown setting'),
+    ({'period': '60'}, 'expected int or float'),
+    ({'tanks': {}}, 'no tanks'),
+    ({'tanks': {'a': {'pin_echo': 7}}}, 'same pin'),
+    ({'tanks': {'a': {'dist_min': 500, 'dist_max': 100}}}, 'dist_min'),
+    ({'tanks': {'a': {}, 'b': {'pin_trigger': 11, 'pin_echo': 13}}},
+     'pin 11 is already used by a'),
+    ({'sink': {'port': True}}, 'sink.port'),
+    ({'tanks': {'a': {'on_invalid': 'zero'}}}, 'null, carry'),
+    ({'tanks': {'a': {'min_valid': 2}}}, 'min_valid'),
+])
+def test_parse_errors(settings, match):
+    with pytest.raises(ConfigError, match=match):
+        config.parse(settings)
+
+
+def test_simulated_tanks_may_share_pins():
+    tanks = config.parse({'tanks': {'a': {'sensor': 'simulated'},
+                                    'b': {'sensor': 'simulated'}}}).tanks
+    assert [tank.name for tank in tanks] == ['a', 'b']
+
+
+def test_calibration(tmp_path):
+    (tmp_path / 'cal.json').write_text(
+        json.dumps([[300, 1000], [100, 5000], [200, 3000], [200, 9999]]))
+    path = tmp_path / 'lolat.json'
+    _write(path, {'tanks': {'bucket': {'calibration': 'cal.json'}}})
+    tank, = config.load(str(path)).tanks
+    assert tank.calibration_file == str(tmp_path / 'cal.json')
+    assert tank.calibration == ((100, 5000), (200, 3000), (300, 1000))
+    assert tank.map_volume(150) == 4000
+    assert tank.map_volume(200) == 3000
+    # Beyond the ends: the end.
+    assert tank.map_volume(50) == 5000
+    assert tank.map_volume(400) == 1000
+    assert isinstance(tank.map_volume(275), int)
+
+
+def test_bad_calibration(tmp_path):
+    (tmp_path / 'cal.json').write_text('{"not": "pairs"}')
+    with pytest.raises(ConfigError, match='pairs'):
+        config.parse({'tanks': {'bucket': {'calibration': 'cal.json'}}},
+                     str(tmp_path / 'lolat.json'))
+    with pytest.raises(ConfigError, match='Calibration'):
+        config.parse({'tanks': {'bucket': {'calibration': 'none.json'}}},
+                     str(tmp_path / 'lolat.json'))
+
+
+def test_watcher(tmp_path):
+    path = tmp_path / 'lolat.json'
+    _write(path, {'tanks': {'a': {}, 'b': {'pin_trigger': 13,
+                                           'pin_echo': 15}}})
+    watcher = ConfigWatcher(str(path))
+    old = watcher.config
+    assert watcher.check() is None
+
+    _write(path, {'tanks': {'b': {'pin_trigger': 13, 'pin_echo': 15,
+                                  'period': 60}, 'c': {}}})
+    new = watcher.check()
+    assert new is watcher.config
+    assert config.changes(old, new) == (['c'], ['b'], ['a'])
+    assert watcher.check() is None
+
+    # A broken file leaves the old config in place, and isn't reported
+    # again until it changes.
+    path.write_text('{')
+    os.utime(path, ns=(0, 0))
+    with pytest.raises(ConfigError):
+        watcher.check()
+    assert watcher.config is new
+    assert watcher.check() is None
+
+
+def test_watcher_sees_calibration_change(tmp_path):
+    cal = tmp_path / 'cal.json'
+    _write(cal, [[100, 5000], [200, 3000]])
+    path = tmp_path / 'lolat.json'
+    _write(path, {'tanks': {'bucket': {'calibration': 'cal.json'}}})
+    watcher = ConfigWatcher(str(path))
+    _write(cal, [[100, 6000], [200, 3000]])
+    assert watcher.check().tanks[0].map_volume(100) == 6000
+
+
+def test_run_tanks_at_their_own_periods(tmp_path, monkeypatch):
+    client = Client()
+    monkeypatch.setattr(lolat, 'make_client', lambda *args: client)
+    path = tmp_path / 'lolat.json'
+    _write(path, {'tanks': {'near': simulated_tank(500, 0.01),
+                            'far': simulated_tank(2000, 10)}})
+    lolat.run(ConfigWatcher(str(path)), Health(), max_samples=6,
+              check_interval=0.005)
+    # Both straight away, then near until far is due again.
+    assert client.readings()[:2] == [('near', 500), ('far', 2000)]
+    assert client.readings()[2:] == [('near', 500)] * 4
+
+
+def test_run_reloads_only_changed_tanks(tmp_path, monkeypatch):
+    client = Client()
+    monkeypatch.setattr(lolat, 'make_client', lambda *args: client)
+    path = tmp_path / 'lolat.json'
+    _write(path, {'tanks': {'a': simulated_tank(500),
+                            'b': simulated_tank(600)}})
+    built = []
+    tank_class = lolat.Tank
+
+    def tank(config, due, override=None):
+        built.append(config.name)
+        return tank_class(config, due, override)
+    monkeypatch.setattr(lolat, 'Tank', tank)
+
+    def reload_requested():
+        if len(client.readings()) == 2:
+            _write(path, {'tanks': {'a': simulated_tank(500),
+                                    'b': simulated_tank(700)}})
+            return True
+        return False
+
+    health = Health()
+    lolat.run(ConfigWatcher(str(path)), health, max_samples=4,
+              check_interval=0.005, reload_requested=reload_requested)
+    assert built == ['a', 'b', 'b']
+    assert sorted(client.readings()[2:]) == [('a', 500), ('b', 700)]
+    assert health.tanks.keys() == {'a', 'b'}
+
+
+def test_run_survives_a_bad_reload(tmp_path, monkeypatch):
+    client = Client()
+    monkeypatch.setattr(lolat, 'make_client', lambda *args: client)
+    path = tmp_path / 'lolat.json'
+    _write(path, {'tanks': {'a': simulated_tank(500)}})
+    watcher = ConfigWatcher(str(path))
+    path.write_text('{"tanks": ')
+    os.utime(path, ns=(0, 0))
+    health = Health()
+    lolat.run(watcher, health, max_samples=3, check_interval=0.005)
+    assert client.readings() == [('a', 500)] * 3
+    assert health.errors['config_errors'] == 1
+
+
+def test_sensor_override():
+    tank, = config.load().tanks
+    sensor = tank.make_sensor(('simulated', {'distance': 900, 'noise': 0}))
+    assert (sensor.PIN_TRIGGER, sensor.PIN_ECHO) == (7, 11)
+    with sensor.open():
+        assert sensor.get_distance() == 900
+
+
+def test_calibrate_tank_without_calibration_yet(tmp_path, monkeypatch):
+    path = tmp_path / 'lolat.json'
+    _write(path, {'tanks': {'bucket': {
+        'calibration': 'bucket_calibration.json'}}})
+    with pytest.raises(ConfigError, match='Calibration'):
+        config.load(str(path))
+    tank, = config.load(str(path), calibrations=False).tanks
+    assert tank.calibration == ()
+
+    # One reading with the bucket empty, then done.
+    monkeypatch.setattr('builtins.input', lambda prompt: 'q')
+    calibrate_bucket.main(['-c', str(path), '-t', 'bucket',
+                           '--simulate', '500'])
+    tank, = config.load(str(path)).tanks
+    assert tank.calibration == ((500, 0),)
+
+
+def test_reload_swapping_pins():
+    import mock_GPIO
+    old = config.parse({'tanks': {
+        'a': {}, 'b': {'pin_trigger': 13, 'pin_echo': 15}}})
+    new = config.parse({'tanks': {
+        'a': {'pin_trigger': 13, 'pin_echo': 15}, 'b': {}}})
+    tanks = lolat.open_tanks(old.tanks)
+    try:
+        lolat.apply_config(tanks, old, new, Health())
+        # Neither new tank has had its pins reset by the other's old one.
+        for tank in tanks.values():
+            assert mock_GPIO.is_output(tank.config.pin_trigger)
+            assert mock_GPIO.is_input(tank.config.pin_echo)
+    finally:
+        for tank in tanks.values():
+            tank.close()
+
+
+def test_run_reports_dead_and_dropped_tanks(tmp_path, monkeypatch):
+    client = Client()
+    monkeypatch.setattr(lolat, 'make_client', lambda *args: client)
+    dead = simulated_tank(500, 5)
+    dead['sensor_options'] = dict(dead['sensor_options'], missing=1.0)
+    path = tmp_path / 'lolat.json'
+    _write(path, {'tanks': {'good': simulated_tank(500, 100),
+                            'dead': dead}})
+    health = Health()
+    started = time.time()
+    lolat.run(ConfigWatcher(str(path)), health, max_samples=2,
+              check_interval=0.005)
+    assert health.is_healthy(now=started + 9)
+    # Never a valid reading: unhealthy after two of its periods.
+    assert health.tank_health(now=started + 11) == {'good': True,
+                                                    'dead': False}
+
+    old = config.load(str(path))
+    new = config.parse({'tanks': {'good': simulated_tank(500, 100),
+                                  'bad': {'sensor': 'no_such_sensor'}}})
+    tanks = lolat.open_tanks(old.tanks)
+    try:
+        lolat.apply_config(tanks, old, new, health)
+    finally:
+        for tank in tanks.values():
+            tank.close()
+    assert health.dropped == {'bad'}
+    assert health.tank_health(now=started + 11) == {'good': True,
+                                                    'bad': False}
@@ -0,0 +1,118 @@
+#!/usr/bin/python3
+"""Unit tests for the sensor and sink registry."""
+
+import argparse
+import os
+import subprocess
+import sys
+import pytest
+from context import lolat
+import drivers
+from drivers import DriverError
+from hc_sr04 import EdgeDistanceSensor
+from line_protocol import SocketClient
+from replay import ReplaySensor
+from simulator import VirtualClock, SimulatedBoard, ScriptedProfile
+
+
+def test_simulated_sensor():
+    sensor = drivers.sensor('simulated', distance=700, noise=0)
+    with sensor.open():
+        assert sensor.get_distance() == 700
+    assert sensor._gpio.poll_time == drivers.PI_POLL_TIME
+
+
+def test_unknown_backend():
+    with pytest.raises(DriverError, match='hc_sr04'):
+        drivers.sensor('no_such_sensor')
+    with pytest.raises(DriverError):
+        drivers.sink('no_such_module:Client')
+
+
+def test_module_attribute_and_register():
+    sensor = drivers.sensor('replay:ReplaySensor', path='capture.bin')
+    assert isinstance(sensor, ReplaySensor)
+    drivers.register_sink('test_list', list)
+    try:
+        assert drivers.sink('test_list') == []
+    finally:
+        del drivers.SINKS['test_list']
+
+
+def test_line_protocol_sink():
+    client = drivers.sink('line_protocol', host='127.0.0.1', port=8094,
+                          tags={'src': 'bucket'})
+    assert isinstance(client, SocketClient)
+    client.close()
+
+
+def test_imports_are_lazy():
+    """Loading lolat doesn't load any GPIO or Telegraf library."""
+    code = ('import sys; import context; import lolat; '
+            'print(sorted(m for m in sys.modules if m.split(".")[0] in '
+            '("RPi", "mock_GPIO", "telegraf", "mock_telegraf")))')
+    out = subprocess.run([sys.executable, '-c', code], check=True,
+                         capture_output=True, text=True,
+                         cwd=os.path.dirname(__file__)).stdout
+    assert out.strip() == '[]'
+
+
+def test_edge_sensor():
+    clock = VirtualClock()
+    board = SimulatedBoard(clock, ScriptedProfile([1000]))
+    sensor = EdgeDistanceSensor(gpio=board, clock=clock)
+    with sensor.open():
+        assert sensor.get_distance() == 1000
+        # Never reads in a busy-wait loop.
+        before = clock.time()
+        sensor._get_pulse_round_trip_time()
+        assert clock.time() - before < 0.07
+
+
+def test_edge_sensor_no_echo():
+    class _DeadBoard(SimulatedBoard):
+        def _fire(self, now):
+            self.pulses += 1
+
+    clock = VirtualClock()
+    sensor = EdgeDistanceSensor(gpio=_DeadBoard(clock, None), clock=clock)
+    with sensor.open():
+        with pytest.raises(sensor.InvalidDistanceError):
+            sensor.get_distance()
+
+
+def test_replay_sensor(tmp_path):
+    path = tmp_path / 'capture.bin'
+    recorded = drivers.sensor('simulated', distance=1200, noise=0,
+                              poll_time=None)
+    with recorded.open(), open(path, 'wb') as f:
+        recorded.capture(f, 7)
+    sensor = drivers.sensor('replay', path=str(path), loop=False)
+    with sensor.open():
+        assert sensor.get_distance() == 1200
+        with pytest.raises(EOFError):
+            sensor.get_distance()
+
+
+def test_replay_rejects_other_files(tmp_path):
+    path = tmp_path / 'capture.bin'
+    path.write_bytes(b'time,reading\n1,2\n')
+    with pytest.raises(ValueError):
+        with ReplaySensor(str(path)).open():
+            pass
+
+
+def test_sensor_override():
+    parser = argparse.ArgumentParser()
+    drivers.add_arguments(parser)
+    args = parser.parse_args(['--simulate', '900',
+                              '--sensor-option', 'noise=0'])
+    name, options = drivers.sensor_override(args)
+    sensor = drivers.sensor(name, **options)
+    with sensor.open():
+        assert sensor.get_distance() == 900
+    args = parser.parse_args(['--sensor', 'replay', '--sensor-option',
+                              'path=x.bin', '--sensor-option', 'loop=false'])
+    assert drivers.sensor_override(args) == \
+        ('replay', {'path': 'x.bin', 'loop': False})
+    assert drivers.sensor_override(parser.parse_args([])) == (None, {})
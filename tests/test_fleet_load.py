@@ -0,0 +1,29 @@
+#!/usr/bin/python3
+"""Tests for the synthetic fleet load generator."""
+
+import pytest
+from context import lolat
+from fleet_load import TankDynamics, run_fleet
+
+
+def test_dynamics_stay_in_tank():
+    tank = TankDynamics(depth=1000, start=0.9, rate=1, wave_height=50)
+    for now in range(0, 5000, 7):
+        assert 0 <= tank.level(now) <= 1000
+        assert 50 <= tank.distance(now) <= 1050
+
+
+def test_dynamics_fill_then_drain():
+    tank = TankDynamics(depth=1000, start=0, rate=1)
+    assert tank.level(500) == 500
+    assert tank.level(1500) == 500  # Full at 1000s, then back down.
+
+
+@pytest.mark.timeout(10)
+def test_run_fleet():
+    result = run_fleet(20, cycles=2, period=60)
+    assert result['samples'] == 40
+    assert result['received'] == 40
+    assert result['overrun_rate'] == 0
+    # 20 tanks at ~0.3s each can't fit a 1s period.
+    assert run_fleet(20, cycles=1, period=1)['overrun_rate'] == 1
@@ -0,0 +1,125 @@
+#!/usr/bin/python3
+"""Unit tests for fusing several sensors on one tank."""
+
+import pytest
+from context import lolat, virtual_sensor
+import config
+import drivers
+from config import ConfigError
+from fusion import FusedSensor
+from hc_sr04 import DistanceSensor, EdgeDistanceSensor
+from simulator import ScriptedProfile
+
+
+def _sensor(script, sensor_class=DistanceSensor, **kwargs):
+    kwargs.setdefault('min_valid', 3)
+    return virtual_sensor(ScriptedProfile(script), sensor_class, **kwargs)
+
+
+def _distance(fused):
+    with fused.open():
+        return fused.get_distance()
+
+
+def test_agreeing_sensors():
+    fused = FusedSensor([_sensor([1000]), _sensor([1010])])
+    assert _distance(fused) == 1005
+    assert fused.weights[0] == fused.weights[1]
+
+
+def test_variance_weighting():
+    # The noisy one barely counts.
+    fused = FusedSensor([_sensor([1000]),
+                         _sensor([1100, 1300, 900, 1200, 1000])])
+    assert _distance(fused) == 1000
+    assert fused.weights[1] < fused.weights[0] / 1000
+
+
+def test_validity_weighting():
+    # 3 valid pulses against 5: weighted 3 to 5.
+    fused = FusedSensor([_sensor([1000, None, 1000, None, 1000]),
+                         _sensor([1016])])
+    assert _distance(fused) == 1010
+
+
+def test_degrades_when_one_fails():
+    fused = FusedSensor([_sensor([None, None, 1000]), _sensor([1200])])
+    assert _distance(fused) == 1200
+    assert fused.weights[0] is None
+
+    class Broken(DistanceSensor):
+        def _get_pulse_round_trip_time(self):
+            raise OSError('unplugged')
+    broken = virtual_sensor(ScriptedProfile([1]), Broken)
+    fused = FusedSensor([broken, _sensor([800])])
+    assert _distance(fused) == 800
+
+
+def test_all_fail():
+    fused = FusedSensor([_sensor([None]), _sensor([10])])
+    with fused.open():
+        with pytest.raises(fused.InvalidDistanceError):
+            fused.get_distance()
+        # Caught by lolat as for any other sensor.
+        assert lolat.get_reading_and_volume(fused, lolat.map_volume) == \
+            (None, None)
+
+
+def test_parallel():
+    fused = FusedSensor([_sensor([1000], EdgeDistanceSensor),
+                         _sensor([1020], EdgeDistanceSensor)],
+                        parallel=True)
+    with fused.open():
+        assert fused.get_distance() == 1010
+        assert fused.get_distance() == 1010
+    assert fused._executor is None
+
+
+def test_fused_backend():
+    simulated = {'sensor': 'simulated', 'noise': 0, 'poll_time': None}
+    fused = drivers.sensor('fused', dist_max=2000, sensors=[
+        dict(simulated, distance=600),
+        dict(simulated, distance=700, dist_max=3000)])
+    assert [sensor.DIST_MAX for sensor in fused.sensors] == [2000, 3000]
+    assert _distance(fused) == 650
+
+
+def test_fused_config():
+    tank, = config.parse({'tanks': {'a': {
+        'sensor': 'fused',
+        'sensor_options': {'sensors': [
+            {}, {'pin_trigger': 13, 'pin_echo': 15}]}}}}).tanks
+    assert isinstance(tank.make_sensor(), FusedSensor)
+    with pytest.raises(ConfigError, match='list of sensors'):
+        config.parse({'tanks': {'a': {'sensor': 'fused'}}})
+    with pytest.raises(ConfigError, match='pin 11'):
+        config.parse({'tanks': {'a': {
+            'sensor': 'fused',
+            'sensor_options': {'sensors': [{}, {'pin_trigger': 13}]}}}})
+
+
+def test_retries():
+    """Each sensor retries its invalid pulses."""
+    fused = FusedSensor([_sensor([None, 1000, None, 1000, 1000, 1000, 1000],
+                                 retries=2, min_valid=5),
+                         _sensor([1020])])
+    assert _distance(fused) == 1010
+    assert fused.sensors[0]._gpio.pulses == 7
+
+
+def test_time_budget_is_shared():
+    """Read in turn, the sensors share the budget, not get one each."""
+    budgets = []
+
+    class Recording(DistanceSensor):
+        def _get_valid_distances(self, time_budget=None):
+            budgets.append(time_budget)
+            return super()._get_valid_distances(time_budget)
+    fused = FusedSensor([_sensor([1000], Recording),
+                         _sensor([1000], Recording)], time_budget=1.0)
+    assert _distance(fused) == 1000
+    # Simulated sensors take no real time: half each.
+    assert budgets[0] == pytest.approx(0.5, abs=0.01)
+    assert budgets[1] == pytest.approx(1.0, abs=0.01)
+    assert drivers.sensor('fused', time_budget=2, sensors=[
+        {'sensor': 'simulated'}]).time_budget == 2
@@ -6,13 +6,15 @@ import time
 from threading import Timer
 from functools import partial
 import mock_GPIO as GPIO
-from context import lolat
+from context import lolat, virtual_sensor
 from hc_sr04 import DistanceSensor
+from simulator import EchoProfile, ScriptedProfile, Echo, distance_to_time
 
 # Python is far from a Real Time OS so don't expect anything like accurate
 # timing here. The purpose is to test your driver logic, pin setting etc.
 # It is not possible to simulate echo distances by setting input pins after
-# appropriate time intervals.
+# appropriate time intervals. Tests needing accurate echoes use the virtual
+# clock in simulator.py instead.
 
 # All distances are in millimeters, all times in seconds.
 # Speed of sound in air is about 343m/s = 343,000 mm/s.
@@ -70,36 +72,108 @@ def test_board_setup():
         assert GPIO.output_is_low(mock_sensor.PIN_TRIGGER)
         assert GPIO.is_input(mock_sensor.PIN_ECHO)
 
-# Couldn't get this to work in the Github VM
-# (due to Python multitask clock granularity?)
-# It returns InvalidDistanceError('Nothing in range of sensor?')
-# Fixed with issue #40
-@pytest.mark.timeout(3)
-def skip_test_sensor_1m():
-    """Simulate object very roughly 1m away"""
+# The mock_GPIO + Timer versions of these couldn't work reliably
+# (Python multitask clock granularity). Issue #40.
+# The simulator runs on a virtual clock so they are now exact.
+@pytest.mark.timeout(1)
+def test_sensor_1m():
+    """Simulate object 1m away"""
     test_distance = 1000  # 1m is 1000mm
-    mock_sensor = DistanceSensor()
+    mock_sensor = virtual_sensor(EchoProfile(test_distance))
     with mock_sensor.open():
-        _set_up_callback(mock_sensor, test_distance)
-        returned_distance = mock_sensor.get_distance()
-    assert _order_of_magnitude_equal(returned_distance, test_distance)
-
-# Couldn't get this to work on the MacBook
-# (due to Python multitask clock granularity?)
-# Any distance too short and the trigger event happens before
-# the code under test has time to listen for it.
-# Any longer and the Exception isn't raised.
-# Fixed with issue #40
-@pytest.mark.timeout(3)
-def skip_test_sensor_too_close_exception():
+        assert mock_sensor.get_distance() == test_distance
+
+@pytest.mark.timeout(1)
+def test_sensor_too_close_exception():
     """Simulate object too close to the sensor. Verify Exception is thrown."""
     test_distance = 20
-    mock_sensor = DistanceSensor()
+    mock_sensor = virtual_sensor(EchoProfile(test_distance))
+    with mock_sensor.open():
+        with pytest.raises(mock_sensor.InvalidDistanceError):
+            mock_sensor.get_distance()
+
+@pytest.mark.timeout(1)
+def test_sensor_drops_highest_and_lowest():
+    """Outliers either side are dropped, the rest averaged."""
+    profile = ScriptedProfile([500, 1000, 1001, 1002, 2000])
+    mock_sensor = virtual_sensor(profile)
+    with mock_sensor.open():
+        assert mock_sensor.get_distance() == 1001
+
+@pytest.mark.timeout(1)
+def test_sensor_missing_echo():
+    """No echo: the sensor gives up after 38ms, ie ~6.5m. Out of range."""
+    mock_sensor = virtual_sensor(ScriptedProfile([1000, None]))
+    with mock_sensor.open():
+        with pytest.raises(mock_sensor.InvalidDistanceError):
+            mock_sensor.get_distance()
+
+@pytest.mark.timeout(1)
+def test_sensor_stray_pulse():
+    """A stray pulse before the echo is measured instead of the echo."""
+    stray = Echo(1000, strays=[(0, distance_to_time(10))])
+    mock_sensor = virtual_sensor(ScriptedProfile([stray]))
     with mock_sensor.open():
-        _set_up_callback(mock_sensor, test_distance)
         with pytest.raises(mock_sensor.InvalidDistanceError):
             mock_sensor.get_distance()
 
+@pytest.mark.timeout(1)
+def test_sensor_round_trip_times_in_two_halves():
+    """Raw capture then the sums gives what get_distance does."""
+    profile = ScriptedProfile([500, 1000, 1001, 1002, 2000, 1000, 20])
+    mock_sensor = virtual_sensor(profile)
+    with mock_sensor.open():
+        round_trip_times = mock_sensor.get_round_trip_times()
+        assert len(round_trip_times) == mock_sensor.NUM_READINGS
+        assert mock_sensor.distance_from_round_trip_times(
+            round_trip_times) == 1001
+        with pytest.raises(mock_sensor.InvalidDistanceError):
+            mock_sensor.distance_from_round_trip_times(
+                mock_sensor.get_round_trip_times())
+
+@pytest.mark.timeout(1)
+def test_sensor_retries_replace_invalid_pulses():
+    """With retries a stray echo costs a pulse, not the reading."""
+    profile = ScriptedProfile([1000, None, 1001, 20, 1002, 1001, 1000])
+    mock_sensor = virtual_sensor(profile, retries=2)
+    with mock_sensor.open():
+        assert mock_sensor.get_distance() == 1001
+        assert mock_sensor._gpio.pulses == 7
+
+@pytest.mark.timeout(1)
+def test_sensor_min_valid():
+    """Out of retries: enough valid pulses still make a reading."""
+    profile = ScriptedProfile([1000, None, 1001, None, 1002, None])
+    mock_sensor = virtual_sensor(profile, retries=1, min_valid=3)
+    with mock_sensor.open():
+        assert mock_sensor.get_distance() == 1001
+    profile = ScriptedProfile([1000, None, None, 1001, None, 1002])
+    mock_sensor = virtual_sensor(profile, retries=1, min_valid=4)
+    with mock_sensor.open():
+        with pytest.raises(mock_sensor.InvalidDistanceError):
+            mock_sensor.get_distance()
+        # Gave up as soon as 4 were out of reach, without a 6th pulse.
+        assert mock_sensor._gpio.pulses == 5
+
+@pytest.mark.timeout(1)
+def test_sensor_retries_within_time_budget():
+    """No retries once the time budget is spent."""
+    profile = ScriptedProfile([None, 1000, 1000, 1000, 1000, 1000])
+    mock_sensor = virtual_sensor(profile, retries=5, min_valid=3,
+                                 time_budget=0.2)
+    with mock_sensor.open():
+        assert mock_sensor.get_distance() == 1000
+        # 5 pulses take more than 0.2s: no 6th.
+        assert mock_sensor._gpio.pulses == 5
+
+@pytest.mark.timeout(1)
+def test_sensor_round_trip_times_min_valid():
+    profile = ScriptedProfile([1000, None, 1001, 1002, 20])
+    mock_sensor = virtual_sensor(profile, min_valid=3)
+    with mock_sensor.open():
+        assert mock_sensor.distance_from_round_trip_times(
+            mock_sensor.get_round_trip_times()) == 1001
+
 @pytest.mark.timeout(3)
 def test_sensor_too_far_exception():
     """Simulate object too far from the sensor. Verify Exception is thrown."""
@@ -116,11 +190,3 @@ def test_board_cleanup():
     with mock_sensor.open():
         pass
     assert GPIO.getmode() == GPIO.UNKNOWN
-
-# TBD:
-# * More complex tests to exercise the 'drop highest and lowest and average
-#   the rest' code.
-#   Tricky because we need to change the callback duration mid test.
-#   Callbacks to set callbacks anyone?
-# * Test to check we don't trigger because of a stray echo from a previous test.
-#   Again tricky because of Python's timing inaccuracy.
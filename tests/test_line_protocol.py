@@ -0,0 +1,76 @@
+#!/usr/bin/python3
+"""Unit tests for line protocol formatting."""
+
+import socket
+import pytest
+from context import lolat
+import line_protocol
+
+
+def test_format_line():
+    assert line_protocol.format_line(
+        'lolat', {'reading': 100, 'volume': 229}, {'src': 'bucket'},
+        1604484000000000000) == \
+        'lolat,src=bucket reading=100i,volume=229i 1604484000000000000'
+
+
+def test_format_value_types():
+    assert line_protocol.format_value(True) == 'true'
+    assert line_protocol.format_value(3) == '3i'
+    assert line_protocol.format_value(0.5) == '0.5'
+    assert line_protocol.format_value('say "hi"') == r'"say \"hi\""'
+
+
+def test_escaping():
+    assert line_protocol.format_line(
+        'my tank', {'a=b': 1}, {'z': 'x,y', 'a': 'p q'}) == \
+        r'my\ tank,a=p\ q,z=x\,y a\=b=1i'
+
+
+def test_no_fields():
+    with pytest.raises(ValueError):
+        line_protocol.format_line('lolat', {})
+
+
+def test_socket_client_udp():
+    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink.bind(('127.0.0.1', 0))
+    sink.settimeout(1)
+    client = line_protocol.SocketClient('127.0.0.1', sink.getsockname()[1],
+                                        tags={'src': 'bucket'})
+    client.metric('lolat', {'reading': 1, 'volume': 2}, {'tank': 'a'}, 5)
+    assert sink.recv(1024) == \
+        b'lolat,src=bucket,tank=a reading=1i,volume=2i 5\n'
+    client.close()
+    sink.close()
+
+
+@pytest.mark.parametrize('values', [
+    {'reading': 100, 'volume': -229},
+    {'f': 0.5, 'b': True, 's': 'a "quoted", spaced\\ string'},
+])
+def test_parse_round_trip(values):
+    tags = {'src': 'my bucket', 'k=v': 'a,b'}
+    line = line_protocol.format_line('lo lat', values, tags, 123)
+    assert line_protocol.parse_line(line + '\n') == \
+        ('lo lat', tags, values, 123)
+
+
+def test_parse_no_timestamp():
+    assert line_protocol.parse_line('lolat reading=1i') == \
+        ('lolat', {}, {'reading': 1}, None)
+
+
+@pytest.mark.parametrize('line', [
+    'lolat',
+    'lolat ',
+    ',src=bucket reading=1i',
+    'lolat,src reading=1i',
+    'lolat reading=',
+    'lolat reading=abc',
+    'lolat reading="open',
+    'lolat reading=1i notatime',
+])
+def test_parse_invalid(line):
+    with pytest.raises(line_protocol.LineProtocolError):
+        line_protocol.parse_line(line)
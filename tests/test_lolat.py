@@ -2,7 +2,9 @@
 """Unit tests for lolat <> db interface."""
 
 import pytest
-from context import lolat
+from context import lolat, Client
+from config import parse
+from metrics_server import Health
 
 
 @pytest.mark.timeout(1)
@@ -22,3 +24,35 @@ def test_insert_data():
     Look for unhandled Errors. The mock itself tests for correct parameters."""
     db = lolat.db_handle()
     lolat.insert_data(db, -1, -1)
+
+
+def test_insert_invalid_data():
+    """An invalid reading is sent as quality only, never as a fake 0."""
+    db = lolat.db_handle()
+    lolat.insert_data(db, None, None)
+
+
+def test_send_sample_on_invalid():
+    null, carry = parse({'tanks': {
+        'null': {'sensor': 'simulated'},
+        'carry': {'sensor': 'simulated', 'on_invalid': 'carry'}}}).tanks
+    client = Client()
+    health = Health()
+    last = (812, 5000, 0.0)
+    assert lolat.send_sample(client, health, None, None, tank=null,
+                             last=last) == (None, None, lolat.INVALID)
+    assert lolat.send_sample(client, health, None, None, tank=carry,
+                             last=last) == (812, 5000, lolat.CARRIED)
+    # Nothing to carry yet.
+    assert lolat.send_sample(client, health, None, None,
+                             tank=carry)[2] == lolat.INVALID
+    assert lolat.send_sample(client, health, 700, 6000,
+                             tank=carry)[2] == lolat.GOOD
+    assert client.values() == [
+        {'quality': 'invalid'},
+        {'reading': 812, 'volume': 5000, 'quality': 'carried'},
+        {'quality': 'invalid'},
+        {'reading': 700, 'volume': 6000, 'quality': 'good'}]
+    assert health.errors['invalid_readings'] == 3
+    # Only good readings count as samples.
+    assert list(health.tanks) == ['carry']
@@ -0,0 +1,85 @@
+#!/usr/bin/python3
+"""Unit tests for the local metrics and health endpoint."""
+
+import json
+import urllib.error
+import urllib.request
+import pytest
+from context import lolat
+from metrics_server import Health, render, serve
+
+
+def test_render():
+    health = Health(period=60)
+    health.started = 1000
+    health.record_sample('bucket', 100, 229, now=1010)
+    health.record_error('invalid_readings')
+    health.record_cycle(0.5)
+    health.record_cycle(0.25)
+    health.record_queue(3, 2)
+    text = render(health, now=1040)
+    assert 'lolat_up 1\n' in text
+    assert 'lolat_volume_ml{tank="bucket"} 229\n' in text
+    assert 'lolat_reading_mm{tank="bucket"} 100\n' in text
+    assert 'lolat_last_sample_age_seconds{tank="bucket"} 30\n' in text
+    assert 'lolat_cycles_total 2\n' in text
+    assert 'lolat_cycle_seconds 0.25\n' in text
+    assert 'lolat_cycle_seconds_max 0.5\n' in text
+    assert 'lolat_errors_total{type="invalid_readings"} 1\n' in text
+    assert '# TYPE lolat_errors_total counter\n' in text
+    assert 'lolat_queue_depth 3\n' in text
+    assert 'lolat_errors_total{type="ring_overruns"} 2\n' in text
+
+
+def test_health():
+    health = Health(period=60)
+    health.started = 1000
+    assert health.is_healthy(now=1100)
+    assert not health.is_healthy(now=1200)
+    health.record_sample('bucket', 100, 229, now=1200)
+    health.record_sample('barrel', 100, 229, now=1100)
+    assert not health.is_healthy(now=1221)
+    health.record_sample('barrel', 100, 229, now=1220)
+    assert health.is_healthy(now=1221)
+
+
+def test_expected_tanks():
+    """Each tank against its own period, sampled yet or not."""
+    health = Health(period=60)
+    health.expect({'fast': 10, 'slow': 100, 'dead': 10}, now=1000)
+    health.record_sample('fast', 100, 229, now=1000)
+    health.record_sample('slow', 100, 229, now=1000)
+    assert health.is_healthy(now=1019)
+    assert health.tank_health(now=1021) == {'fast': False, 'slow': True,
+                                            'dead': False}
+    health.record_sample('fast', 100, 229, now=1020)
+    assert not health.is_healthy(now=1021)
+    assert 'lolat_tank_up{tank="dead"} 0\n' in render(health, now=1021)
+    assert 'lolat_tank_up{tank="slow"} 1\n' in render(health, now=1021)
+
+    # Re-expecting keeps when a tank was first expected.
+    health.expect({'fast': 10, 'dead': 10}, now=1015)
+    assert health.tank_health(now=1021) == {'fast': True, 'dead': False}
+    health.expect({'fast': 10, 'dead': 10}, dropped=['fast'], now=1015)
+    assert not health.tank_health(now=1021)['fast']
+
+
+@pytest.mark.timeout(5)
+def test_serve():
+    health = Health(period=60)
+    health.record_sample('bucket', 100, 229)
+    server = serve(health, '127.0.0.1', 0)
+    url = f'http://127.0.0.1:{server.server_address[1]}'
+    try:
+        with urllib.request.urlopen(url + '/metrics') as reply:
+            assert 'lolat_volume_ml{tank="bucket"} 229' in \
+                reply.read().decode()
+        with urllib.request.urlopen(url + '/health') as reply:
+            assert json.load(reply)['healthy']
+        health.period = 0
+        with pytest.raises(urllib.error.HTTPError) as e:
+            urllib.request.urlopen(url + '/health')
+        assert e.value.code == 503
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,142 @@
+#!/usr/bin/python3
+"""Unit tests for the mock GPIO board itself."""
+
+import threading
+import pytest
+import mock_GPIO as GPIO
+
+
+@pytest.fixture
+def board():
+    board = GPIO.Board()
+    board.setmode(GPIO.BOARD)
+    yield board
+    board.cleanup()
+
+
+def test_pin_validity(board):
+    with pytest.raises(ValueError):
+        board.setup(1, GPIO.IN)  # Pin 1 is 3.3V
+    board.setup(40, GPIO.IN)
+    board.cleanup()
+    with pytest.raises(ValueError):
+        board.setup(40, GPIO.IN)
+
+
+def test_boards_are_independent(board):
+    other = GPIO.Board()
+    other.setmode(GPIO.BCM)
+    other.setup(4, GPIO.OUT)
+    with pytest.raises(ValueError):
+        board.output(4, GPIO.HIGH)  # Not set up on this board.
+    other.output(4, GPIO.HIGH)
+    assert other.output_is_high(4)
+
+
+def test_callbacks_on_edges_only(board):
+    board.setup(7, GPIO.OUT, initial=GPIO.LOW)
+    edges = []
+    board.register_event_callback(7, GPIO.RISING, lambda: edges.append('R'))
+    board.register_event_callback(7, GPIO.FALLING, lambda: edges.append('F'))
+    for state in (GPIO.HIGH, GPIO.HIGH, GPIO.LOW, GPIO.HIGH):
+        board.output(7, state)
+    assert edges == ['R', 'F', 'R']
+
+
+def test_deregister(board):
+    board.setup(7, GPIO.OUT)
+    a, b = (lambda: None), (lambda: None)
+    board.register_event_callback(7, GPIO.RISING, a)
+    board.register_event_callback(7, GPIO.RISING, b)
+    board.register_event_callback(7, GPIO.FALLING, a)
+    board.deregister_event_callback(7, GPIO.RISING, a)
+    assert board.get_registered_event_callbacks(7) == \
+        [(GPIO.RISING, b), (GPIO.FALLING, a)]
+    board.deregister_event_callback(7)
+    assert board.get_registered_event_callbacks(7) == []
+
+
+def test_callback_changing_pins_is_not_reentered(board):
+    """Edges caused by a callback are dispatched after it, in order."""
+    board.setup(7, GPIO.OUT, initial=GPIO.LOW)
+    board.setup(11, GPIO.IN)
+    board.init_input_state(11, GPIO.LOW)
+    order = []
+
+    def on_trigger():
+        order.append('trigger start')
+        board.simulate_input_state_change(11, GPIO.HIGH)
+        board.simulate_input_state_change(11, GPIO.LOW)
+        order.append('trigger end')
+
+    board.register_event_callback(7, GPIO.RISING, on_trigger)
+    board.register_event_callback(11, GPIO.RISING,
+                                  lambda: order.append('echo rise'))
+    board.register_event_callback(11, GPIO.FALLING,
+                                  lambda: order.append('echo fall'))
+    board.output(7, GPIO.HIGH)
+    assert order == ['trigger start', 'trigger end', 'echo rise', 'echo fall']
+
+
+def test_event_detect(board):
+    board.setup(11, GPIO.IN)
+    board.init_input_state(11, GPIO.LOW)
+    channels = []
+    board.add_event_detect(11, GPIO.BOTH, callback=channels.append)
+    with pytest.raises(RuntimeError):
+        board.add_event_detect(11, GPIO.RISING)
+    assert not board.event_detected(11)
+    board.simulate_input_state_change(11, GPIO.HIGH)
+    board.simulate_input_state_change(11, GPIO.LOW)
+    assert board.event_detected(11)
+    assert not board.event_detected(11)
+    assert channels == [11, 11]
+    board.remove_event_detect(11)
+    board.simulate_input_state_change(11, GPIO.HIGH)
+    assert channels == [11, 11]
+    with pytest.raises(RuntimeError):
+        board.add_event_callback(11, channels.append)
+
+
+@pytest.mark.timeout(2)
+def test_wait_for_edge(board):
+    board.setup(11, GPIO.IN)
+    board.init_input_state(11, GPIO.LOW)
+    assert board.wait_for_edge(11, GPIO.RISING, timeout=10) is None
+
+    def pulse():
+        # A rise immediately followed by a fall must still be seen.
+        board.simulate_input_state_change(11, GPIO.HIGH)
+        board.simulate_input_state_change(11, GPIO.LOW)
+    timer = threading.Timer(0.05, pulse)
+    timer.start()
+    assert board.wait_for_edge(11, GPIO.RISING, timeout=1000) == 11
+    timer.join()
+
+
+@pytest.mark.timeout(10)
+def test_many_threads_no_lost_or_reordered_edges(board):
+    """Dozens of 'sensors', each toggled from its own thread."""
+    pins = [3, 5, 8, 10, 12, 13, 15, 16, 18, 19, 21, 22, 23, 24]
+    toggles = 1000
+    seen = {pin: [] for pin in pins}
+    for pin in pins:
+        board.setup(pin, GPIO.IN)
+        board.init_input_state(pin, GPIO.LOW)
+        for edge in (GPIO.RISING, GPIO.FALLING):
+            board.register_event_callback(
+                pin, edge, lambda p=pin, e=edge: seen[p].append(e))
+
+    def toggle(pin):
+        for i in range(toggles):
+            board.simulate_input_state_change(
+                pin, GPIO.HIGH if i % 2 == 0 else GPIO.LOW)
+
+    threads = [threading.Thread(target=toggle, args=(pin,)) for pin in pins]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    expected = [GPIO.RISING, GPIO.FALLING] * (toggles // 2)
+    for pin in pins:
+        assert seen[pin] == expected
@@ -0,0 +1,76 @@
+#!/usr/bin/python3
+"""Unit tests for the --profile mode."""
+
+import io
+import time
+import pytest
+from context import lolat, Client
+import calibrate_bucket
+import instrumentation
+from profiling import profile_cycles, StackSampler
+from drivers import simulated_sensor
+
+
+def test_profile_cycles_report():
+    sensor = simulated_sensor(1000)
+    kept = []
+    report = io.StringIO()
+    with sensor.open():
+        _, memory = profile_cycles(
+            lambda: kept.append(sensor.get_distance()), 4, file=report)
+    text = report.getvalue()
+    assert len(kept) == 4
+    assert len(memory) == 4
+    assert 'Profiled 4 cycles.' in text
+    assert 'functions by CPU time' in text
+    # The busy-wait is where the time goes.
+    assert '_get_pulse_round_trip_time' in text
+    assert 'allocation sites' in text
+    assert 'Memory in use after each cycle' in text
+
+
+def test_stack_sampler():
+    sampler = StackSampler(0.001)
+    sampler.start()
+    end = time.monotonic() + 0.05
+    while time.monotonic() < end:
+        pass
+    sampler.stop()
+    assert sum(sampler.stacks.values()) > 0
+    assert any('test_stack_sampler' in stack for stack in sampler.stacks)
+    line = sampler.collapsed().splitlines()[0]
+    assert line.rsplit(' ', 1)[1].isdigit()
+
+
+def test_lolat_main_profile(tmp_path, monkeypatch):
+    client = Client()
+    monkeypatch.setattr(lolat, 'make_client', lambda *args: client)
+    report = tmp_path / 'report.txt'
+    collapsed = tmp_path / 'stacks.txt'
+    try:
+        lolat.main(['--profile', '2', '--simulate', '800',
+                    '--no-instrumentation',
+                    '--profile-output', str(report),
+                    '--profile-sample', '0.001',
+                    '--profile-collapsed', str(collapsed)])
+    finally:
+        instrumentation.stats.enable(False)
+        instrumentation.stats.reset()
+    assert [values['reading'] for values in client.values()] == [800, 800]
+    text = report.read_text()
+    assert 'Profiled 2 cycles.' in text
+    assert 'stack samples' in text
+    assert 'sample_once' in collapsed.read_text()
+
+
+def test_calibrate_bucket_profile(capsys):
+    calibrate_bucket.main(['--profile', '2', '--simulate', '500'])
+    assert 'get_distance' in capsys.readouterr().out
+
+
+def test_profile_needs_a_cycle(capsys):
+    with pytest.raises(SystemExit):
+        calibrate_bucket.main(['--profile', '-1', '--simulate', '500'])
+    assert 'must be 1 or more' in capsys.readouterr().err
+    with pytest.raises(ValueError):
+        profile_cycles(lambda: None, 0, file=io.StringIO())
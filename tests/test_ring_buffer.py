@@ -0,0 +1,56 @@
+#!/usr/bin/python3
+"""Unit tests for the shared memory ring buffer."""
+
+import multiprocessing
+import pytest
+from context import lolat
+from ring_buffer import RingBuffer, MAX_TIMES
+
+
+def test_write_read():
+    with RingBuffer(4) as ring:
+        assert ring.read() == []
+        assert ring.write(10.0, [0.001, 0.002]) == 1
+        assert ring.write(11.0, [0.003]) == 2
+        assert ring.depth == 2
+        samples = ring.read()
+        assert ring.depth == 0
+        assert [(s.seq, s.time, s.round_trip_times) for s in samples] == \
+            [(1, 10.0, (0.001, 0.002)), (2, 11.0, (0.003,))]
+        assert ring.read() == []
+        assert ring.overruns == 0
+
+
+def test_lapped_reader_counts_overruns():
+    with RingBuffer(4) as ring:
+        for i in range(10):
+            ring.write(float(i), [i / 1000])
+        assert ring.depth == 4
+        samples = ring.read()
+        # Only the last 4 are still there.
+        assert [s.time for s in samples] == [6.0, 7.0, 8.0, 9.0]
+        assert ring.overruns == 6
+
+
+def test_too_many_times():
+    with RingBuffer(4) as ring:
+        with pytest.raises(ValueError):
+            ring.write(0.0, [0.001] * (MAX_TIMES + 1))
+
+
+def _write_in_child(name, count):
+    ring = RingBuffer(8, name=name)
+    for i in range(count):
+        ring.write(float(i), [i / 1000] * 5)
+    ring.close()
+
+
+def test_shared_between_processes():
+    with RingBuffer(8) as ring:
+        process = multiprocessing.get_context('fork').Process(
+            target=_write_in_child, args=(ring.name, 5))
+        process.start()
+        process.join(5)
+        samples = ring.read()
+        assert [s.seq for s in samples] == [1, 2, 3, 4, 5]
+        assert samples[4].round_trip_times == (0.004,) * 5
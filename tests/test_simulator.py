@@ -0,0 +1,101 @@
+#!/usr/bin/python3
+"""Unit tests for the virtual clock HC-SR04 simulator."""
+
+import time
+import pytest
+from context import lolat, virtual_sensor
+from simulator import (VirtualClock, EchoProfile, ScriptedProfile, Echo,
+                       distance_to_time, ECHO_TIMEOUT)
+
+
+def test_virtual_clock():
+    clock = VirtualClock(100)
+    clock.sleep(1.5)
+    assert clock.time() == 101.5
+    clock.advance_to(50)
+    assert clock.time() == 101.5
+    with pytest.raises(ValueError):
+        clock.sleep(-1)
+
+
+@pytest.mark.parametrize('distance', [30, 100, 1234, 4000])
+def test_exact_distances(distance):
+    sensor = virtual_sensor(EchoProfile(distance))
+    board = sensor._gpio
+    with sensor.open():
+        assert sensor.get_distance() == distance
+    assert board.pulses == 5
+
+
+def test_round_trip_time():
+    sensor = virtual_sensor(ScriptedProfile([1000, None]))
+    with sensor.open():
+        assert sensor._get_pulse_round_trip_time() == \
+            pytest.approx(distance_to_time(1000))
+        assert sensor._get_pulse_round_trip_time() == \
+            pytest.approx(ECHO_TIMEOUT)
+
+
+def test_poll_time_quantises():
+    """Modelling the cost of a pin read limits the timing resolution."""
+    sensor = virtual_sensor(EchoProfile(1000),
+                            board_options={'poll_time': 20e-6})
+    with sensor.open():
+        assert abs(sensor.get_distance() - 1000) <= 343000 * 20e-6
+
+
+def test_deterministic():
+    """The same seed gives the same readings, noise and faults included."""
+    def run(seed):
+        profile = EchoProfile(1000, noise=5, missing=0.05, stray=0.05,
+                              seed=seed)
+        sensor = virtual_sensor(profile)
+        results = []
+        with sensor.open():
+            for _ in range(50):
+                try:
+                    results.append(sensor.get_distance())
+                except sensor.InvalidDistanceError as e:
+                    results.append(e.message)
+        return results
+    assert run(1) == run(1)
+    assert run(1) != run(2)
+
+
+def test_moving_surface():
+    """Distance can be a function of virtual time."""
+    sensor = virtual_sensor(EchoProfile(lambda now: 1000 + 10 * now))
+    clock = sensor._clock
+    with sensor.open():
+        first = sensor.get_distance()
+        clock.sleep(60)
+        assert sensor.get_distance() - first == pytest.approx(600, abs=5)
+
+
+def test_scripted_profile_repeats():
+    profile = ScriptedProfile([1, None, Echo(3, ((0, 1e-6),))])
+    echoes = [profile.next_echo(0) for _ in range(4)]
+    assert [e.distance for e in echoes] == [1, None, 3, 1]
+
+
+def test_wrong_pin_direction():
+    sensor = virtual_sensor(EchoProfile(1000))
+    board = sensor._gpio
+    with sensor.open():
+        with pytest.raises(ValueError):
+            board.input(sensor.PIN_TRIGGER)
+        with pytest.raises(ValueError):
+            board.output(sensor.PIN_ECHO, board.HIGH)
+
+
+@pytest.mark.timeout(10)
+def test_thousands_of_readings_per_second():
+    sensor = virtual_sensor(EchoProfile(1000, noise=2))
+    clock = sensor._clock
+    start = time.perf_counter()
+    with sensor.open():
+        for _ in range(2000):
+            sensor.get_distance()
+    assert time.perf_counter() - start < 2
+    # 2000 readings of 5 pulses, each with a 60msec settle.
+    assert clock.time() > 2000 * 5 * 0.06
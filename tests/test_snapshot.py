@@ -0,0 +1,98 @@
+#!/usr/bin/python3
+"""Unit tests for warm start snapshots."""
+
+import json
+import time
+import pytest
+from context import lolat, Client, simulated_tank
+import snapshot
+from snapshot import SnapshotError, TankState
+from config import ConfigWatcher
+from metrics_server import Health
+
+
+def test_round_trip(tmp_path):
+    path = tmp_path / 'state'
+    states = {'bucket': TankState(900.0, 1000.5, 812, 1234, 1900.5),
+              'butt ü': TankState(60.0, 0.0, 0, 0, 1060.0)}
+    snapshot.save(str(path), states, 1001.0)
+    assert snapshot.load(str(path)) == (1001.0, states)
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_missing_and_corrupt(tmp_path):
+    path = tmp_path / 'state'
+    assert snapshot.load(str(path)) == (0.0, {})
+    data = snapshot.pack({'a': TankState(1.0, 2.0, 3, 4, 5.0)}, 6.0)
+    path.write_bytes(data[:-1])
+    with pytest.raises(SnapshotError, match='truncated'):
+        snapshot.load(str(path))
+    path.write_bytes(b'LOLATCAP' + data[8:])
+    with pytest.raises(SnapshotError, match='not a snapshot'):
+        snapshot.load(str(path))
+
+
+def _run(tmp_path, monkeypatch, max_samples):
+    client = Client()
+    monkeypatch.setattr(lolat, 'make_client', lambda *args: client)
+    health = Health()
+    lolat.run(ConfigWatcher(str(tmp_path / 'lolat.json')), health,
+              max_samples=max_samples, check_interval=0.005,
+              state_path=str(tmp_path / 'state'))
+    return client.readings(), health
+
+
+def test_restart_resumes(tmp_path, monkeypatch):
+    (tmp_path / 'lolat.json').write_text(json.dumps(
+        {'tanks': {'near': simulated_tank(500, 0.01),
+                   'far': simulated_tank(2000, 10)}}))
+    sent, _ = _run(tmp_path, monkeypatch, 3)
+    assert sent == [('near', 500), ('far', 2000), ('near', 500)]
+
+    # Restarted: far isn't due for another 10s, and its last sample is
+    # there from the start.
+    started = time.time()
+    sent, health = _run(tmp_path, monkeypatch, 2)
+    assert sent == [('near', 500)] * 2
+    far = health.tanks['far']
+    assert (far.reading, far.volume) == (2000, lolat.map_volume(2000))
+    assert far.time < started
+
+    # A new period takes effect straight away, from the last sample.
+    (tmp_path / 'lolat.json').write_text(json.dumps(
+        {'tanks': {'near': simulated_tank(500, 0.01),
+                   'far': simulated_tank(2000, 0.02)}}))
+    sent, _ = _run(tmp_path, monkeypatch, 2)
+    assert ('far', 2000) in sent
+
+
+def test_corrupt_snapshot_starts_cold(tmp_path, monkeypatch):
+    (tmp_path / 'lolat.json').write_text(json.dumps(
+        {'tanks': {'a': simulated_tank(500, 10)}}))
+    (tmp_path / 'state').write_bytes(b'garbage')
+    sent, _ = _run(tmp_path, monkeypatch, 1)
+    assert sent == [('a', 500)]
+    assert snapshot.load(str(tmp_path / 'state'))[1]['a'].reading == 500
+
+
+def test_restart_then_carry(tmp_path, monkeypatch):
+    (tmp_path / 'lolat.json').write_text(json.dumps(
+        {'tanks': {'a': simulated_tank(500, 0.01)}}))
+    sent, _ = _run(tmp_path, monkeypatch, 1)
+    assert sent == [('a', 500)]
+
+    # Restarted with every pulse missing: the restored reading is carried,
+    # as the same types as a good one or Influx would reject it.
+    tank = dict(simulated_tank(500, 0.01), on_invalid='carry', retries=0)
+    tank['sensor_options'] = dict(tank['sensor_options'], missing=1.0)
+    (tmp_path / 'lolat.json').write_text(json.dumps({'tanks': {'a': tank}}))
+    client = Client()
+    monkeypatch.setattr(lolat, 'make_client', lambda *args: client)
+    lolat.run(ConfigWatcher(str(tmp_path / 'lolat.json')), Health(),
+              max_samples=1, check_interval=0.005,
+              state_path=str(tmp_path / 'state'))
+    values, = client.values()
+    assert values == {'reading': 500, 'volume': lolat.map_volume(500),
+                      'quality': 'carried'}
+    assert type(values['reading']) is int
+    assert type(values['volume']) is int
@@ -0,0 +1,88 @@
+#!/usr/bin/python3
+"""Unit tests for sampling in a separate process (lolat.py --split)."""
+
+import time
+import pytest
+from context import lolat, Client, virtual_sensor
+import instrumentation
+from metrics_server import Health
+from drivers import simulated_sensor
+from simulator import ScriptedProfile
+from hc_sr04 import DistanceSensor
+from split_sampler import SplitSampler, consume
+
+
+@pytest.mark.timeout(10)
+def test_consume_samples_from_process():
+    sensor = simulated_sensor(1000)
+    got = []
+    with SplitSampler(sensor, period=0.01) as sampler:
+        consume(sampler, sensor, lambda *sample: got.append(sample),
+                poll_interval=0.001, max_samples=3)
+        assert sampler.process.is_alive()
+    assert not sampler.process.is_alive()
+    assert len(got) >= 3
+    for distance, sampled_at in got:
+        assert abs(distance - 1000) < 5
+        assert abs(sampled_at - time.time()) < 5
+
+
+@pytest.mark.timeout(10)
+def test_invalid_sample_is_none():
+    sensor = virtual_sensor(ScriptedProfile([20]))
+    got = []
+    with SplitSampler(sensor, period=0.01) as sampler:
+        consume(sampler, sensor, lambda *sample: got.append(sample),
+                poll_interval=0.001, max_samples=1)
+    assert got[0][0] is None
+
+
+@pytest.mark.timeout(10)
+def test_dead_sampler_raises():
+    # Never opened: a sensor with no GPIO fails in the sampler process.
+    sensor = DistanceSensor(gpio=object())
+    with SplitSampler(sensor, period=0.01) as sampler:
+        with pytest.raises(RuntimeError):
+            consume(sampler, sensor, lambda *sample: None,
+                    poll_interval=0.001, max_samples=1)
+
+
+@pytest.mark.timeout(10)
+def test_run_split_sends_with_sample_time(capsys):
+    client = Client()
+    health = Health(60)
+    before = time.time()
+    # No noise: the consumer may get more than 2 samples, and each must
+    # read exactly 800.
+    lolat.run_split(simulated_sensor(800, noise=0), client, health,
+                    period=0.01,
+                    max_samples=2)
+    points = [point for point in client.sent if point.measurement == 'lolat']
+    assert len(points) >= 2
+    for _, values, _, timestamp in points:
+        assert values['reading'] == 800
+        assert values['volume'] == lolat.map_volume(800)
+        assert before * 1e9 <= timestamp <= time.time() * 1e9
+    assert health.tanks['bucket'].reading == 800
+    assert health.cycles >= 2
+
+
+@pytest.mark.timeout(10)
+def test_run_split_publishes_ring_buffer_stats():
+    client = Client()
+    health = Health(60)
+    instrumentation.stats.reset()
+    instrumentation.stats.enable()
+    try:
+        lolat.run_split(simulated_sensor(800, noise=0), client, health,
+                        period=0.01, max_samples=2)
+    finally:
+        instrumentation.stats.enable(False)
+        instrumentation.stats.reset()
+    internal = client.values('lolat_internal')
+    # One per batch, however many samples were in it.
+    assert 1 <= len(internal) <= 2
+    for values in internal:
+        assert values['ring_depth'] >= 1
+        assert values['overruns'] == 0
+    assert health.queue_depth >= 1
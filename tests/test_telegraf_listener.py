@@ -0,0 +1,84 @@
+#!/usr/bin/python3
+"""Tests for the Telegraf stand-in, and lolat.insert_data against it."""
+
+import socket
+import time
+import pytest
+from context import lolat
+from line_protocol import SocketClient
+from telegraf_listener import TelegrafListener, load_insert_data
+
+
+@pytest.fixture
+def listener():
+    with TelegrafListener(port=0, keep_points=True) as listener:
+        yield listener
+
+
+def _send(listener, text, protocol=socket.SOCK_DGRAM):
+    with socket.socket(socket.AF_INET, protocol) as sock:
+        sock.connect((listener.host, listener.port))
+        sock.sendall(text.encode())
+
+
+@pytest.mark.timeout(5)
+def test_validates_lines(listener):
+    _send(listener, 'lolat reading=1i,volume=2i\n'
+                    'lolat reading=oops\n'
+                    'lolat reading=1.5\n'  # Type conflict with the first.
+                    'lolat,src=bucket reading=3i 10\n')
+    assert listener.wait_for(2, timeout=2)
+    time.sleep(0.05)
+    stats = listener.stats()
+    assert (stats['accepted'], stats['rejected']) == (2, 2)
+    assert listener.points[1] == ('lolat', {'src': 'bucket'},
+                                  {'reading': 3}, 10)
+
+
+@pytest.mark.timeout(5)
+def test_drops_and_reordering(listener):
+    lines = [f'lolat seq={seq}i {seq}\n' for seq in (1, 2, 4, 5, 3, 8)]
+    _send(listener, ''.join(lines), socket.SOCK_STREAM)
+    assert listener.wait_for(6, timeout=2)
+    stats = listener.stats()
+    # 3 arrived late. 6 and 7 never arrived.
+    assert (stats['dropped'], stats['reordered']) == (2, 1)
+    assert stats['duplicates'] == 0
+
+
+@pytest.mark.timeout(5)
+def test_duplicates(listener):
+    lines = [f'lolat seq={seq}i {seq}\n' for seq in (1, 2, 2, 4)]
+    _send(listener, ''.join(lines), socket.SOCK_STREAM)
+    assert listener.wait_for(4, timeout=2)
+    stats = listener.stats()
+    # The second 2 doesn't hide that 3 was lost.
+    assert (stats['dropped'], stats['reordered'],
+            stats['duplicates']) == (1, 0, 1)
+
+
+@pytest.mark.timeout(5)
+@pytest.mark.parametrize('protocol', ['udp', 'tcp'])
+def test_insert_data_end_to_end(listener, protocol):
+    sent, failed, _ = load_insert_data(listener, 200, protocol)
+    assert (sent, failed) == (200, 0)
+    assert listener.wait_for(200, timeout=2)
+    assert listener.points[0] == ('lolat', {'src': 'bucket'},
+                                  {'reading': 0, 'volume': 0,
+                                   'quality': 'good'}, None)
+
+
+@pytest.mark.timeout(5)
+def test_outage(listener):
+    client = SocketClient(listener.host, listener.port, protocol='tcp')
+    listener.outage(0.2)
+    with pytest.raises(OSError):
+        for _ in range(10):
+            client.metric('lolat', {'reading': 1})
+            time.sleep(0.01)
+    time.sleep(0.4)
+    assert listener.is_up
+    client = SocketClient(listener.host, listener.port, protocol='tcp')
+    client.metric('lolat', {'reading': 1})
+    assert listener.wait_for(1, timeout=2)
+    client.close()